@@ -0,0 +1,114 @@
+''' asynchronous access log.
+    the server loop only appends the request fields to a bounded
+    queue, a background thread formats the lines and writes them
+    in batches. when the queue is full lines are dropped and counted
+    instead of blocking the loop.
+'''
+import collections
+import sys
+import threading
+import time
+
+
+class AsyncAccessLog:
+    QUEUE_SIZE = 10000
+    # write when this many lines are waiting, or every INTERVAL seconds
+    BATCH = 512
+    INTERVAL = 0.5
+
+    def __init__(self, path=None, queue_size=None):
+        self.path = path if path not in (None, '', '-') else None
+        self.queue = collections.deque()
+        self.queue_size = queue_size or self.QUEUE_SIZE
+        # lines dropped because the queue was full (counted in the
+        # server loop) or the write failed (counted in the writer)
+        self.overflow = 0
+        self.failed = 0
+        self._reported = 0
+        self._reopen = False
+        self._date = (0, '')
+        self.event = threading.Event()
+        self.stream = self.open()
+        self.thread = None
+        self.stopped = False
+
+    def open(self):
+        if self.path:
+            return open(self.path, 'a')
+        return sys.stderr
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run,
+                                       name='boring-access-log',
+                                       daemon=True)
+        self.thread.start()
+
+    def access(self, req=None, resp=None):
+        ''' called in the server loop '''
+        if len(self.queue) >= self.queue_size:
+            self.overflow += 1
+            return
+        if req:
+            entry = (time.time(), req.remote_addr, req.method, req.uri,
+                     req.proto, resp.code if resp else '')
+        else:
+            entry = (time.time(), '', '', '', '', '')
+        self.queue.append(entry)
+        if len(self.queue) >= self.BATCH:
+            self.event.set()
+
+    @property
+    def dropped(self):
+        return self.overflow + self.failed
+
+    def reopen(self):
+        ''' reopen the log file, safe to call from a signal handler '''
+        self._reopen = True
+
+    def format_date(self, now):
+        second = int(now)
+        if self._date[0] != second:
+            self._date = (second, time.strftime('%d/%m/%Y %H:%M:%S %p',
+                                                time.localtime(second)))
+        return self._date[1]
+
+    def run(self):
+        while not self.stopped:
+            self.event.wait(self.INTERVAL)
+            self.event.clear()
+            self.flush()
+
+    def flush(self):
+        if self._reopen:
+            self._reopen = False
+            if self.path:
+                old, self.stream = self.stream, self.open()
+                old.close()
+        queue = self.queue
+        lines = []
+        while queue:
+            now, addr, method, path, proto, code = queue.popleft()
+            lines.append(' %s -- [%s] %s %s %s %s -- \n' %
+                         (addr, self.format_date(now), method, path, proto,
+                          code))
+        dropped = self.dropped
+        if dropped != self._reported:
+            lines.append('[WARNING] %s access log lines dropped\n' %
+                         (dropped - self._reported))
+            self._reported = dropped
+        if not lines:
+            return
+        try:
+            self.stream.write(''.join(lines))
+            self.stream.flush()
+        except (OSError, ValueError):
+            self.failed += len(lines)
+
+    def close(self):
+        self.stopped = True
+        self.event.set()
+        if self.thread:
+            self.thread.join(1)
+        self.flush()
+        if self.path:
+            self.stream.close()
@@ -0,0 +1,8 @@
+''' load generation benchmarks for boring.
+
+    python -m boring.bench --duration 5 --json result.json
+
+    starts the server on a local port with the reference apps in
+    boring.bench.apps and measures req/s and latency percentiles
+    for keep-alive, non keep-alive and pipelined connections.
+'''
@@ -0,0 +1,173 @@
+''' run the benchmark suite.
+
+    python -m boring.bench [--duration 5] [--connections 50] [--json FILE]
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from boring import __version__
+from boring.bench import loadgen
+
+MODES = ('keepalive', 'close', 'pipelined')
+
+# name -> (app, path, request options)
+SCENARIOS = {
+    'hello': ('boring.bench.apps:hello', '/', {}),
+    'stream': ('boring.bench.apps:stream', '/', {}),
+    'upload': ('boring.bench.apps:upload', '/', {
+        'method': 'POST',
+        'body': b'u' * 262144,
+        'chunked': True
+    }),
+    'static': ('boring.bench.apps:hello', '/static/bench.js', {}),
+    'listing': ('.', '/', {}),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare_dir(root):
+    ''' files for the static and directory listing scenarios '''
+    static = os.path.join(root, 'static')
+    os.makedirs(static)
+    with open(os.path.join(static, 'bench.js'), 'wb') as f:
+        f.write(b'var boring = "bench";\n' * 2048)
+    for i in range(200):
+        with open(os.path.join(root, 'file-%03d.txt' % i), 'w') as f:
+            f.write('%s\n' % i)
+    with open(os.path.join(root, 'boring.config'), 'w') as f:
+        f.write('STATIC_URL=/static/\nSTATIC_ROOT=%s\n' % static)
+
+
+def start_server(app, port, root, extra_args):
+    env = os.environ.copy()
+    package_dir = os.path.dirname(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [package_dir, env.get('PYTHONPATH')]))
+    argv = [sys.executable, '-m', 'boring', app, '-b', '127.0.0.1',
+            '-p', str(port), '--use-config'] + extra_args
+    proc = subprocess.Popen(argv, cwd=root, env=env,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('server exited with code %s' % proc.returncode)
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError('server did not start')
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def run(args):
+    root = tempfile.mkdtemp(prefix='boring-bench-')
+    results = []
+    try:
+        prepare_dir(root)
+        for name in args.scenarios:
+            app, path, options = SCENARIOS[name]
+            port = free_port()
+            proc = start_server(app, port, root, args.server_args)
+            try:
+                for mode in args.modes:
+                    request = loadgen.build_request(
+                        path, keepalive=mode != 'close', **options)
+                    stats = loadgen.load('127.0.0.1', port, request, mode,
+                                         args.connections, args.duration,
+                                         args.depth)
+                    result = {'scenario': name, 'mode': mode}
+                    result.update(stats.summary())
+                    results.append(result)
+                    print_result(result)
+            finally:
+                stop_server(proc)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def print_result(result):
+    latency = result['latency_ms']
+    print('%-8s %-10s %10s %10s %10s %10s %7s' %
+          (result['scenario'], result['mode'], result['rps'], latency['p50'],
+           latency['p99'], latency['p999'], result['errors']))
+    sys.stdout.flush()
+
+
+def create_args():
+    parser = argparse.ArgumentParser(prog='python -m boring.bench')
+    parser.add_argument('--duration', type=float, default=3,
+                        help='seconds to run every scenario, default 3')
+    parser.add_argument('-c', '--connections', type=int, default=50,
+                        help='concurrent connections, default 50')
+    parser.add_argument('--depth', type=int, default=10,
+                        help='requests per batch in pipelined mode, default 10')
+    parser.add_argument('--scenario', dest='scenarios', action='append',
+                        choices=sorted(SCENARIOS),
+                        help='scenario to run, can be repeated, default all')
+    parser.add_argument('--mode', dest='modes', action='append',
+                        choices=MODES,
+                        help='connection mode, can be repeated, default all')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('server_args', nargs=argparse.REMAINDER,
+                        help='extra options for the server, after --')
+    args = parser.parse_args()
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    args.modes = args.modes or list(MODES)
+    if args.server_args[:1] == ['--']:
+        args.server_args = args.server_args[1:]
+    return args
+
+
+def main():
+    args = create_args()
+    print('%-8s %-10s %10s %10s %10s %10s %7s' %
+          ('scenario', 'mode', 'req/s', 'p50 ms', 'p99 ms', 'p999 ms',
+           'errors'))
+    results = run(args)
+    if args.json:
+        report = {
+            'version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'options': {
+                'duration': args.duration,
+                'connections': args.connections,
+                'depth': args.depth,
+                'server_args': args.server_args,
+            },
+            'results': results,
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('results written to', args.json)
+
+
+if __name__ == '__main__':
+    main()
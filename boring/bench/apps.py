@@ -0,0 +1,37 @@
+''' reference wsgi apps used by the benchmarks '''
+
+STREAM_CHUNK = b'x' * 65536
+STREAM_CHUNKS = 16  # 1MB response
+
+
+def hello(environ, start_response):
+    body = b'Hello, World!'
+    start_response('200 OK', [('Content-Type', 'text/plain'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def stream(environ, start_response):
+    ''' large body without content-length, sent chunked '''
+    start_response('200 OK', [('Content-Type', 'application/octet-stream')])
+
+    def body():
+        for _ in range(STREAM_CHUNKS):
+            yield STREAM_CHUNK
+
+    return body()
+
+
+def upload(environ, start_response):
+    ''' read the whole request body, returns its size '''
+    size = 0
+    inp = environ['wsgi.input']
+    while 1:
+        data = inp.read(65536)
+        if not data:
+            break
+        size += len(data)
+    body = str(size).encode()
+    start_response('200 OK', [('Content-Type', 'text/plain'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
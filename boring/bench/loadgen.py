@@ -0,0 +1,151 @@
+''' asyncio http load generator.
+    every client keeps one connection open (or reconnects for every
+    request), sends requests and measures the time till the response
+    has been read completely.
+'''
+import asyncio
+import math
+import time
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.bytes_read = 0
+        self.start = 0
+        self.end = 0
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0
+        latencies = sorted(self.latencies)
+        index = max(0, math.ceil(p * len(latencies)) - 1)
+        return latencies[index]
+
+    def summary(self):
+        duration = (self.end - self.start) or 1e-9
+        count = len(self.latencies)
+        ms = lambda v: round(v * 1000, 3)
+        latencies = sorted(self.latencies)
+        return {
+            'requests': count,
+            'errors': self.errors,
+            'duration': round(duration, 3),
+            'rps': round(count / duration, 1),
+            'bytes_read': self.bytes_read,
+            'latency_ms': {
+                'mean': ms(sum(latencies) / count) if count else 0,
+                'p50': ms(self.percentile(0.50)),
+                'p99': ms(self.percentile(0.99)),
+                'p999': ms(self.percentile(0.999)),
+                'max': ms(latencies[-1]) if count else 0,
+            }
+        }
+
+
+def build_request(path='/', method='GET', body=None, chunked=False,
+                  keepalive=True):
+    headers = ['%s %s HTTP/1.1' % (method, path), 'Host: localhost',
+               'Connection: %s' % ('keep-alive' if keepalive else 'close')]
+    payload = b''
+    if body is not None:
+        if chunked:
+            headers.append('Transfer-Encoding: chunked')
+            step = 16384
+            parts = []
+            for i in range(0, len(body), step):
+                part = body[i:i + step]
+                parts.append(b'%x\r\n%s\r\n' % (len(part), part))
+            parts.append(b'0\r\n\r\n')
+            payload = b''.join(parts)
+        else:
+            headers.append('Content-Length: %s' % len(body))
+            payload = body
+    return ('\r\n'.join(headers) + '\r\n\r\n').encode() + payload
+
+
+async def read_response(reader):
+    ''' read one response, returns the number of bytes read and
+        whether the server will close the connection.
+    '''
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = lines[0].split()
+    if len(status) < 2 or not status[1].isdigit():
+        raise ValueError('bad status line %r' % lines[0])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            k, v = line.split(':', 1)
+            headers[k.strip().lower()] = v.strip()
+    size = len(head)
+    close = headers.get('connection', '').lower() == 'close'
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while 1:
+            line = await reader.readuntil(b'\r\n')
+            chunk = int(line.split(b';')[0], 16)
+            data = await reader.readexactly(chunk + 2)
+            size += len(line) + len(data)
+            if not chunk:
+                break
+    elif 'content-length' in headers:
+        data = await reader.readexactly(int(headers['content-length']))
+        size += len(data)
+    elif status[1] not in ('204', '304'):
+        data = await reader.read()
+        size += len(data)
+        close = True
+    return size, close
+
+
+async def client(host, port, request, mode, depth, deadline, stats):
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            stats.errors += 1
+            await asyncio.sleep(0.01)
+            continue
+        try:
+            while time.monotonic() < deadline:
+                count = depth if mode == 'pipelined' else 1
+                start = time.monotonic()
+                writer.write(request * count)
+                await writer.drain()
+                close = False
+                for _ in range(count):
+                    size, close = await read_response(reader)
+                    stats.latencies.append(time.monotonic() - start)
+                    stats.bytes_read += size
+                if mode == 'close' or close:
+                    break
+        except (OSError, ValueError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError):
+            stats.errors += 1
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+
+async def run_load(host, port, request, mode='keepalive', connections=50,
+                   duration=5, depth=10):
+    ''' run `connections` clients for `duration` seconds.
+        mode is keepalive, close or pipelined.
+    '''
+    stats = Stats()
+    stats.start = time.monotonic()
+    deadline = stats.start + duration
+    await asyncio.gather(*[
+        client(host, port, request, mode, depth, deadline, stats)
+        for _ in range(connections)
+    ])
+    stats.end = time.monotonic()
+    return stats
+
+
+def load(*args, **kwargs):
+    return asyncio.run(run_load(*args, **kwargs))
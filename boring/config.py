@@ -40,9 +40,28 @@ class Config:
             if not self.args:
                 # the server is not started from command line
                 return ''
-            return getattr(self.args, name, '')
+            # options in config file are upper case (WORKERS=4),
+            # command line options are lower case (--workers 4)
+            value = getattr(self.args, name, None)
+            if value is None:
+                value = getattr(self.args, name.lower(), None)
+            return '' if value is None else value
         return value
 
+    def get(self, name, default=None, cast=None):
+        ''' return option `name` converted with `cast`,
+            `default` is returned if the option is not set.
+        '''
+        value = self[name]
+        if value == '' or value is None:
+            return default
+        if cast is None:
+            return value
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            raise BadConfigFile('invalid value for %s: %r' % (name, value))
+
     def __setitem__(self, key, value):
         self._options[key] = value
 
@@ -63,6 +82,9 @@ class DummyConfig:
     def __setitem__(self, *args):
         pass
 
+    def get(self, name, default=None, cast=None):
+        return default
+
     __getattr__ = __getitem__
 
     def __bool__(self):
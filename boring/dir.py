@@ -3,37 +3,111 @@
 
 '''
 
+import collections
+import html
 import mimetypes
 import os
+import threading
+import time
+import urllib.parse
 
 from boring.exception import BadRequest
-from boring.http import Response
+from boring.http import FileWrapper, Response
+from boring.ranges import (not_satisfiable_headers, range_response,
+                           select_ranges)
 
 from . import utils
 
-TEMPLATE = '''
-<h1> Directory listing for /{current_path}/</h1>
+TEMPLATE_HEAD = '''
+<h1> Directory listing for /{current_path}</h1>
+{nav}
 <table style="border-spacing:15px 0px;">
   <tr>
-    <th><h2>files</h2></th>
-    <th> <h2>size</h2> </th>
-    <th> <h2> Type </h2>
+    <th><h2><a href="?{sort_name}">files</a></h2></th>
+    <th> <h2><a href="?{sort_size}">size</a></h2> </th>
+    <th> <h2><a href="?{sort_type}">Type</a></h2>
   </tr>
   <tr><th><hr></th></tr>
+'''
 
-      {paths}
+TEMPLATE_ROW = '''
+                <tr>
+                    <td style="font-size: 30px;">
+                        <a href="{href}">{name}</a>
+                    </td>
+                    <td>
+                       {size} KB
+                    </td>
+                    <td>
+                    {type}
+                    </td>
+                </tr>
+'''
+
+TEMPLATE_FOOT = '''
 </table>
+{nav}
 '''
 
 
+class ListingCache:
+    ''' rendered directory listings, keyed by directory and query.
+        an entry is valid as long as the directory mtime doesn't
+        change, that is till an entry is added, removed or renamed.
+    '''
+    SIZE = 64
+
+    def __init__(self, size=None):
+        self.size = self.SIZE if size is None else size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, mtime):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != mtime:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, mtime, body):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (mtime, body)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
 class DirectoryServer:
+    SORT_KEYS = {
+        'name': lambda e: e[0],
+        'size': lambda e: e[2],
+        # folders first
+        'type': lambda e: (not e[1], e[0]),
+    }
+    # entries per page when ?page= is used
+    PER_PAGE = 1000
+    MAX_PER_PAGE = 10000
+    # bigger listings are streamed and not cached
+    STREAM_ENTRIES = 5000
+    ROWS_PER_BLOCK = 500
+
     def __init__(self, conn, request, server):
         self.log = server.log
-        self.resp = Response(request, conn)
+        self.resp = Response(request, conn, server.write_buffer,
+                             server.coalesce_size)
+        server.set_keep_alive(self.resp)
+        self.broken = False
         self.request = request
         self.base_dir = os.path.abspath(os.getcwd())
         self.server = server
         self.conn = conn
+        self.started = time.monotonic()
 
     def serve(self):
         path = self.request.path.replace('/', '', 1)
@@ -41,9 +115,8 @@ class DirectoryServer:
             # avoid revealing system root directory
             raise BadRequest()
         if path == '':
-            path = '.'
-            resp = self.listdir(path)
-        if os.path.exists(path):
+            resp = self.listdir('.')
+        elif os.path.exists(path):
             if os.path.isfile(path):
                 resp = self.open_file(path)
             else:
@@ -59,11 +132,25 @@ class DirectoryServer:
         try:
             self.serve()
         except OSError as e:
+            if self.resp.headers_sent:
+                raise
             self.resp.start_response('403 Forbidden',
                                      [('Content-Length', len(str(e)))])
             r = [str(e).encode()]
             self.resp.write_response(r)
+        self.server.finish_response(self)
+
+    def finish(self):
+        self.resp.close()
         self.log.access(self.request, self.resp)
+        if self.server.metrics:
+            self.server.metrics.observe(self)
+        # the request body is never read here
+        if (self.broken or not self.resp.keep_alive
+                or not self.request.parser.body_done):
+            self.server.close_connection(self.conn)
+        else:
+            self.server.reuse_connection(self.conn, self.request)
 
     def check_modify(self):
         pass
@@ -72,33 +159,60 @@ class DirectoryServer:
         self.resp.start_response('404 Not Found', [])
         return b'file not found %s' % path.encode(),
 
-    def listdir(self, path):
-        links = []
-        if path == '.':
-            directory = os.listdir()
-        else:
-            directory = os.listdir(path)
-        for p in directory:
-            abspath = os.path.join(path, p)
-            _type = 'file' if os.path.isfile(abspath) else 'folder'
-            links.append('''
-                <tr>
-                    <td style="font-size: 30px;">
-                        <a href="/%s">%s</a>
-                    </td>
-                    <td> 
-                       %s KB 
-                    </td>
-                    <td>
-                    %s
-                    </td>
-                </tr>
-                    ''' %
-                         (abspath, p, os.stat(abspath).st_size // 1024, _type))
+    def list_options(self):
+        ''' sort and page options from the query string '''
+        query = urllib.parse.parse_qs(self.request.query)
+        sort = query.get('sort', ['name'])[0]
+        if sort not in self.SORT_KEYS:
+            sort = 'name'
+        order = query.get('order', ['asc'])[0]
+        if order not in ('asc', 'desc'):
+            order = 'asc'
+        try:
+            page = max(int(query.get('page', [0])[0]), 0)
+            per_page = int(query.get('per_page', [self.PER_PAGE])[0])
+            per_page = min(max(per_page, 1), self.MAX_PER_PAGE)
+        except ValueError:
+            page, per_page = 0, self.PER_PAGE
+        return sort, order, page, per_page
 
-        links = '\n'.join(links)
-        res = TEMPLATE.format(paths=links, current_path=path)
-        res = res.encode()
+    def scan(self, path):
+        ''' (name, is_dir, size) of every entry, one scandir pass '''
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                    size = entry.stat().st_size
+                except OSError:
+                    # broken symlink or removed meanwhile
+                    is_dir, size = False, 0
+                entries.append((entry.name, is_dir, size))
+        return entries
+
+    def listdir(self, path):
+        sort, order, page, per_page = self.list_options()
+        mtime = os.stat(path).st_mtime_ns
+        cache = self.server.listing_cache
+        key = (os.path.abspath(path), sort, order, page, per_page)
+        res = cache.get(key, mtime) if cache else None
+        if res is None:
+            entries = self.scan(path)
+            entries.sort(key=self.SORT_KEYS[sort], reverse=order == 'desc')
+            pages = 0
+            if page:
+                pages = max((len(entries) + per_page - 1) // per_page, 1)
+                entries = entries[(page - 1) * per_page:page * per_page]
+            body = self.render(path, entries, sort, order, page, pages,
+                               per_page)
+            if len(entries) > self.STREAM_ENTRIES:
+                # too big to keep in memory, send it as it is rendered
+                self.resp.start_response('200 OK',
+                                         [("Content-Type", 'text/html')])
+                return body
+            res = b''.join(body)
+            if cache:
+                cache.set(key, mtime, res)
         header = [
             ("Content-Type", 'text/html'),
             ('Content-Length', len(res)),
@@ -106,19 +220,74 @@ class DirectoryServer:
         self.resp.start_response('200 OK', header)
         return [res]
 
+    def render(self, path, entries, sort, order, page, pages, per_page):
+        ''' generate the listing page in blocks of ROWS_PER_BLOCK rows '''
+        current = '' if path == '.' else path.rstrip('/')
+        base = '/' + urllib.parse.quote(current + '/' if current else '',
+                                        errors='surrogateescape')
+        nav = ''
+        if pages:
+            links = []
+            for label, number in (('previous', page - 1), ('next', page + 1)):
+                if 1 <= number <= pages:
+                    query = urllib.parse.urlencode({
+                        'sort': sort, 'order': order, 'page': number,
+                        'per_page': per_page})
+                    links.append('<a href="?%s">%s</a>' %
+                                 (html.escape(query), label))
+            nav = '<p>page %s of %s %s</p>' % (page, pages, ' '.join(links))
+        sort_links = {}
+        for name in self.SORT_KEYS:
+            # clicking the current sort column reverses the order
+            new_order = 'desc' if name == sort and order == 'asc' else 'asc'
+            sort_links['sort_' + name] = html.escape(urllib.parse.urlencode(
+                {'sort': name, 'order': new_order}))
+        yield TEMPLATE_HEAD.format(
+            current_path=html.escape(current + '/' if current else ''),
+            nav=nav, **sort_links).encode('utf-8', 'surrogateescape')
+        rows = []
+        for name, is_dir, size in entries:
+            rows.append(TEMPLATE_ROW.format(
+                href=base + urllib.parse.quote(name, errors='surrogateescape'),
+                name=html.escape(name), size=size // 1024,
+                type='folder' if is_dir else 'file'))
+            if len(rows) >= self.ROWS_PER_BLOCK:
+                yield ''.join(rows).encode('utf-8', 'surrogateescape')
+                rows = []
+        if rows:
+            yield ''.join(rows).encode('utf-8', 'surrogateescape')
+        yield TEMPLATE_FOOT.format(nav=nav).encode()
+
     def open_file(self, path):
 
-        length = os.stat(path).st_size
-        header = []
+        stat = os.stat(path)
+        length = stat.st_size
+        last_modified = utils.http_date(stat.st_mtime)
+        header = [('Last-Modified', last_modified), ('Accept-Ranges', 'bytes')]
         filetype, enc = mimetypes.guess_type(path)
         if filetype:
             if enc:
                 filetype = filetype + ', charset=%s' % enc
+        headers = self.request.headers
+        ranges = select_ranges(headers.get('Range'), headers.get('If-Range'),
+                               length, last_modified=last_modified)
+        if ranges == []:
+            self.resp.start_response('416 Range Not Satisfiable',
+                                     header + not_satisfiable_headers(length))
+            return [b'']
+        file = open(path, 'rb')
+        if ranges:
+            range_headers, body = range_response(file, ranges, length,
+                                                 filetype)
+            self.resp.start_response('206 Partial Content',
+                                     header + range_headers)
+            return body
+        if filetype:
             header.append(('Content-Type', filetype))
         header.append(("Content-Length", str(length)))
         self.resp.start_response('200 OK', header)
 
-        return open(path, 'rb')
+        return FileWrapper(file)
 
 
 # if __name__ == '__main__':
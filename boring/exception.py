@@ -45,3 +45,15 @@ class BadRequest(HttpException):
 
 class InvalidHeader(BadRequest):
     pass
+
+
+class HeaderTooLarge(HttpException):
+    body = 'Request Header Fields Too Large'
+    code = 431
+    reason = "Request Header Fields Too Large"
+
+
+class UnknownEncoding(HttpException):
+    body = 'Not Implemented'
+    code = 501
+    reason = "Not Implemented"
@@ -0,0 +1,74 @@
+''' http headers.
+    one container for the request headers (built by the parser) and
+    the response headers (built by start_response). the fields are
+    kept in order in a list of (name, value), lookups go through an
+    index by lower case name so they are case-insensitive and don't
+    scan the list.
+'''
+
+
+class Headers:
+    __slots__ = ('fields', 'index')
+
+    def __init__(self, fields=()):
+        self.fields = []
+        # lower case name -> values, in order
+        self.index = {}
+        self.extend(fields)
+
+    def add(self, name, value):
+        self.fields.append((name, value))
+        key = name.lower()
+        values = self.index.get(key)
+        if values is None:
+            self.index[key] = [value]
+        else:
+            values.append(value)
+
+    def append(self, field):
+        self.add(*field)
+
+    def extend(self, fields):
+        for name, value in fields:
+            self.add(name, value)
+
+    def get(self, name, default=None):
+        ''' the value of the field, the values of a field sent more
+            than once are joined with ', ' (rfc 7230 3.2.2).
+        '''
+        values = self.index.get(name.lower())
+        if values is None:
+            return default
+        if len(values) == 1:
+            return values[0]
+        return ', '.join(values)
+
+    def get_all(self, name):
+        return list(self.index.get(name.lower(), ()))
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name):
+        return name.lower() in self.index
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __bool__(self):
+        return bool(self.fields)
+
+    def items(self):
+        return list(self.fields)
+
+    def keys(self):
+        return [name for name, _ in self.fields]
+
+    def __repr__(self):
+        return 'Headers(%r)' % self.fields
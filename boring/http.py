@@ -1,68 +1,159 @@
+import collections
+import copy
+import errno
 import io
+import itertools
+import os
+import re
+import selectors
+import tempfile
+import threading
 import time
+import traceback
 import urllib.parse
 import socket
 from boring import __version__
-from boring.exception import BadRequest, InvalidHeader
+from boring.exception import (BadRequest, HeaderTooLarge, InvalidHeader,
+                              UnknownEncoding)
+from boring.headers import Headers
 from boring.utils import http_date
 
 
 class Request:
-    def __init__(self, parser, conn=None):
+    ''' the request line is split when the request is created, the
+        uri is unquoted the first time it is used, many apps never
+        look at it.
+    '''
+    __slots__ = ('parser', 'addr', 'remote_addr', 'remote_port', 'method',
+                 'raw_uri', 'proto', 'scheme', '_uri', '_path', '_query')
 
-        self._headers = {}
-        self.uri = ""
+    def __init__(self, parser, conn=None):
         self.parser = parser
         self.addr = parser.remote_addr  # (addr,port)
         self.remote_addr, self.remote_port = self.addr
         try:
-            self.method, self.uri, self.proto = parser.status_line.decode(
+            self.method, self.raw_uri, self.proto = parser.status_line.decode(
             ).split()
         except ValueError:
             raise BadRequest(400, "Invalid Status Line")
-        self.uri = urllib.parse.unquote(self.uri)
         self.scheme = 'http'
-        q = self.uri.find("?") > -1
-        self.query = ''
-        if q:
-            self.path, query = self.uri.split("?", 1)
-            self.query = urllib.parse.unquote(query)
-        else:
-            self.path = self.uri
+        self._uri = None
+        self._path = None
+        self._query = None
+
+    @property
+    def uri(self):
+        if self._uri is None:
+            self._uri = urllib.parse.unquote(self.raw_uri)
+        return self._uri
+
+    def split_uri(self):
+        path, q, query = self.uri.partition('?')
+        self._path = path
+        self._query = urllib.parse.unquote(query) if q else ''
+
+    @property
+    def path(self):
+        if self._path is None:
+            self.split_uri()
+        return self._path
+
+    @property
+    def query(self):
+        if self._query is None:
+            self.split_uri()
+        return self._query
 
     @property
     def headers(self):
-        if self._headers:
-            return self._headers
-        headers = {}
-        for k, v in self.parser.headers:
-            headers[k.decode()] = v.decode()
-        self._headers = headers
-        return headers
+        return self.parser.headers
 
     @property
-    def should_close(self):
-        c = self.headers.get("Connection")
-        if c and c.lower() == "close":
+    def keep_alive(self):
+        ''' the client wants a persistent connection (rfc 7230 6.3),
+            the default for HTTP/1.1, HTTP/1.0 has to ask for it.
+        '''
+        tokens = [t.strip() for t in
+                  self.headers.get("Connection", '').lower().split(',')]
+        if 'close' in tokens:
+            return False
+        if self.proto == 'HTTP/1.1':
             return True
-        return False
+        return self.proto == 'HTTP/1.0' and 'keep-alive' in tokens
+
+    @property
+    def should_close(self):
+        return not self.keep_alive
 
     @property
     def body(self):
         return self.parser.body
 
 
+class FileWrapper:
+    ''' wsgi.file_wrapper, responses wrapped with this class are
+        sent with os.sendfile() when the file has a file descriptor.
+    '''
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def fileno(self):
+        return self.filelike.fileno()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.filelike.read(self.blksize)
+        if data:
+            return data
+        raise StopIteration
+
+
 class Response:
-    def __init__(self, req, conn):
+    # how long to wait for a slow client to accept more data
+    SEND_TIMEOUT = 30
+    # stop pulling from the app when this much data is waiting
+    # to be sent, continue when the socket is writable again
+    HIGH_WATER = 65536
+    # file bodies up to this size are read and sent with the
+    # headers in one sendmsg() instead of a separate sendfile()
+    COALESCE_SIZE = 16384
+    IOV_MAX = 1024
+
+    def __init__(self, req, conn, high_water=None, coalesce_size=None):
 
         self.req = req
         self.conn = conn
-        self.headers = []
+        self.headers = Headers()
         self.code = None
         self.reason = ""
         self.sent = 0
         self.headers_set = False
         self.headers_sent = False
+        self.high_water = high_water or self.HIGH_WATER
+        if coalesce_size is None:
+            coalesce_size = self.COALESCE_SIZE
+        self.coalesce_size = coalesce_size
+        # outbound buffer, drained by flush()
+        self.out = collections.deque()
+        self.out_size = 0
+        self.bytes_sent = 0
+        self.last_write = time.monotonic()
+        self.data = None
+        # the connection is kept open after the response, the server
+        # sets it and the Keep-Alive header value (timeout, max)
+        self.keep_alive = req.keep_alive
+        self.keep_alive_params = None
+        self.body = None  # iterator of framed body chunks
+        # the app returned a list, there is no need to send each piece
+        # as soon as it is pulled
+        self.buffered = False
+        self.file = None  # (fileno, offset, end) for sendfile
+        self.finished = False
 
     def start_response(self, status, headers):
 
@@ -77,16 +168,13 @@ class Response:
         #self.headers = headers
 
     def get_length(self):
-        for name, value in self.headers:
-            if name.lower() == 'content-length':
-                return int(value)
-        return
+        length = self.headers.get('Content-Length')
+        if length is None:
+            return
+        return int(length)
 
     def is_chunck(self):
-        for k, v in self.headers:
-            if k.lower() == 'transfer-encoding':
-                return v == 'chunked'
-        return False
+        return self.headers.get('Transfer-Encoding') == 'chunked'
 
     def default_headers(self):
         return [
@@ -102,82 +190,355 @@ class Response:
         return "".join(header).encode()
 
     def write_response(self, data):
+        ''' queue the response and send as much as the socket accepts.
+            on a non-blocking socket the rest is sent by calling
+            pump() when the socket is writable, check `finished`.
+        '''
         if not self.headers_set:
             raise TypeError("start_response not called")
+        self.data = data
+        self.buffered = isinstance(data, (list, tuple))
         if self.code not in (204,304):
             size = self.get_length()
             chunck = False
             if size is None:
-                chunck = True
-                if not self.is_chunck():
-                    self.headers.append(("Transfer-Encoding", 'chunked'))
+                if self.req.proto == 'HTTP/1.1':
+                    chunck = True
+                    if not self.is_chunck():
+                        self.headers.append(("Transfer-Encoding", 'chunked'))
+                else:
+                    # HTTP/1.0 has no chunked encoding,
+                    # closing the connection ends the body
+                    self.keep_alive = False
         status = [
             b"HTTP/1.1",
             str(self.code).encode(),
             self.reason.encode(), b"\r\n"
         ]
         status = b" ".join(status)
-        self.write(status)
-        connection = self.req.headers.get('Connection', 'close')
-        self.headers.append(("Connection", connection))
+        self.connection_headers()
         header = self.process_headers(self.headers)
-        self.write(header)
+        self.write(status + header)
         self.headers_sent = True
         if self.code not in (204,304):
             self.write_body(data, size, chunck)
-
-    def write_chunck(self, data):
-        ''' send the data with chunck transfer'''
-        iterator = iter(data)
-        try:
-            while 1:
-                try:
-                    chunck = next(iterator)
-                except StopIteration:
-                    break
-                size = ('%x' % len(chunck)).encode()
-                body = b"%s\r\n%s\r\n" % (size, chunck)
-                self.conn.send(body)
-            self.conn.send(b'0\r\n\r\n')
-        finally:
-            if hasattr(data, 'close'):
-                data.close()
+        self.send()
+
+    def connection_headers(self):
+        value = self.headers.get('Connection')
+        if value is not None:
+            # set by the app
+            if 'close' in value.lower():
+                self.keep_alive = False
+            return
+        if not self.keep_alive:
+            self.headers.append(("Connection", 'close'))
+            return
+        if self.req.proto == 'HTTP/1.0':
+            self.headers.append(("Connection", 'keep-alive'))
+        if self.keep_alive_params:
+            self.headers.append(
+                ('Keep-Alive', 'timeout=%d, max=%d' % self.keep_alive_params))
 
     def write_body(self, data, size=None, chunck=False):
         if chunck:
-            self.write_chunck(data)
+            self.body = self.iter_chunck(data)
             return
-        assert size is not None
+        if size is None:
+            # close delimited
+            self.body = (chunck for chunck in data if chunck)
+            return
+        if isinstance(data, FileWrapper) and self.use_sendfile(data, size):
+            return
+        self.body = self.iter_body(data, size)
+
+    def iter_chunck(self, data):
+        ''' frame the data with chunck transfer'''
+        for chunck in data:
+            if not chunck:
+                # empty chunck would end the body
+                continue
+            # one piece, the framing is sent with the data
+            yield (('%x\r\n' % len(chunck)).encode(), chunck, b'\r\n')
+        yield b'0\r\n\r\n'
+
+    def iter_body(self, data, size):
+        for data_chunck in data:
+            # make sure the server doesnt send data
+            # more than the content-length specified
+            if self.sent >= size:
+                return
+            remain = size - self.sent
+            data_chunck = data_chunck[:remain]
+            self.sent += len(data_chunck)
+            yield data_chunck
+
+    def use_sendfile(self, wrapper, size):
+        ''' send the file with os.sendfile, the data is copied by the
+            kernel. returns False if the file can't be sent this way.
+        '''
+        if not hasattr(os, 'sendfile'):
+            return False
         try:
-            iterator = iter(data)
-            while 1:
+            fileno = wrapper.fileno()
+            offset = wrapper.filelike.tell()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return False
+        if size <= self.coalesce_size:
+            # small file, one read and it goes out with the headers
+            data = os.pread(fileno, size, offset)
+            self.sent += len(data)
+            self.write(data)
+            return True
+        self.file = (fileno, offset, offset + size)
+        return True
+
+    def sendfile(self):
+        ''' returns False if the socket is not writable '''
+        fileno, offset, end = self.file
+        while offset < end:
+            try:
+                sent = os.sendfile(self.conn.fileno(), fileno, offset,
+                                   end - offset)
+            except BlockingIOError:
+                self.file = (fileno, offset, end)
+                return False
+            except OSError as e:
+                if self.sent == 0 and e.errno in (errno.EINVAL, errno.ENOSYS,
+                                                  errno.ENOTSOCK):
+                    # not supported for this file, send it the normal way
+                    self.file = None
+                    self.body = self.iter_body(self.data, end - offset)
+                    return True
+                raise
+            if sent == 0:
+                # file is smaller than content-length
+                break
+            offset += sent
+            self.sent += sent
+            self.bytes_sent += sent
+            self.last_write = time.monotonic()
+        self.file = None
+        return True
+
+    def pump(self):
+        ''' pull data from the app and write it to the socket, each piece
+            is sent once it is pulled so a streamed response doesn't wait
+            for the next one. while the socket is full pulling goes on
+            till the buffer is over the high water mark.
+            returns True when the whole response has been sent.
+        '''
+        blocked = False
+        while 1:
+            if self.body is not None and self.out_size < self.high_water:
                 try:
-                    data_chunck = next(iterator)
+                    self.write(next(self.body))
                 except StopIteration:
+                    self.body = None
+                if self.buffered and self.body is not None:
+                    # the app returned a list, it goes out in one write
+                    continue
+            if self.out and not blocked:
+                blocked = not self.flush()
+            if self.body is not None and self.out_size < self.high_water:
+                continue
+            if self.out:
+                if blocked:
+                    return False
+                continue
+            if self.file is not None:
+                if not self.sendfile():
+                    return False
+                continue
+            if self.body is None:
+                break
+        self.finished = True
+        self.close()
+        return True
+
+    def send(self):
+        ''' send the response, waits for the socket if it is blocking '''
+        blocking = self.conn.gettimeout() != 0
+        while not self.pump():
+            if not blocking:
+                return False
+            self.wait_writable()
+        return True
+
+    def flush(self):
+        ''' write the outbound buffer, returns False if the
+            socket buffer is full. the buffered pieces are written
+            with one sendmsg() call.
+        '''
+        out = self.out
+        while out:
+            try:
+                if len(out) == 1 or not hasattr(self.conn, 'sendmsg'):
+                    sent = self.conn.send(out[0])
+                else:
+                    iov = list(itertools.islice(out, self.IOV_MAX))
+                    sent = self.conn.sendmsg(iov)
+            except BlockingIOError:
+                return False
+            self.out_size -= sent
+            self.bytes_sent += sent
+            self.last_write = time.monotonic()
+            while sent:
+                size = len(out[0])
+                if sent < size:
+                    out[0] = memoryview(out[0])[sent:]
                     break
-                # make sure the server doesnt send data
-                # more than the content-length specified
-                if self.sent >= size:
-                    return
-                remain = size - self.sent
-                self.write(data_chunck[:remain])
-                self.sent += len(data_chunck[:remain])
-        finally:
-            if hasattr(data, "close"):
-                data.close()
+                sent -= size
+                out.popleft()
+        return True
+
+    def close(self):
+        ''' close the app response '''
+        data, self.data = self.data, None
+        self.body = self.file = None
+        if hasattr(data, "close"):
+            data.close()
+
+    def wait_writable(self):
+        # select() can't wait for fds over FD_SETSIZE
+        with selectors.DefaultSelector() as sel:
+            sel.register(self.conn, selectors.EVENT_WRITE)
+            if not sel.select(self.SEND_TIMEOUT):
+                raise socket.timeout('timed out sending response')
 
     def write(self, data):
-        self.conn.send(data)
-        #self.conn.close()
+        if isinstance(data, tuple):
+            for piece in data:
+                self.write(piece)
+            return
+        if data:
+            self.out.append(data)
+            self.out_size += len(data)
+
+
+class ThreadedResponse(Response):
+    ''' response of an app running in the thread pool. a pool thread
+        pulls the body from the app till the buffer is over the high
+        water mark, the loop writes it to the socket when `notify` wakes
+        it up and submits another pull once the buffer has drained.
+        pool threads never wait for a slow client.
+    '''
+    def __init__(self, req, conn, pool, notify, high_water=None,
+                 coalesce_size=None):
+        super().__init__(req, conn, high_water, coalesce_size)
+        self.pool = pool
+        self.notify = notify
+        self.lock = threading.Lock()
+        # the app has more to send, and a pool thread is pulling it
+        self.producing = True
+        self.pulling = True
+        # closed by the loop while a pool thread was in the app iterable
+        self.aborted = False
+        # the loop has been woken up for the data in the buffer
+        self.woken = False
+
+    @property
+    def idle(self):
+        ''' nothing to write till a pool thread adds more '''
+        return self.producing and not self.out
+
+    def wake(self):
+        with self.lock:
+            if self.woken:
+                return
+            self.woken = True
+        self.notify()
+
+    def send(self):
+        ''' called in the pool thread at the end of write_response '''
+        self.wake()
+        self.produce()
+
+    def produce(self):
+        ''' called in a pool thread, pull from the app till the buffer
+            is over the high water mark.
+        '''
+        while 1:
+            with self.lock:
+                if (self.aborted or self.body is None
+                        or self.out_size >= self.high_water):
+                    return
+            try:
+                data = next(self.body)
+            except StopIteration:
+                with self.lock:
+                    self.body = None
+                return
+            except Exception:
+                # the response can't be finished, the connection is closed
+                traceback.print_exc()
+                with self.lock:
+                    self.body = None
+                    self.keep_alive = False
+                return
+            with self.lock:
+                self.write(data)
+            self.wake()
+
+    def pull(self):
+        ''' called in the loop with the lock held '''
+        self.pulling = True
+        self.pool.submit(self.produce).add_done_callback(self.task_done)
+
+    def task_done(self, future=None):
+        ''' called in the pool thread after each pull '''
+        with self.lock:
+            self.pulling = False
+            if self.body is None or self.aborted:
+                self.producing = False
+            aborted = self.aborted
+        if aborted:
+            super().close()
+            return
+        self.notify()
+
+    def pump(self):
+        ''' called in the loop, write what the app has produced.
+            returns True when the whole response has been sent.
+        '''
+        with self.lock:
+            self.woken = False
+            flushed = self.flush()
+            if self.producing:
+                if not self.pulling and self.out_size < self.high_water:
+                    self.pull()
+                return False
+        if not flushed:
+            return False
+        # the app is done, a file body is sent by the loop
+        return super().pump()
+
+    def close(self):
+        with self.lock:
+            if self.pulling:
+                # a pool thread may be in the app iterable, it closes it
+                self.aborted = True
+                return
+            self.producing = False
+        super().close()
 
 
 class BodyReader:
-    def __init__(self, buf=None, conn=None):
-        self.buf = io.BytesIO()
+    # bytes kept in memory before the body is moved to a temp file
+    SPOOL_SIZE = 1024 * 1024
+
+    def __init__(self, buf=None, conn=None, spool_size=None):
+        self.buf = tempfile.SpooledTemporaryFile(
+            max_size=spool_size or self.SPOOL_SIZE)
         self.conn = conn
         self.chunk_left = 0
         self.is_chunk = False
         self.start = False
+        # streaming mode, the body is read from the socket
+        # while the app is reading it. see HTTPParser.read_stream
+        self.source = None
+        self.pending = bytearray()
+        self.eof = False
 
     def write(self, data):
         self.buf.write(data)
@@ -193,121 +554,346 @@ class BodyReader:
         self.buf.seek(pos)
 
     def getvalue(self):
-        return self.buf.getvalue()
+        pos = self.buf.tell()
+        self.buf.seek(0)
+        value = self.buf.read()
+        self.buf.seek(pos)
+        return value
+
+    def fill(self, size=None, line=False):
+        ''' read from the source till `pending` has `size` bytes
+            or a full line.
+        '''
+        pending = self.pending
+        while not self.eof:
+            if size is not None and size >= 0 and len(pending) >= size:
+                break
+            if line and b'\n' in pending:
+                break
+            data = self.source()
+            if not data:
+                self.eof = True
+                break
+            pending += data
+
+    def take(self, size):
+        pending = self.pending
+        if size is None or size < 0 or size >= len(pending):
+            data = bytes(pending)
+            pending.clear()
+        else:
+            data = bytes(pending[:size])
+            del pending[:size]
+        return data
 
     def read(self, size=None):
+        if self.source:
+            self.fill(size)
+            return self.take(size)
         if not self.start:
             self.buf.seek(0)
             self.start = True
         return self.buf.read(size)
 
     def readline(self, size=None):
+        if self.source:
+            self.fill(size, line=True)
+            end = self.pending.find(b'\n') + 1 or len(self.pending)
+            if size is not None and size >= 0:
+                end = min(end, size)
+            return self.take(end)
         if not self.start:
             self.buf.seek(0)
             self.start = True
         return self.buf.readline(size)
 
+    def readlines(self, hint=None):
+        lines = []
+        total = 0
+        for line in self:
+            lines.append(line)
+            total += len(line)
+            if hint and total >= hint:
+                break
+        return lines
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self.buf.close()
+
+
+CHUNK_SIZE_RE = re.compile(rb'[0-9A-Fa-f]+')
+CONTENT_LENGTH_RE = re.compile(r'[0-9]+')
+
+
+class ChunkedReader:
+    ''' resumable decoder for chunked transfer-encoding.
+        feed() consumes whatever has been received, the state is
+        kept till the next call, it never reads from the socket.
+    '''
+    SIZE, DATA, DATA_END, TRAILER, DONE = range(5)
+    # longest chunk-size or trailer line
+    MAX_LINE = 4096
+
+    def __init__(self):
+        self.state = self.SIZE
+        self.left = 0
+
+    @property
+    def done(self):
+        return self.state == self.DONE
+
+    def read_line(self, buf, pos):
+        ''' returns (line, next position), line is None if
+            the line is not complete yet.
+        '''
+        eol = buf.find(b"\r\n", pos)
+        if eol < 0:
+            if len(buf) - pos > self.MAX_LINE:
+                raise BadRequest(400, 'invalid chunck tranfer')
+            return None, pos
+        return bytes(buf[pos:eol]), eol + 2
+
+    def feed(self, buf, pos, write):
+        ''' decode buf from pos, `write` is called with the decoded data.
+            returns the position of the first byte not consumed.
+        '''
+        end = len(buf)
+        while pos < end and self.state != self.DONE:
+            if self.state == self.SIZE:
+                line, pos = self.read_line(buf, pos)
+                if line is None:
+                    break
+                # ignore chunk extensions, whitespace is only
+                # allowed before the ';' (rfc 7230 4.1.1)
+                size, ext, _ = line.partition(b";")
+                if ext:
+                    size = size.rstrip(b" \t")
+                # int() also takes 0x5, +5, 1_0 and spaces, a proxy
+                # may read those differently
+                if not CHUNK_SIZE_RE.fullmatch(size):
+                    raise BadRequest(400, 'invalid chunck tranfer')
+                size = int(size, 16)
+                self.left = size
+                self.state = self.DATA if size else self.TRAILER
+            elif self.state == self.DATA:
+                size = min(self.left, end - pos)
+                with memoryview(buf) as view:
+                    write(view[pos:pos + size])
+                pos += size
+                self.left -= size
+                if not self.left:
+                    self.state = self.DATA_END
+            elif self.state == self.DATA_END:
+                if end - pos < 2:
+                    break
+                if buf[pos:pos + 2] != b"\r\n":
+                    raise BadRequest(400, 'invalid chunck tranfer')
+                pos += 2
+                self.state = self.SIZE
+            elif self.state == self.TRAILER:
+                line, pos = self.read_line(buf, pos)
+                if line is None:
+                    break
+                # trailer fields are ignored, empty line ends the body
+                if not line:
+                    self.state = self.DONE
+        return pos
+
 
 class HTTPParser:
-    def __init__(self, sock, server, addr):
+    RECV_SIZE = 65536
+    # how long a streamed body read waits for the client
+    READ_TIMEOUT = 30
+    # a streamed body the app left unread is skipped by the next request
+    # up to this size, over it the connection is closed
+    SKIP_SIZE = 65536
+    # default limits, the server passes the configured ones
+    MAX_HEADER_COUNT = 100
+    MAX_HEADER_SIZE = 65536  # request line and headers
+
+    def __init__(self, sock, server, addr, max_header_count=None,
+                 max_header_size=None, data=b'', spool_size=None,
+                 stream=False):
         self.server = server
-        self.buf = io.BytesIO()
+        # one growable buffer, `pos` is the start of the unparsed data,
+        # `data` is left over from the previous request on the connection
+        self.buf = bytearray(data)
+        self.pos = 0
+        # how far the buffer has been scanned for the end of headers
+        self.scanned = 0
         self.conn = self.sock = sock
         self.seen_status = False
         self.seen_headers = False
-        self.body = BodyReader(conn=sock)
+        self.body = BodyReader(conn=sock, spool_size=spool_size)
+        self.body_left = 0
+        self.body_done = False
+        self.chunked = None
+        self.stream = stream
         self.remote_addr = addr
         self.begin = False
         self.is_alive = True
-        self.headers = []
-        self.status_line = ''
-
-    def read(self, n=1000):
-        return self.buf.read(n)
+        self.headers = Headers()
+        self.status_line = b''
+        self.method = b''
+        self.last_read = time.monotonic()
+        # bytes received by this parser, left over data was
+        # counted by the previous one
+        self.nread = 0
+        # number of this request on the connection, set by the server
+        self.requests = 1
+        # bytes of the previous request's body to drop first
+        self.skip = 0
+        self.max_header_count = max_header_count or self.MAX_HEADER_COUNT
+        self.max_header_size = max_header_size or self.MAX_HEADER_SIZE
 
     def write(self, data):
-        self.buf.write(data)
+        self.buf += data
 
     def readbuf(self):
-        return self.buf.getvalue()
-
-    def read_chunck(self):
-        buf = io.BytesIO()
-        buf.write(self.buf.getvalue())
-        buf.seek(0)
-        while 1:
-            line = buf.readline()
-            if not line:
-                #  create new buf to write request body
-                #  the previous one has been consumed
-                self.buf = io.BytesIO()
-                break
-            size = line.strip(b'\r\n')
-            try:
-                size = int(size, 16)
-            except ValueError:
-                raise BadRequest(400, 'invalid chunck tranfer')
-            if size == 0:
-                self.begin = True
-                return
-            chunck = buf.readline(size)
-            if len(chunck) < size:
-                while len(chunck) < size:
-                    # either all the data in buf has been read
-                    # or ,readline() doesnt return required amount
-                    remain = buf.readline(size - len(chunck))
-                    if not remain:
-                        #   all the data in buf has been read
-                        #   get the current position
-                        pos = buf.tell()
-                        self.conn.settimeout(0.5)
-                        try:
-                            #  recieve remaining data from the client
-                            data = self.conn.recv(1024)
-                        except (socket.error, socket.timeout):
-                            return
-                        #  write it into the buf
-                        buf.write(data)
-                        #  seek to the current position before
-                        # writing new data
-                        buf.seek(pos)
-                        continue
-                    chunck += remain
-            buf.readline()  # discard trailing \r\n
-            self.body.write(chunck)
+        return bytes(self.buf[self.pos:])
+
+    def consume(self, size):
+        ''' mark `size` bytes of the buffer as parsed '''
+        self.pos += size
+        if self.pos >= len(self.buf):
+            self.buf.clear()
+            self.pos = 0
+
+    def init_body(self):
+        ''' find the body length from the headers. anything a proxy in
+            front of the server could read differently is refused, the
+            rest of the buffer is parsed as the next request
+            (rfc 7230 3.3.3).
+        '''
+        encoding = self.headers.get('Transfer-Encoding')
+        length = self.headers.get('Content-Length')
+        if encoding is not None:
+            if length is not None:
+                raise BadRequest(400, 'both transfer-encoding and '
+                                 'content-length')
+            # a repeated field is joined with ', '
+            codings = [c.strip(' \t').lower() for c in encoding.split(',')]
+            if codings[-1] != 'chunked' or 'chunked' in codings[:-1]:
+                raise BadRequest(400, 'invalid transfer-encoding')
+            if len(codings) > 1:
+                # gzip, chunked, the body can't be decoded
+                raise UnknownEncoding()
+            self.body.is_chunk = True
+            self.chunked = ChunkedReader()
+            return
+        if length is None:
+            length = '0'
+        # int() also takes +5, 0_5 and spaces, a repeated content-length
+        # is joined with ', '
+        if not CONTENT_LENGTH_RE.fullmatch(length):
+            raise BadRequest(400, 'invalid content-length')
+        size = int(length)
+        self.body_left = size
+        # no content-length, then can start processing the request
+        self.body_done = not size
 
     def read_body(self):
-        if self.status_line.split()[0] == b"GET":
-            self.begin = True
-            return
-        size = 0
-        for k, v in self.headers:
-            if k.lower() == b"content-length":
-                size = int(v)  # TODO: content-length might not be int
-            elif k.lower() == b"transfer-encoding" and v.lower() == b"chunked":
-                self.body.is_chunk = True
-                self.read_chunck()
-                return
-        buf_size = self.buf.tell()
-        if not size:
-            # no content-length, then can start processing the request
+        self.decode_body(self.body.write)
+        if self.body_done:
             self.begin = True
+
+    def decode_body(self, write):
+        ''' decode the body received so far, `write` is called with
+            the data. the rest of the buffer belongs to the next request.
+        '''
+        if self.chunked:
+            pos = self.chunked.feed(self.buf, self.pos, write)
+            self.consume(pos - self.pos)
+            self.body_done = self.chunked.done
             return
-        if size and buf_size >= size:
-            self.begin = True
-            self.buf.seek(0)
-            self.body.write(self.buf.read(size))
-            self.buf.read(size)
-            # self.body_set = True
+        available = min(len(self.buf) - self.pos, self.body_left)
+        if available:
+            with memoryview(self.buf) as view:
+                write(view[self.pos:self.pos + available])
+            self.consume(available)
+            self.body_left -= available
+        self.body_done = not self.body_left
+
+    def can_skip_body(self):
+        ''' the part of a streamed body the app doesn't read can be
+            skipped, it is small or already in the buffer.
+        '''
+        if self.body_done:
+            return True
+        if self.chunked:
+            reader = copy.copy(self.chunked)
+            try:
+                reader.feed(self.buf, self.pos, lambda data: None)
+            except BadRequest:
+                return False
+            return reader.done
+        return self.body_left <= self.SKIP_SIZE
+
+    def skip_body(self):
+        ''' drop the body the app didn't read. returns the bytes still to
+            be received, None if the end of the body can't be found.
+        '''
+        self.decode_body(lambda data: None)
+        if self.body_done:
+            return 0
+        if self.chunked:
+            return None
+        return self.body_left
+
+    def read_stream(self):
+        ''' streaming mode, called by the app (in a worker thread) to
+            get more of the body, returns b'' at the end of the body.
+        '''
+        out = bytearray()
+        while not self.body_done:
+            self.decode_body(out.extend)
+            if out or self.body_done:
+                break
+            try:
+                data = self.conn.recv(self.RECV_SIZE)
+            except BlockingIOError:
+                # the loop keeps the socket non-blocking
+                self.wait_readable()
+                continue
+            if not data:
+                self.is_alive = False
+                raise ConnectionError('client closed connection '
+                                      'while sending the body')
+            self.last_read = time.monotonic()
+            self.nread += len(data)
+            self.buf += data
+        return bytes(out)
+
+    def wait_readable(self):
+        with selectors.DefaultSelector() as sel:
+            sel.register(self.conn, selectors.EVENT_READ)
+            if not sel.select(self.READ_TIMEOUT):
+                raise socket.timeout('timed out reading the body')
 
     def __call__(self, conn=None):
-        data = self.conn.recv(2048)
+        data = self.conn.recv(self.RECV_SIZE)
         # print(data.decode())
         if not data:
             #client close connection
             self.is_alive = False
             return self
-        self.buf.write(data)
+        self.last_read = time.monotonic()
+        self.nread += len(data)
+        self.buf += data
+        self.read_headers()
+        return self
+
+    def parse(self):
+        ''' parse the data already in the buffer, for pipelined requests '''
         self.read_headers()
         return self
 
@@ -315,37 +901,80 @@ class HTTPParser:
         return bool(self.headers)
 
     def parse_header(self, line):
-        k, v = line.strip(b"\r\n").split(b" ", 1)
-        return k.rstrip(b":"), v
+        colon = line.find(b":")
+        if colon < 1:
+            raise InvalidHeader(reason="invalid header field")
+        name = line[:colon]
+        if name != name.strip() or line[:1] in b" \t":
+            # no whitespace allowed around the field name (rfc 7230 3.2.4)
+            raise InvalidHeader(reason="invalid header field")
+        # latin-1 like the wsgi environ, any byte decodes
+        return (name.decode('latin-1'),
+                line[colon + 1:].strip(b" \t").decode('latin-1'))
 
     def read_headers(self):
         if self.seen_headers:
-            if self.body.is_chunk:
-                self.read_chunck()
-            else:
-                self.read_body()
-            return
-        headers = []
-        done = self.buf.getvalue().find(b"\r\n\r\n") > -1
-        if done:
-            self.seen_headers = True
-            self.buf.seek(0)
-            status = self.buf.readline()
-            while 1:
-                header = self.buf.readline()
-                if header == b"\r\n":
-                    break
-                try:
-                    header = self.parse_header(header)
-                except (ValueError, TypeError):
-                    raise InvalidHeader(reason="invalid header field")
-                headers.append(header)
-            self.headers = headers
-            self.status_line = status
-            buf = io.BytesIO()
-            buf.write(self.buf.read())
-            self.buf = buf
             self.read_body()
+            return
+        if self.skip:
+            # the end of the previous request's body
+            size = min(self.skip, len(self.buf) - self.pos)
+            self.consume(size)
+            self.skip -= size
+            if self.skip:
+                return
+        buf = self.buf
+        # only scan the new data, the end of headers may start
+        # in the last 3 bytes of the previous scan
+        end = buf.find(b"\r\n\r\n", max(self.scanned - 3, self.pos))
+        if end < 0:
+            self.scanned = len(buf)
+            if self.scanned - self.pos > self.max_header_size:
+                raise HeaderTooLarge()
+            return
+        if end - self.pos > self.max_header_size:
+            raise HeaderTooLarge()
+        self.parse_head(end)
+        self.seen_headers = True
+        self.consume(end + 4 - self.pos)
+        self.init_body()
+        if self.stream and not self.body_done:
+            # the app reads the body while it arrives
+            self.body.source = self.read_stream
+            self.begin = True
+            return
+        self.read_body()
+
+    def parse_head(self, end):
+        ''' parse the request line and headers in one pass,
+            `end` is the offset of the blank line.
+        '''
+        buf = self.buf
+        view = memoryview(buf)
+        headers = Headers()
+        start = self.pos
+        try:
+            # ignore empty lines before the request line (rfc 7230 3.5)
+            while buf.startswith(b"\r\n", start) and start < end:
+                start += 2
+            eol = buf.find(b"\r\n", start, end)
+            if eol < 0:
+                eol = end
+            self.status_line = bytes(view[start:eol])
+            self.method = self.status_line.split(b" ", 1)[0]
+            self.seen_status = True
+            start = eol + 2
+            while start < end:
+                eol = buf.find(b"\r\n", start, end)
+                if eol < 0:
+                    eol = end
+                if len(headers) >= self.max_header_count:
+                    raise HeaderTooLarge(reason="Too Many Header Fields")
+                headers.add(*self.parse_header(bytes(view[start:eol])))
+                start = eol + 2
+        finally:
+            view.release()
+        self.headers = headers
 
     def get_headers(self):
         if not self.headers:
@@ -0,0 +1,251 @@
+''' pre-fork worker mode.
+    the master process forks `workers` processes, each worker binds
+    its own SO_REUSEPORT socket and runs the normal server loop, the
+    kernel balances new connections between them.
+    the master only supervises the workers. a unix socket can't be
+    bound by every worker, it is bound by the master and inherited.
+    on SIGHUP a new generation of the server is started on the listening
+    sockets passed in BORING_LISTEN_FD, then the old workers drain and
+    the old master exits.
+
+'''
+import os
+import select
+import signal
+import subprocess
+import sys
+import time
+import traceback
+
+
+def start_generation(socks):
+    ''' start a new server process with the same command line,
+        it serves on the listening sockets `socks` instead of binding
+        its own.
+    '''
+    env = os.environ.copy()
+    fds = [sock.fileno() for sock in socks]
+    env['BORING_LISTEN_FD'] = ','.join(map(str, fds))
+    argv = [sys.executable, '-m', 'boring'] + sys.argv[1:]
+    proc = subprocess.Popen(argv, env=env, pass_fds=fds)
+    print('[INFO] started new server generation, pid', proc.pid)
+    return proc
+
+
+class Worker:
+    def __init__(self, wid):
+        self.id = wid
+        self.pid = None
+        self.started = 0
+        self.restarts = 0
+        self.last_exit = None
+
+    @property
+    def uptime(self):
+        if not self.pid:
+            return 0
+        return int(time.time() - self.started)
+
+    def status(self):
+        return '  worker %-3s pid %-7s up %6ss  restarts %-3s last exit %s' % (
+            self.id, self.pid or '-', self.uptime, self.restarts,
+            self.last_exit if self.last_exit is not None else '-')
+
+
+class Master:
+    # workers that die sooner than this after booting are
+    # restarted with a delay, so a broken app doesn't fork bomb the box
+    MIN_UPTIME = 1
+    KILL_TIMEOUT = 10
+
+    def __init__(self, server, workers):
+        self.server = server
+        self.num_workers = workers
+        self.workers = {}  # pid -> Worker
+        self.pending = []  # (restart time, Worker)
+        self.signals = ['SIGTERM', 'SIGINT', 'SIGWINCH', 'SIGCHLD', 'SIGUSR1',
+                        'SIGUSR2', 'SIGHUP']
+        self.sig_queue = []
+        self.stopping = False
+        self.stop_time = None
+        self.exit_code = 0
+        self.pipe = None
+        # workers drain for GRACEFUL_TIMEOUT before they are killed
+        self.kill_timeout = self.KILL_TIMEOUT
+
+    def run(self):
+        ''' start the workers and supervise them till the master is stopped
+            returns the exit code of the master.
+        '''
+        self.init_signals()
+        print('[INFO] master process', os.getpid(), 'starting',
+              self.num_workers, 'workers')
+        for wid in range(1, self.num_workers + 1):
+            self.spawn(Worker(wid))
+        while 1:
+            self.handle_signals()
+            self.reap()
+            if self.stopping:
+                if not self.workers:
+                    break
+                if time.time() - self.stop_time > self.kill_timeout:
+                    self.kill_workers(signal.SIGKILL)
+            else:
+                self.restart_pending()
+            self.sleep(1)
+        print('[INFO] master process exiting')
+        return self.exit_code
+
+    def init_signals(self):
+        r, w = os.pipe()
+        os.set_blocking(r, False)
+        os.set_blocking(w, False)
+        self.pipe = (r, w)
+        signal.set_wakeup_fd(w)
+        for sig in self.signals:
+            sig = getattr(signal, sig, None)
+            if sig:
+                signal.signal(sig, self.queue_signal)
+
+    def reset_signals(self):
+        ''' called in the worker, restore signals changed by the master '''
+        signal.set_wakeup_fd(-1)
+        for fd in self.pipe:
+            os.close(fd)
+        for sig in self.signals:
+            sig = getattr(signal, sig, None)
+            if sig:
+                signal.signal(sig, signal.SIG_DFL)
+
+    def queue_signal(self, sig, frame):
+        self.sig_queue.append(sig)
+
+    def sleep(self, timeout):
+        ''' wait till a signal arrives or timeout'''
+        try:
+            ready = select.select([self.pipe[0]], [], [], timeout)[0]
+            if ready:
+                while os.read(self.pipe[0], 1024):
+                    pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def handle_signals(self):
+        while self.sig_queue:
+            sig = self.sig_queue.pop(0)
+            if sig in (signal.SIGTERM, signal.SIGINT):
+                if self.stopping:
+                    # second signal, don't wait for the workers
+                    self.kill_workers(signal.SIGKILL)
+                    continue
+                print('[INFO] quiting server .......')
+                self.stop_workers(sig)
+            elif sig == getattr(signal, 'SIGHUP', None):
+                if not self.stopping:
+                    self.restart()
+            elif sig == getattr(signal, 'SIGWINCH', None):
+                # sent by the reloader
+                self.exit_code = 111
+                self.stop_workers(signal.SIGTERM)
+            elif sig == getattr(signal, 'SIGUSR1', None):
+                # workers reopen their log files
+                self.kill_workers(sig)
+            elif sig == getattr(signal, 'SIGUSR2', None):
+                self.print_status()
+
+    def restart(self):
+        ''' start the new generation, then drain the workers '''
+        socks = self.server.bind_sockets()
+        try:
+            start_generation(socks)
+        except OSError as e:
+            print('[ERROR] could not start a new generation:', e)
+            return
+        finally:
+            # the new generation has its own copy, shared sockets
+            # are still used by the workers
+            for sock in socks:
+                if sock not in self.server.shared_sockets:
+                    sock.close()
+        self.server.restart = True
+        self.stop_workers(signal.SIGTERM)
+
+    def stop_workers(self, sig):
+        if not self.stopping:
+            self.stopping = True
+            self.stop_time = time.time()
+            self.server.stop = True
+        self.kill_workers(sig)
+
+    def kill_workers(self, sig):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                self.workers.pop(pid, None)
+
+    def print_status(self):
+        print('[INFO] master %s, %s workers' % (os.getpid(), len(self.workers)))
+        for worker in sorted(self.workers.values(), key=lambda w: w.id):
+            print(worker.status())
+        for _, worker in self.pending:
+            print(worker.status(), '(waiting to restart)')
+        sys.stdout.flush()
+
+    def reap(self):
+        while 1:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            worker.last_exit = code
+            if self.stopping:
+                print('[INFO] worker %s (pid %s) exited' % (worker.id, pid))
+                continue
+            print('[ERROR] worker %s (pid %s) died with code %s, restarting' %
+                  (worker.id, pid, code))
+            worker.restarts += 1
+            delay = 0
+            if time.time() - worker.started < self.MIN_UPTIME:
+                delay = min(worker.restarts, 10)
+            worker.pid = None
+            self.pending.append((time.time() + delay, worker))
+
+    def restart_pending(self):
+        now = time.time()
+        pending = self.pending
+        self.pending = []
+        for when, worker in pending:
+            if when > now:
+                self.pending.append((when, worker))
+            else:
+                self.spawn(worker)
+
+    def spawn(self, worker):
+        pid = os.fork()
+        if pid:
+            worker.pid = pid
+            worker.started = time.time()
+            self.workers[pid] = worker
+            print('[INFO] booting worker %s with pid %s' % (worker.id, pid))
+            return
+        # worker process
+        code = 0
+        try:
+            self.reset_signals()
+            self.server.run_worker(worker.id)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 0
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
@@ -0,0 +1,264 @@
+''' server metrics in prometheus text format.
+    the metrics are updated in the server loop, they are plain ints
+    and floats so keeping them costs a few additions per request.
+    with --workers each worker copies its metrics to shared memory,
+    any worker answering a scrape renders those of all the workers.
+'''
+import bisect
+import json
+import mmap
+import struct
+import time
+
+from boring import __version__
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('"', '\\"'))
+                             for k, v in labels)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, doc, label=None):
+        self.name = name
+        self.doc = doc
+        # optional label name, values are kept per label value
+        self.label = label
+
+    def header(self):
+        return ['# HELP %s %s' % (self.name, self.doc),
+                '# TYPE %s %s' % (self.name, self.kind)]
+
+    def labels(self, value, extra):
+        labels = list(extra)
+        if self.label:
+            labels.append((self.label, value))
+        return format_labels(labels)
+
+    def render(self, extra=()):
+        return self.header() + self.samples(extra)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, doc, label=None):
+        super().__init__(name, doc, label)
+        self.values = {}
+
+    def inc(self, amount=1, label=None):
+        self.values[label] = self.values.get(label, 0) + amount
+
+    def samples(self, extra=()):
+        values = self.values
+        if not values and not self.label:
+            values = {None: 0}
+        return ['%s%s %s' % (self.name, self.labels(label, extra), value)
+                for label, value in sorted(values.items(),
+                                           key=lambda i: str(i[0]))]
+
+    def dump(self):
+        return list(self.values.items())
+
+    def load(self, state):
+        self.values = {label: value for label, value in state}
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, label=None):
+        self.values[label] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, doc, buckets=None):
+        super().__init__(name, doc)
+        self.buckets = tuple(buckets or self.BUCKETS)
+        # counts[i] is the number of values in bucket i, the last one is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, extra=()):
+        lines = []
+        total = 0
+        bounds = [repr(float(b)) for b in self.buckets] + ['+Inf']
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            labels = format_labels(list(extra) + [('le', bound)])
+            lines.append('%s_bucket%s %s' % (self.name, labels, total))
+        labels = format_labels(extra)
+        lines.append('%s_sum%s %s' % (self.name, labels, self.sum))
+        lines.append('%s_count%s %s' % (self.name, labels, self.count))
+        return lines
+
+    def dump(self):
+        return [self.counts, self.sum, self.count]
+
+    def load(self, state):
+        self.counts, self.sum, self.count = state
+
+
+class SharedMetrics:
+    ''' metrics of the workers in shared memory, mapped by the master
+        before the workers are forked. every worker has a slot for a
+        snapshot of its metrics, only it writes there.
+    '''
+    SLOT_SIZE = 65536
+    # sequence number, odd while the slot is written, and data length
+    HEADER = struct.Struct('QQ')
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.map = mmap.mmap(-1, self.SLOT_SIZE * workers)
+
+    def write(self, worker_id, data):
+        if len(data) > self.SLOT_SIZE - self.HEADER.size:
+            return False
+        offset = (worker_id - 1) * self.SLOT_SIZE
+        seq, _ = self.HEADER.unpack_from(self.map, offset)
+        self.HEADER.pack_into(self.map, offset, seq + 1, 0)
+        start = offset + self.HEADER.size
+        self.map[start:start + len(data)] = data
+        self.HEADER.pack_into(self.map, offset, seq + 2, len(data))
+        return True
+
+    def read(self, worker_id, retries=100):
+        ''' snapshot of a worker, None if it hasn't written one '''
+        offset = (worker_id - 1) * self.SLOT_SIZE
+        start = offset + self.HEADER.size
+        for _ in range(retries):
+            seq, size = self.HEADER.unpack_from(self.map, offset)
+            if seq % 2:
+                # being written
+                time.sleep(0)
+                continue
+            data = self.map[start:start + size]
+            if self.HEADER.unpack_from(self.map, offset)[0] == seq:
+                return data or None
+        return None
+
+    def snapshots(self):
+        for worker_id in range(1, self.workers + 1):
+            data = self.read(worker_id)
+            if data:
+                yield worker_id, data
+
+
+class Metrics:
+    ''' all the metrics of one server process '''
+    # seconds between copies to shared memory
+    STORE_INTERVAL = 1
+
+    def __init__(self, server, shared=None):
+        self.server = server
+        self.shared = shared
+        self.started = time.time()
+        self.requests = Counter('boring_requests_total',
+                                'Requests served, by status code.', 'code')
+        self.duration = Histogram('boring_request_duration_seconds',
+                                  'Time from a complete request to the end '
+                                  'of its response.')
+        self.bytes_in = Counter('boring_request_bytes_total',
+                                'Bytes received from clients.')
+        self.bytes_out = Counter('boring_response_bytes_total',
+                                 'Bytes sent to clients.')
+        self.accepted = Counter('boring_connections_accepted_total',
+                                'Connections accepted.')
+        self.closed = Counter('boring_connections_closed_total',
+                              'Connections closed.')
+        self.parse_errors = Counter('boring_parse_errors_total',
+                                    'Requests rejected by the parser.')
+        self.active = Gauge('boring_connections_active',
+                            'Open client connections.')
+        self.idle = Gauge('boring_connections_idle',
+                          'Keep-alive connections waiting for a request.')
+        self.log_dropped = Counter('boring_access_log_dropped_total',
+                                 'Access log lines dropped by the async '
+                                 'access log.')
+        self.uptime = Gauge('boring_uptime_seconds',
+                            'Seconds since the server started.')
+
+    def observe(self, handler):
+        ''' called once a response is finished.
+            handler is WsgiApp or DirectoryServer.
+        '''
+        resp = handler.resp
+        # handle_error sets the code as a str
+        self.requests.inc(label=str(int(resp.code)))
+        self.duration.observe(time.monotonic() - handler.started)
+        self.bytes_in.inc(resp.req.parser.nread)
+        self.bytes_out.inc(resp.bytes_sent)
+
+    def all(self):
+        return (self.requests, self.duration, self.bytes_in, self.bytes_out,
+                self.accepted, self.closed, self.parse_errors, self.active,
+                self.idle, self.log_dropped, self.uptime)
+
+    def update(self):
+        self.active.set(self.accepted.values.get(None, 0) -
+                        self.closed.values.get(None, 0))
+        self.idle.set(self.server.idle_connections())
+        # the access log counts the dropped lines itself
+        self.log_dropped.inc(self.server.log.dropped -
+                             self.log_dropped.values.get(None, 0))
+        self.uptime.set(round(time.time() - self.started, 3))
+
+    def dump(self):
+        return json.dumps([metric.dump() for metric in self.all()]).encode()
+
+    def load(self, data):
+        for metric, state in zip(self.all(), json.loads(data)):
+            metric.load(state)
+
+    def store(self):
+        ''' copy the metrics of this worker to shared memory '''
+        self.update()
+        if not self.shared.write(self.server.worker_id, self.dump()):
+            print('[WARNING] metrics of worker %s too big for shared memory'
+                  % self.server.worker_id)
+
+    def render(self):
+        if self.shared is None:
+            self.update()
+            extra = ()
+            if self.server.worker_id:
+                extra = (('worker', self.server.worker_id),)
+            workers = [(extra, self)]
+        else:
+            # all the workers, they are stored every STORE_INTERVAL
+            self.store()
+            workers = []
+            for worker_id, data in self.shared.snapshots():
+                metrics = Metrics(self.server)
+                metrics.load(data)
+                workers.append(((('worker', worker_id),), metrics))
+        lines = ['# boring %s' % __version__]
+        for i, metric in enumerate(self.all()):
+            lines.extend(metric.header())
+            for extra, metrics in workers:
+                lines.extend(metrics.all()[i].samples(extra))
+        lines.append('')
+        return '\n'.join(lines).encode()
+
+    def app(self, environ, start_response):
+        ''' wsgi app serving the metrics '''
+        body = self.render()
+        start_response('200 OK', [
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+            ('Content-Length', str(len(body))),
+        ])
+        return [body]
@@ -0,0 +1,171 @@
+''' in memory LRU cache of small static files.
+    every entry keeps the file content, the response headers and a
+    strong ETag computed from the content. entries are revalidated
+    by mtime at most once every `check_interval` seconds, in between
+    a hit doesn't touch the disk.
+    the same cache keeps gzip variants, either read from a `.gz`
+    sibling or compressed once from the original file. whether a file
+    has a `.gz` sibling is recorded in its entry and checked again
+    with the file, so a hit doesn't look for it either.
+'''
+import collections
+import gzip
+import hashlib
+import mimetypes
+import os
+import stat as stat_module
+import threading
+import time
+
+from boring import utils
+
+
+# types worth compressing on the fly
+COMPRESSIBLE_TYPES = {
+    'application/javascript', 'application/json', 'application/xml',
+    'application/xhtml+xml', 'application/manifest+json', 'image/svg+xml',
+    'application/wasm'
+}
+
+
+def compressible(path):
+    mime_type, encoding = mimetypes.guess_type(path)
+    if not mime_type or encoding:
+        return False
+    return mime_type.startswith('text/') or mime_type in COMPRESSIBLE_TYPES
+
+
+def sibling_stat(path):
+    ''' (size, mtime) of the precompressed `path.gz`, None if there
+        is none.
+    '''
+    try:
+        stat = os.stat(path + '.gz')
+    except OSError:
+        return None
+    if not stat_module.S_ISREG(stat.st_mode):
+        return None
+    return (stat.st_size, stat.st_mtime)
+
+
+class CacheEntry:
+    __slots__ = ('path', 'mtime', 'size', 'length', 'content', 'etag',
+                 'headers', 'last_modified', 'encoding', 'checked',
+                 'gzip_sibling')
+
+    def __init__(self, path, stat, content, encoding=None):
+        ''' content is the body as sent, encoded with `encoding` if set,
+            size and mtime are the ones of the file on disk.
+        '''
+        self.path = path
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        self.length = len(content)
+        self.content = content
+        self.encoding = encoding
+        self.etag = '"%s"' % hashlib.blake2b(content,
+                                             digest_size=12).hexdigest()
+        self.last_modified = utils.http_date(stat.st_mtime)
+        self.headers = []
+        # foo.js.gz is guessed as application/javascript too
+        mime_type, _ = mimetypes.guess_type(path)
+        if mime_type:
+            self.headers.append(('Content-Type', mime_type))
+        if encoding:
+            self.headers.extend([('Content-Encoding', encoding),
+                                 ('Vary', 'Accept-Encoding')])
+        self.headers.extend([('Content-Length', str(self.length)),
+                             ('Last-Modified', self.last_modified),
+                             ('ETag', self.etag),
+                             ('Accept-Ranges', 'bytes')])
+        self.checked = time.monotonic()
+        # (size, mtime) of the .gz sibling, set by the cache
+        self.gzip_sibling = None
+
+
+class FileCache:
+    SIZE = 32 * 1024 * 1024
+    MAX_FILE_SIZE = 256 * 1024
+    CHECK_INTERVAL = 1
+    COMPRESS_LEVEL = 6
+    # defaults of the cache of files compressed on the fly
+    GZIP_SIZE = 16 * 1024 * 1024
+    GZIP_MAX_FILE = 4 * 1024 * 1024
+
+    def __init__(self, size=None, max_file_size=None, check_interval=None):
+        self.size = self.SIZE if size is None else size
+        self.max_file_size = (self.MAX_FILE_SIZE
+                              if max_file_size is None else max_file_size)
+        self.check_interval = (self.CHECK_INTERVAL
+                               if check_interval is None else check_interval)
+        self.entries = collections.OrderedDict()
+        self.used = 0
+        # the static handler may run in the thread pool
+        self.lock = threading.Lock()
+
+    def get(self, path, encoding=None, compress=False):
+        ''' cached entry for path, None if the file is not cached.
+            with `encoding` the cached variant in that encoding.
+        '''
+        key = (path, encoding)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+        if time.monotonic() - entry.checked < self.check_interval:
+            return entry
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.remove(path, encoding)
+            return None
+        if stat.st_mtime != entry.mtime or stat.st_size != entry.size:
+            # changed on disk, load it again
+            self.remove(path, encoding)
+            return self.load(path, stat, encoding, compress)
+        if encoding is None:
+            sibling = sibling_stat(path)
+            if sibling != entry.gzip_sibling:
+                entry.gzip_sibling = sibling
+                self.remove(path + '.gz', 'gzip')
+        entry.checked = time.monotonic()
+        return entry
+
+    def load(self, path, stat=None, encoding=None, compress=False):
+        ''' read the file into the cache if it is small enough,
+            returns the entry or None.
+            `encoding` is the content coding of the cached variant,
+            with `compress` the file is gzipped here, otherwise the
+            file itself is already encoded (a .gz sibling).
+        '''
+        try:
+            stat = stat or os.stat(path)
+            if stat.st_size > self.max_file_size or stat.st_size > self.size:
+                return None
+            with open(path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            return None
+        if compress:
+            content = gzip.compress(content, self.COMPRESS_LEVEL, mtime=0)
+        entry = CacheEntry(path, stat, content, encoding)
+        if encoding is None:
+            entry.gzip_sibling = sibling_stat(path)
+        key = (path, encoding)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.used -= old.length
+            self.entries[key] = entry
+            self.used += entry.length
+            while self.used > self.size:
+                _, evicted = self.entries.popitem(last=False)
+                self.used -= evicted.length
+        return entry
+
+    def remove(self, path, encoding=None):
+        with self.lock:
+            entry = self.entries.pop((path, encoding), None)
+            if entry:
+                self.used -= entry.length
@@ -0,0 +1,101 @@
+''' index of the files under STATIC_ROOT.
+    built once at startup, the static handler answers requests for
+    files that are not in it with 404 without touching the disk.
+    refresh() only rescans the directories whose mtime changed, a
+    directory mtime changes when an entry is added, removed or renamed.
+'''
+import os
+
+
+class StaticManifest:
+    # seconds between refreshes
+    REFRESH = 2
+
+    def __init__(self, root, refresh=None):
+        self.root = os.path.abspath(root)
+        self.refresh_interval = refresh or self.REFRESH
+        self.files = set()
+        self.dirs = {}  # dir path -> mtime_ns when it was scanned
+        self.scan(self.root)
+
+    def __contains__(self, path):
+        return path in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+    def scan(self, directory):
+        ''' add the files under directory, recursively '''
+        stack = [directory]
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            self.dirs[directory] = mtime
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if entry.path not in self.dirs:
+                            stack.append(entry.path)
+                    elif entry.is_file():
+                        self.files.add(entry.path)
+                except OSError:
+                    continue
+
+    def forget(self, directory):
+        ''' remove directory and everything under it '''
+        prefix = directory + os.sep
+        for path in [d for d in self.dirs
+                     if d == directory or d.startswith(prefix)]:
+            del self.dirs[path]
+        self.files = {f for f in self.files if not f.startswith(prefix)}
+
+    def refresh(self):
+        ''' rescan the directories that changed since the last scan,
+            returns the number of rescanned directories.
+        '''
+        changed = []
+        for directory, mtime in list(self.dirs.items()):
+            try:
+                if os.stat(directory).st_mtime_ns != mtime:
+                    changed.append(directory)
+            except OSError:
+                changed.append(directory)
+        for directory in changed:
+            if directory not in self.dirs:
+                # removed with a parent directory
+                continue
+            try:
+                # stat first, a change during the scan is seen next time
+                mtime = os.stat(directory).st_mtime_ns
+                entries = {e.name: e for e in os.scandir(directory)}
+            except OSError:
+                self.forget(directory)
+                continue
+            self.dirs[directory] = mtime
+            prefix = directory + os.sep
+            # drop entries that are gone, files in sub directories
+            # are left to the sub directory scan
+            for path in [f for f in self.files if f.startswith(prefix)
+                         and os.sep not in f[len(prefix):]]:
+                entry = entries.get(path[len(prefix):])
+                if entry is None or entry.is_dir():
+                    self.files.discard(path)
+            for sub in [d for d in self.dirs if d.startswith(prefix)
+                        and os.sep not in d[len(prefix):]]:
+                entry = entries.get(sub[len(prefix):])
+                if entry is None or not entry.is_dir():
+                    self.forget(sub)
+            for entry in entries.values():
+                try:
+                    if entry.is_dir():
+                        if entry.path not in self.dirs:
+                            self.scan(entry.path)
+                    elif entry.is_file():
+                        self.files.add(entry.path)
+                except OSError:
+                    continue
+        return len(changed)
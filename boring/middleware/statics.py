@@ -8,7 +8,11 @@ import os
 import re
 from datetime import datetime
 
-from boring import __version__, utils
+from boring import utils
+from boring.http import FileWrapper
+from boring.middleware.cache import compressible
+from boring.ranges import (not_satisfiable_headers, range_response,
+                           select_ranges)
 
 DATE_RE = re.compile(
     r'''
@@ -23,74 +27,240 @@ DATE_RE = re.compile(
 
 
 class StaticsHandler:
-    def __init__(self, app, req, config=None, log=None):
-        self.req = req
+    ''' created once per server process, everything about the
+        request is read from the wsgi environ.
+    '''
+    def __init__(self, app, config=None, log=None, cache=None,
+                 gzip_cache=None, manifest=None):
+        self.cache = cache
+        # compressed variants made on the fly, None when disabled
+        self.gzip_cache = gzip_cache
+        # StaticManifest of the static dir, None when disabled
+        self.manifest = manifest
         self.app = app
         self.config = config
-        self.headers = [("Date", utils.http_date()), ('Connection', 'close'),
-                        ('Server', "Boring-Server/%s" % __version__)]
-
         url = self.config.STATIC_URL
         if not url.endswith('/'):
-            # do some padding here, so regex can match the url
-            config.STATIC_URL += '/'
-        self.static_url = self.config.STATIC_URL
-        regex = self.static_url + '(?P<path>.+)'
-        self.regex = re.compile(regex)
-        self.static_dir = config.STATIC_ROOT
+            url += '/'
+        self.static_url = url
+        self.static_dir = os.path.abspath(config.STATIC_ROOT)
         self.log = log
 
-    def has_changed(self, file):
+    def has_changed(self, env, mtime):
         ''' check if  the file has been modified '''
         #  eg.  'If-Modified-Since': 'Thu, 23 Apr 2020 21:00:22
-        last_modified = datetime.utcfromtimestamp(int(os.stat(file).st_mtime))
-        cached_time = self.req.headers.get('If-Modified-Since')
+        cached_time = env.get('HTTP_IF_MODIFIED_SINCE')
         if not cached_time:
             return True
+        last_modified = datetime.utcfromtimestamp(int(mtime))
         cached_time = utils.parse_header_date(cached_time)
         if last_modified > cached_time:
             return True
         return False
 
-    def get_file_path(self):
-        match = self.regex.search(self.req.path)
-        if match:
-            path = match.group('path')
-            path = os.path.join(self.static_dir, path)
-            return path
-        return ''
+    def get_file_path(self, env):
+        ''' file for the request, '' if the path leaves the static dir '''
+        path = env['PATH_INFO'][len(self.static_url):]
+        if not path:
+            return ''
+        path = os.path.normpath(os.path.join(self.static_dir, path))
+        if not path.startswith(self.static_dir + os.sep):
+            return ''
+        return path
+
+    def is_file(self, path):
+        if self.manifest is not None:
+            return path in self.manifest
+        return os.path.isfile(path)
+
+    def etag_matches(self, env, etag):
+        ''' compare If-None-Match with the etag of the file '''
+        if_none_match = env.get('HTTP_IF_NONE_MATCH')
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        # weak comparison, W/"x" matches "x" (rfc 7232 3.2)
+        etag = etag[2:] if etag.startswith('W/') else etag
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == etag:
+                return True
+        return False
+
+    def accepts_gzip(self, env):
+        ''' check Accept-Encoding for gzip, `gzip;q=0` refuses it '''
+        accept = env.get('HTTP_ACCEPT_ENCODING')
+        if not accept:
+            return False
+        for coding in accept.lower().split(','):
+            coding, _, params = coding.partition(';')
+            if coding.strip() not in ('gzip', 'x-gzip', '*'):
+                continue
+            params = params.replace(' ', '')
+            if params.startswith('q='):
+                try:
+                    return float(params[2:]) > 0
+                except ValueError:
+                    return False
+            return True
+        return False
+
+    def ranges(self, env, size, etag=None, last_modified=None):
+        return select_ranges(env.get('HTTP_RANGE'), env.get('HTTP_IF_RANGE'),
+                             size, etag, last_modified)
 
     def serve(self, env, start_response):
-        path = self.get_file_path()
-        if not os.path.exists(path) or not os.path.isfile(path):
+        path = self.get_file_path(env)
+        if not path or (self.manifest is not None
+                        and path not in self.manifest):
+            return self.resp_not_found(env, start_response)
+        entry = self.cache.get(path) if self.cache else None
+        if self.accepts_gzip(env):
+            resp = self.serve_gzip(env, start_response, path, entry)
+            if resp is not None:
+                return resp
+        if entry:
+            return self.serve_cached(env, start_response, entry,
+                                     self.has_variants(path, entry))
+        if not self.is_file(path):
             return self.resp_not_found(env, start_response)
-        if not self.has_changed(path):
-            return self.resp_not_modified(env, start_response)
-        return self.serve_static(env, start_response, path)
+        if self.cache:
+            entry = self.cache.load(path)
+            if entry:
+                return self.serve_cached(env, start_response, entry,
+                                         self.has_variants(path, entry))
+        return self.serve_file(env, start_response, path,
+                               vary=self.has_variants(path))
 
-    def resp_not_modified(self, env, start_response):
-        headers = self.headers
-        headers.append(("Content-Length", '0'))
+    def serve_gzip(self, env, start_response, path, entry=None):
+        ''' serve the gzip variant of path: a .gz sibling if there is one,
+            else the file compressed on the fly if that is enabled.
+            `entry` is the cache entry of path, it knows if there is a
+            sibling. returns None when there is no gzip variant.
+        '''
+        gz_path = path + '.gz'
+        if entry is None:
+            if self.cache:
+                gz_entry = self.cache.get(gz_path, 'gzip')
+                if gz_entry:
+                    return self.serve_cached(env, start_response, gz_entry)
+            sibling = self.is_file(gz_path) and self.is_file(path)
+        else:
+            sibling = entry.gzip_sibling is not None
+        if sibling:
+            if self.cache:
+                gz_entry = (self.cache.get(gz_path, 'gzip')
+                            or self.cache.load(gz_path, encoding='gzip'))
+                if gz_entry:
+                    return self.serve_cached(env, start_response, gz_entry)
+            # too big for the cache, or removed since the entry was checked
+            if entry is None or os.path.isfile(gz_path):
+                return self.serve_file(env, start_response, gz_path, 'gzip')
+        if self.gzip_cache and compressible(path):
+            entry = (self.gzip_cache.get(path, 'gzip', compress=True)
+                     or self.gzip_cache.load(path, encoding='gzip',
+                                             compress=True))
+            # tiny files can grow when compressed
+            if entry and entry.length < entry.size:
+                return self.serve_cached(env, start_response, entry)
+        return None
+
+    def has_variants(self, path, entry=None):
+        ''' the response for path depends on Accept-Encoding '''
+        if self.gzip_cache and compressible(path):
+            return True
+        if entry is not None:
+            return entry.gzip_sibling is not None
+        return self.is_file(path + '.gz')
+
+    def serve_file(self, env, start_response, path, encoding=None,
+                   vary=False):
+        ''' serve a file from disk '''
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return self.resp_not_found(env, start_response)
+        etag = 'W/"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+        headers = []
+        if encoding or vary:
+            headers.append(('Vary', 'Accept-Encoding'))
+        if self.etag_matches(env, etag):
+            return self.resp_not_modified(env, start_response, etag, headers)
+        if (not env.get('HTTP_IF_NONE_MATCH')
+                and not self.has_changed(env, stat.st_mtime)):
+            return self.resp_not_modified(env, start_response, etag, headers)
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+        return self.serve_static(env, start_response, path, stat, etag,
+                                 headers)
+
+    def serve_cached(self, env, start_response, entry, vary=False):
+        ''' serve a file from the cache, no filesystem access '''
+        # encoded entries already have their Vary header
+        extra = [('Vary', 'Accept-Encoding')] if vary else []
+        if self.etag_matches(env, entry.etag):
+            if entry.encoding:
+                extra = [('Vary', 'Accept-Encoding')]
+            return self.resp_not_modified(env, start_response, entry.etag,
+                                          extra)
+        if_modified = env.get('HTTP_IF_MODIFIED_SINCE')
+        if (if_modified and not env.get('HTTP_IF_NONE_MATCH')
+                and utils.parse_header_date(if_modified) >=
+                datetime.utcfromtimestamp(int(entry.mtime))):
+            if entry.encoding:
+                extra = [('Vary', 'Accept-Encoding')]
+            return self.resp_not_modified(env, start_response, entry.etag,
+                                          extra)
+        ranges = self.ranges(env, entry.length, entry.etag,
+                             entry.last_modified)
+        if ranges is not None:
+            headers = [
+                h for h in entry.headers
+                if h[0] not in ('Content-Type', 'Content-Length')
+            ] + extra
+            if not ranges:
+                start_response('416 Range Not Satisfiable',
+                               headers + not_satisfiable_headers(entry.length))
+                return [b'']
+            mime_type, _ = mimetypes.guess_type(entry.path)
+            range_headers, body = range_response(entry.content, ranges,
+                                                 entry.length, mime_type)
+            start_response('206 Partial Content', headers + range_headers)
+            return body
+        # entry.headers is shared by every response of the entry
+        start_response('200 OK', entry.headers + extra)
+        return [entry.content]
+
+    def resp_not_modified(self, env, start_response, etag=None, extra=()):
+        headers = [("Content-Length", '0')]
+        if etag:
+            headers.append(('ETag', etag))
+        headers.extend(extra)
         start_response('304 Not Modified', headers)
         return b''
 
     def resp_not_found(self, env, start_response):
-        headers = self.headers
-        headers.append(("Content-Length", '0'))
-        start_response('404 Not Found', headers)
+        start_response('404 Not Found', [("Content-Length", '0')])
         return b''
 
-    def serve_static(self, env, start_response, file):
-        headers = self.headers
-        last_modified = datetime.utcfromtimestamp(
-            os.stat(file).st_mtime).strftime('%a, %d %b %y %H:%M:%S GMT')
-        size = os.stat(file).st_size
+    def serve_static(self, env, start_response, file, stat, etag=None,
+                     headers=None):
+        headers = headers or []
+        if etag:
+            headers.append(('ETag', etag))
+        last_modified = utils.http_date(stat.st_mtime)
+        size = stat.st_size
         mime_type, _ = mimetypes.guess_type(file)
-        if mime_type:
-            self.headers.append(('Content-Type', mime_type))
-
-        headers.extend([("Content-Length", str(size)),
-                        ('Last-Modified', last_modified)])
+        headers.extend([('Last-Modified', last_modified),
+                        ('Accept-Ranges', 'bytes')])
+        ranges = self.ranges(env, size, etag, last_modified)
+        if ranges == []:
+            start_response('416 Range Not Satisfiable',
+                           headers + not_satisfiable_headers(size))
+            return [b'']
         try:
             static = open(file, 'rb')
             #  the file will be closed once it is delivered ..
@@ -100,10 +270,19 @@ class StaticsHandler:
                 '[INFO]  PermissionError: permission denied while opening %s' %
                 file)
             return self.resp_not_found(env, start_response)
+        file_wrapper = env.get('wsgi.file_wrapper', FileWrapper)
+        if ranges:
+            range_headers, body = range_response(static, ranges, size,
+                                                 mime_type, file_wrapper)
+            start_response('206 Partial Content', headers + range_headers)
+            return body
+        if mime_type:
+            headers.append(('Content-Type', mime_type))
+        headers.append(("Content-Length", str(size)))
         start_response('200 OK', headers)
-        return static
+        return file_wrapper(static)
 
     def __call__(self, env, start_response):
-        if not self.req.path.startswith(self.static_url):
+        if not env['PATH_INFO'].startswith(self.static_url):
             return self.app(env, start_response)
         return self.serve(env, start_response)
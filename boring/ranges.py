@@ -0,0 +1,161 @@
+''' byte range requests (rfc 7233).
+    used by the static files middleware and the directory server,
+    a single range is sent as the body of a 206 response, several
+    ranges as a multipart/byteranges body. parts of a file are read
+    with os.pread so only the requested bytes are read.
+'''
+import os
+import secrets
+
+from boring.http import FileWrapper
+
+# more ranges than this and the whole file is sent,
+# thousands of tiny ranges cost more than the file
+MAX_RANGES = 16
+
+
+def parse_range(header, size):
+    ''' parse a Range header for a representation of `size` bytes.
+        returns a sorted list of (start, end) with end inclusive,
+        [] if no range can be satisfied or None if the header
+        should be ignored (not bytes or malformed).
+    '''
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        if not sep:
+            return None
+        first, last = first.strip(), last.strip()
+        try:
+            if not first:
+                # suffix range, the last n bytes
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < 0 or start >= size:
+            continue
+        ranges.append((start, end))
+    ranges.sort()
+    # merge overlapping and adjacent ranges
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def if_range_matches(if_range, etag=None, last_modified=None):
+    ''' check If-Range, only strong validators match '''
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return bool(etag) and not etag.startswith('W/') and if_range == etag
+    if if_range.startswith('W/'):
+        return False
+    return bool(last_modified) and if_range == last_modified
+
+
+def select_ranges(header, if_range, size, etag=None, last_modified=None):
+    ''' ranges asked for by the Range and If-Range headers.
+        None means send the whole representation with 200,
+        [] means 416 Range Not Satisfiable.
+    '''
+    if not header:
+        return None
+    if if_range and not if_range_matches(if_range, etag, last_modified):
+        return None
+    return parse_range(header, size)
+
+
+def not_satisfiable_headers(size):
+    return [('Content-Range', 'bytes */%d' % size), ('Content-Length', '0')]
+
+
+def range_response(source, ranges, size, content_type=None,
+                   file_wrapper=FileWrapper):
+    ''' headers and body of a 206 response.
+        source is the content as bytes or an open file, the file
+        is closed with the response.
+    '''
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers = [('Content-Range', 'bytes %d-%d/%d' % (start, end, size)),
+                   ('Content-Length', str(end - start + 1))]
+        if content_type:
+            headers.insert(0, ('Content-Type', content_type))
+        if isinstance(source, bytes):
+            return headers, [source[start:end + 1]]
+        source.seek(start)
+        # the response sends content-length bytes from the current
+        # position, with sendfile() when it can
+        return headers, file_wrapper(source)
+    body = MultipartRanges(source, ranges, size, content_type)
+    headers = [('Content-Type', body.content_type),
+               ('Content-Length', str(body.length))]
+    return headers, body
+
+
+class MultipartRanges:
+    ''' multipart/byteranges body '''
+    BLOCK_SIZE = 65536
+
+    def __init__(self, source, ranges, size, content_type=None):
+        self.source = source
+        self.boundary = secrets.token_hex(12)
+        self.parts = []
+        self.length = 0
+        for start, end in ranges:
+            head = ['\r\n--%s\r\n' % self.boundary]
+            if content_type:
+                head.append('Content-Type: %s\r\n' % content_type)
+            head.append('Content-Range: bytes %d-%d/%d\r\n\r\n' %
+                        (start, end, size))
+            head = ''.join(head).encode('latin-1')
+            self.parts.append((head, start, end + 1))
+            self.length += len(head) + end + 1 - start
+        self.tail = ('\r\n--%s--\r\n' % self.boundary).encode()
+        self.length += len(self.tail)
+
+    @property
+    def content_type(self):
+        return 'multipart/byteranges; boundary=%s' % self.boundary
+
+    def read(self, start, end):
+        if isinstance(self.source, bytes):
+            yield self.source[start:end]
+            return
+        fileno = self.source.fileno()
+        while start < end:
+            data = os.pread(fileno, min(self.BLOCK_SIZE, end - start), start)
+            if not data:
+                return
+            start += len(data)
+            yield data
+
+    def __iter__(self):
+        for head, start, end in self.parts:
+            yield head
+            yield from self.read(start, end)
+        yield self.tail
+
+    def close(self):
+        if hasattr(self.source, 'close'):
+            self.source.close()
@@ -1,26 +1,55 @@
+''' auto reload.
+    the process started from the command line binds the listening
+    sockets and runs the server in a child process that inherits them
+    (BORING_LISTEN_FD). when a module file changes the child exits with
+    code 111 and a new child is started on the same sockets, so clients
+    connecting meanwhile wait in the listen backlog instead of being
+    refused.
+    changes are watched with inotify on linux and by polling the
+    files mtime elsewhere.
+'''
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import signal
+import site
+import struct
 import subprocess
 import sys
-import signal
-import os
+import sysconfig
 import threading
 import time
 
+# wait till no change is seen for DEBOUNCE seconds before reloading,
+# editors and `git checkout` write many files in a burst
+DEBOUNCE = 0.2
+MAX_DELAY = 2
+
+
 def sig_winch(*args):
     sys.exit(111)
 
 
-def start_new_process():
+def start_new_process(socks=()):
+    ''' run the server in a child process till it exits with a code
+        other than 111. `socks` are the listening sockets passed to it.
+    '''
+    env = os.environ.copy()
+    env['BORING_RELOAD_PROC'] = 'true'
+    pass_fds = [sock.fileno() for sock in socks]
+    if pass_fds:
+        env['BORING_LISTEN_FD'] = ','.join(map(str, pass_fds))
     while 1:
         argv = sys.argv
-        env = os.environ.copy()
-        env['BORING_RELOAD_PROC'] = 'true'
         try:
-            code = subprocess.call(argv, env=env)
+            code = subprocess.call(argv, env=env, pass_fds=pass_fds)
         except OSError as e:
-            if e.errno in (2,193,8,13):
+            if e.errno in (2, 193, 8, 13):
                 py = os.path.basename(sys.executable)
-                argv.insert(0,py)
-                code = subprocess.call(argv, env=env)
+                argv.insert(0, py)
+                code = subprocess.call(argv, env=env, pass_fds=pass_fds)
             else:
                 raise
         if code == 111:
@@ -28,29 +57,176 @@ def start_new_process():
         return code
 
 
+class PollingWatcher:
+    ''' compare the mtime of the files every INTERVAL seconds '''
+    INTERVAL = 1
+
+    def __init__(self):
+        self.mtimes = {}
+
+    def watch(self, path):
+        if path not in self.mtimes:
+            self.mtimes[path] = self.mtime(path)
+
+    def mtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def wait(self, timeout):
+        ''' files changed since the last call '''
+        time.sleep(min(timeout, self.INTERVAL))
+        changed = set()
+        for path, old in self.mtimes.items():
+            mtime = self.mtime(path)
+            # a missing file is probably being saved, wait for it
+            if mtime is not None and mtime != old:
+                self.mtimes[path] = mtime
+                changed.add(path)
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    ''' watch the directories of the files with inotify(7).
+        directories are watched rather than files since editors
+        often save by writing a new file and renaming it.
+    '''
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+    def __init__(self):
+        name = ctypes.util.find_library('c') or 'libc.so.6'
+        libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify not available')
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.wds = {}  # watch descriptor -> directory
+        self.names = {}  # directory -> names of the watched files
+
+    def watch(self, path):
+        directory, name = os.path.split(os.path.abspath(path))
+        if directory not in self.names:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                             self.MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOENT:
+                    return
+                # ENOSPC: out of watches (fs.inotify.max_user_watches)
+                raise OSError(err, os.strerror(err))
+            self.wds[wd] = directory
+            self.names[directory] = set()
+        self.names[directory].add(name)
+
+    def wait(self, timeout):
+        ''' files changed since the last call '''
+        changed = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed
+        while 1:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(data):
+                wd, _, _, length = self.EVENT.unpack_from(data, pos)
+                pos += self.EVENT.size
+                name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+                pos += length
+                directory = self.wds.get(wd)
+                if directory and name in self.names[directory]:
+                    changed.add(os.path.join(directory, name))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_watcher():
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher()
+        except OSError as e:
+            print('[INFO] inotify not available (%s), polling for changes' %
+                  e)
+    return PollingWatcher()
+
+
+def module_files():
+    ''' source files of the loaded modules, the standard library
+        is left out, it doesn't change while developing. site-packages
+        is often inside it and is watched, editable installs live there.
+    '''
+    paths = sysconfig.get_paths()
+    stdlib = tuple({os.path.join(paths[name], '')
+                    for name in ('stdlib', 'platstdlib')})
+    packages = {paths['purelib'], paths['platlib']}
+    packages.update(getattr(site, 'getsitepackages', list)())
+    packages = tuple(os.path.join(path, '') for path in packages)
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None)
+        if not path:
+            continue
+        if path.startswith(stdlib) and not path.startswith(packages):
+            continue
+        yield path
+
+
+def watch_modules(server, watcher):
+    loaded = 0
+    while not server.stop:
+        # modules imported lazily are watched as they show up
+        if len(sys.modules) != loaded:
+            loaded = len(sys.modules)
+            try:
+                for path in module_files():
+                    watcher.watch(path)
+            except OSError as e:
+                print('[INFO] inotify failed (%s), polling for changes' % e)
+                watcher.close()
+                watcher = PollingWatcher()
+                loaded = 0
+                continue
+        changed = watcher.wait(1)
+        if not changed:
+            continue
+        deadline = time.monotonic() + MAX_DELAY
+        while time.monotonic() < deadline:
+            more = watcher.wait(DEBOUNCE)
+            if not more:
+                break
+            changed |= more
+        print('[INFO]', ', '.join(sorted(changed)), 'changed, reloading')
+        watcher.close()
+        os.kill(os.getpid(), signal.SIGWINCH)
+        return
+    watcher.close()
+
+
 def start(server):
     def main():
-        mtimes = {}
         while not server.started:
             # wait till server starts
             if server.stop:
-                sys.exit(0)
-        print('[INFO] auto reload starting')
-        mods = list(sys.modules.items()).copy()
-        for module_name, module in mods:
-            if hasattr(module, '__file__') and module.__file__ is not None:
-                mtime = os.stat(module.__file__).st_mtime
-                mtimes[module] = mtime
-        while 1:
-            for mod in mtimes:
-                if server.stop:
-                    #  signal from main thread to stop
-                    sys.exit(0)
-                s = os.stat(mod.__file__).st_mtime
-                if s > mtimes[mod]:
-                    print(mod.__file__, 'changed restarting')
-                    os.kill(os.getpid(),signal.SIGWINCH)
-                    break
-            time.sleep(1)
-    threading.Thread(target=main).start()
+                return
+            time.sleep(0.1)
+        watcher = get_watcher()
+        print('[INFO] auto reload starting (%s)' %
+              type(watcher).__name__.replace('Watcher', '').lower())
+        watch_modules(server, watcher)
 
+    threading.Thread(target=main, name='boring-reloader', daemon=True).start()
@@ -1,21 +1,31 @@
+import collections
 import contextlib
 import logging
 import os
 import selectors
 import signal
 import socket
+import stat
 import sys
 import time
 import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 from boring import __version__, utils, wsgi
 from boring.config import BadConfigFile, Config, DummyConfig
 from boring.exception import HttpException
-from boring.http import HTTPParser, Request
+from boring.http import HTTPParser, Request, Response
+from boring.timers import TimerQueue
 from boring.wsgi import WsgiApp
 
-from .dir import DirectoryServer
+from .dir import DirectoryServer, ListingCache
+from .accesslog import AsyncAccessLog
+from .master import Master, start_generation
+from .metrics import Metrics, SharedMetrics
+from .middleware import StaticsHandler
+from .middleware.cache import FileCache
+from .middleware.manifest import StaticManifest
 from . import reloader
 
 
@@ -32,6 +42,8 @@ class Logger:
             ' %(addr)s -- [%(asctime)s] %(method)s %(path)s %(proto)s %(code)s -- %(message)s',
             datefmt='%d/%m/%Y %H:%M:%S %p')
         ch.setFormatter(formatter)
+        self.formatter = formatter
+        self.writer = None
         ##
         ### add ch to logger
         self._access.addHandler(ch)
@@ -39,7 +51,25 @@ class Logger:
         self._log = logging.getLogger('__')
         self._log.setLevel(logging.DEBUG)
 
+    def configure(self, path=None, mode=None, queue_size=None):
+        ''' access log to a file instead of stderr, mode async writes
+            it from a background thread.
+        '''
+        if mode == 'async':
+            self.writer = AsyncAccessLog(path, queue_size)
+            self.writer.start()
+            return
+        if path and path != '-':
+            for handler in list(self._access.handlers):
+                self._access.removeHandler(handler)
+            handler = logging.FileHandler(path)
+            handler.setFormatter(self.formatter)
+            self._access.addHandler(handler)
+
     def access(self, req=None, resp=None):
+        if self.writer:
+            self.writer.access(req, resp)
+            return
         extras = {
             'method': '',
             "path": '',
@@ -60,6 +90,25 @@ class Logger:
         extras.update(r)
         self._access.info('', extra=extras)
 
+    @property
+    def dropped(self):
+        return self.writer.dropped if self.writer else 0
+
+    def reopen(self):
+        ''' reopen the log file, for logrotate '''
+        if self.writer:
+            self.writer.reopen()
+            return
+        for handler in self._access.handlers:
+            if isinstance(handler, logging.FileHandler):
+                old = handler.setStream(open(handler.baseFilename, 'a'))
+                if old:
+                    old.close()
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+
     def log(self, message):
         self._log.info(message)
 
@@ -73,9 +122,21 @@ class SignalHandler:
         self.sigint(*args)
 
     def sigint(self, *args):
-        print("[INFO] quiting server .......")
-        self.server.shutdown()
-        sys.exit(0)
+        if self.server.draining or not self.server.started:
+            # second signal, don't wait for the connections
+            print("[INFO] quiting server .......")
+            self.server.shutdown()
+            sys.exit(0)
+        self.server.graceful_stop()
+
+    def sighup(self, *args):
+        if self.server.master_pid:
+            # the master starts the new generation
+            return
+        self.server.graceful_stop(restart=True)
+
+    def sigusr1(self, *args):
+        self.server.log.reopen()
 
     def unknown(self, *args):
         print('[INFO] ignoring unknown signal,', args[0])
@@ -85,11 +146,51 @@ class SignalHandler:
         sys.exit(111)
 
 
+def is_unix(sock):
+    return sock.family == getattr(socket, 'AF_UNIX', None)
+
+
+def format_address(sock):
+    addr = sock.getsockname()
+    if is_unix(sock):
+        return 'unix:%s' % addr
+    return '%s port %s' % addr[:2]
+
+
+def systemd_fds():
+    ''' listening sockets passed by systemd socket activation
+        (sd_listen_fds(3)), they start at fd 3. the variables are
+        removed so the processes started by the server don't take
+        them for their own.
+    '''
+    pid = os.environ.pop('LISTEN_PID', None)
+    count = os.environ.pop('LISTEN_FDS', None)
+    os.environ.pop('LISTEN_FDNAMES', None)
+    if not count or (pid and pid != str(os.getpid())):
+        return []
+    return list(range(3, 3 + int(count)))
+
+
 class Server:
+    # default timeouts in seconds, can be changed in config
+    # or from command line
+    HEADER_TIMEOUT = 30
+    BODY_TIMEOUT = 30
+    KEEPALIVE_TIMEOUT = 30
+    WRITE_TIMEOUT = 30
+    # seconds to let in flight requests finish when stopping
+    GRACEFUL_TIMEOUT = 30
+    # requests served on a keep-alive connection before it is closed
+    MAX_KEEPALIVE_REQUESTS = 1000
+    # pending connections queue of the listening socket
+    BACKLOG = 1024
+    # connections accepted each time a listening socket is ready,
+    # a burst of clients doesn't starve the connections already open
+    ACCEPT_BATCH = 64
+
     def __init__(self, app=None, config=None, args=None):
         self.sel = selectors.DefaultSelector()
-        self.sock = socket.socket()
-        self.signals = ['SIGTERM', "SIGINT","SIGWINCH"]
+        self.signals = ['SIGTERM', "SIGINT","SIGWINCH", "SIGUSR1", "SIGHUP"]
         self.signal_class = SignalHandler(self)
         self.module = None
         self.app = app
@@ -97,48 +198,468 @@ class Server:
         self.log = Logger()
         self.stop = False
         self.config = config or DummyConfig()
+        # conn -> (timeout kind, Timer)
         self._active_conns = {}
+        self.timers = TimerQueue()
+        self.timeouts = {
+            'header': self.HEADER_TIMEOUT,
+            'body': self.BODY_TIMEOUT,
+            'keepalive': self.KEEPALIVE_TIMEOUT,
+            'write': self.WRITE_TIMEOUT,
+        }
+        self.write_buffer = Response.HIGH_WATER
+        self.coalesce_size = Response.COALESCE_SIZE
+        self.max_header_count = None
+        self.max_header_size = None
+        self.body_spool_size = None
+        self.stream_body = False
         self.started = False
-
-    def init_socket(self):
+        # set by SIGTERM/SIGINT/SIGHUP, the loop stops accepting and
+        # exits once the open connections are done
+        self.draining = False
+        self.restart = False
+        self.drain_started = False
+        self.graceful_timeout = self.GRACEFUL_TIMEOUT
+        self.max_keepalive_requests = self.MAX_KEEPALIVE_REQUESTS
+        # socket options, see init_socket_options()
+        self.backlog = self.BACKLOG
+        self.accept_batch = self.ACCEPT_BATCH
+        self.tcp_nodelay = True
+        self.tcp_quickack = False
+        self.tcp_defer_accept = 0
+        self.tcp_fastopen = 0
+        self.sndbuf = None
+        self.rcvbuf = None
+        # listening sockets shared with other processes
+        self.shared_sockets = set()
+        # listening sockets bound before the workers are forked
+        self.inherited = []
+        # fds passed by systemd socket activation
+        self.systemd_fds = []
+        self.unix_socket = None
+        self.unix_socket_mode = None
+        # the unix socket file was created by this process
+        self.unix_socket_owner = False
+        # all open client connections
+        self.connections = set()
+        self.multiprocess = False
+        self.multithread = False
+        self.master_pid = None
+        self.worker_id = None
+        self.pool = None
+        self._wakeup = None
+        self._completed = collections.deque()
+        # (conn, parser) with pipelined data waiting to be parsed
+        self._ready = collections.deque()
+        # listening socket -> kind (http or metrics)
+        self.listeners = {}
+        self.metrics = None
+        self.metrics_path = None
+        # metrics of all the workers, mapped by the master
+        self.shared_metrics = None
+        # the per server part of the wsgi environ, see WsgiApp
+        self.environ_template = None
+        self.static_cache = None
+        # gzip variants of static files compressed on the fly
+        self.gzip_cache = None
+        # rendered listings of the directory server
+        self.listing_cache = None
+        # connections accepted on the metrics port
+        self._metrics_conns = set()
+
+    def bind_sockets(self):
+        ''' the listening sockets. inherited from the process that
+            started this one when BORING_LISTEN_FD is set (reloader,
+            restart), passed by systemd (LISTEN_FDS) or bound here.
+        '''
+        fds = os.environ.get('BORING_LISTEN_FD')
+        if fds:
+            socks = [socket.socket(fileno=int(fd)) for fd in fds.split(',')]
+            self.shared_sockets.update(socks)
+            return socks
+        if self.systemd_fds:
+            socks = [socket.socket(fileno=fd) for fd in self.systemd_fds]
+            self.shared_sockets.update(socks)
+            return socks
+        socks = list(self.inherited)
+        self.shared_sockets.update(socks)
+        if self.unix_socket and not socks:
+            socks.append(self.bind_unix())
+        if self.args.bind or not self.unix_socket:
+            socks.append(self.bind_tcp())
+        return socks
+
+    def bind_tcp(self):
         port = self.args.port
-        addr = self.args.bind
+        addr = self.args.bind or '0.0.0.0'
+        sock = socket.socket()
         try:
-            self.sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEPORT,True)
-            self.sock.bind((addr, int(port)))
+            sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEPORT,True)
+            sock.bind((addr, int(port)))
         except OSError as e:
             print("[ERROR] could't bind to address %s:%s" % (addr, port), e)
             sys.exit(1)
-        self.sock.listen(100)
-        self.sock.setblocking(False)
-        self.sel.register(self.sock, selectors.EVENT_READ,
-                          self.handle_connection)
+        self.tune_listener(sock)
+        sock.listen(self.backlog)
+        return sock
+
+    def bind_unix(self):
+        path = self.unix_socket
+        try:
+            # left over by a server that didn't stop cleanly
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX)
+        try:
+            sock.bind(path)
+            if self.unix_socket_mode is not None:
+                os.chmod(path, self.unix_socket_mode)
+        except OSError as e:
+            print("[ERROR] could't bind to unix socket %s" % path, e)
+            sys.exit(1)
+        self.unix_socket_owner = True
+        self.tune_listener(sock)
+        sock.listen(self.backlog)
+        return sock
+
+    def remove_unix_socket(self):
+        ''' remove the socket file on exit, unless a new generation
+            of the server is using it.
+        '''
+        if self.unix_socket_owner and not self.restart:
+            self.unix_socket_owner = False
+            with contextlib.suppress(OSError):
+                os.unlink(self.unix_socket)
+
+    def tune_listener(self, sock):
+        ''' options of a listening socket, set before listen() since the
+            buffer sizes decide the tcp window offered to clients.
+            accepted connections inherit them. options missing on the
+            platform are skipped.
+        '''
+        options = [(socket.SOL_SOCKET, 'SO_SNDBUF', self.sndbuf),
+                   (socket.SOL_SOCKET, 'SO_RCVBUF', self.rcvbuf)]
+        if not is_unix(sock):
+            options += [(socket.IPPROTO_TCP, 'TCP_DEFER_ACCEPT',
+                         self.tcp_defer_accept),
+                        (socket.IPPROTO_TCP, 'TCP_FASTOPEN',
+                         self.tcp_fastopen)]
+        for level, name, value in options:
+            option = getattr(socket, name, None)
+            if not value or option is None:
+                continue
+            try:
+                sock.setsockopt(level, option, value)
+            except OSError as e:
+                print('[ERROR] could not set %s on the listening socket' %
+                      name, e)
+
+    def tune_connection(self, conn):
+        ''' options of an accepted connection '''
+        if is_unix(conn):
+            return
+        with contextlib.suppress(OSError):
+            if self.tcp_nodelay:
+                # responses are written in as few sends as possible,
+                # waiting for the ack of the previous one only adds latency
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.tcp_quickack and hasattr(socket, 'TCP_QUICKACK'):
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
+    def init_socket(self):
+        for sock in self.bind_sockets():
+            sock.setblocking(False)
+            self.sel.register(sock, selectors.EVENT_READ,
+                              self.handle_connection)
+            self.listeners[sock] = 'http'
+            print('[INFO] starting server on', format_address(sock))
+
+    def init_metrics(self):
+        ''' metrics are served on METRICS_PATH of the server
+            or on a separate METRICS_PORT.
+        '''
+        self.metrics_path = self.config.get('METRICS_PATH')
+        port = self.config.get('METRICS_PORT', None, int)
+        if not self.metrics_path and not port:
+            return
+        self.metrics = Metrics(self, self.shared_metrics)
+        if self.shared_metrics:
+            self.timers.call_later(Metrics.STORE_INTERVAL, self.store_metrics)
+        if not port:
+            return
+        sock = socket.socket()
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, True)
+            sock.bind((self.args.bind or '0.0.0.0', port))
+        except OSError as e:
+            print("[ERROR] could't bind metrics to port %s" % port, e)
+            sys.exit(1)
+        sock.listen(self.backlog)
+        sock.setblocking(False)
+        self.sel.register(sock, selectors.EVENT_READ, self.handle_connection)
+        self.listeners[sock] = 'metrics'
+        print('[INFO] serving metrics on port', port)
+
+    def store_metrics(self):
+        self.metrics.store()
+        self.timers.call_later(Metrics.STORE_INTERVAL, self.store_metrics)
 
-        print('[INFO] starting server on ', addr, 'port', port)
+    def idle_connections(self):
+        return sum(1 for kind, _ in self._active_conns.values()
+                   if kind == 'keepalive')
 
     def start(self):
         self.init()
+        workers = self.config.get('WORKERS', 1, int)
+        if workers > 1:
+            self.start_master(workers)
+            return
         self.init_socket()
         print("[INFO]", 'server started, press control-c to stop')
         self.started = True
         if "BORING_RELOAD_PROC" in os.environ:
             reloader.start(self)
+        self.loop()
+
+    def start_master(self, workers):
+        ''' fork `workers` processes, each one runs the server loop
+            on its own SO_REUSEPORT socket.
+        '''
+        if (self.unix_socket and not self.systemd_fds
+                and not os.environ.get('BORING_LISTEN_FD')):
+            # one unix socket shared by the workers, they can't each
+            # bind the path like they do with SO_REUSEPORT
+            self.inherited = [self.bind_unix()]
+        if self.config.get('METRICS_PATH') or self.config.get('METRICS_PORT'):
+            # a scrape on any worker shows the metrics of all of them
+            self.shared_metrics = SharedMetrics(workers)
+        master = Master(self, workers)
+        master.kill_timeout = self.config.get(
+            'GRACEFUL_TIMEOUT', self.graceful_timeout, float) + 5
+        self.started = True
+        if "BORING_RELOAD_PROC" in os.environ:
+            reloader.start(self)
+        code = master.run()
+        self.remove_unix_socket()
+        sys.exit(code)
+
+    def run_worker(self, worker_id):
+        ''' entry point of a forked worker '''
+        self.master_pid = os.getppid()
+        self.worker_id = worker_id
+        # the master removes the unix socket file
+        self.unix_socket_owner = False
+        self.multiprocess = True
+        self.stop = False
+        # every worker needs its own listening socket, SO_REUSEPORT
+        # lets them bind the same address. with --reload they share
+        # the socket of the reloader process.
+        self.sel = selectors.DefaultSelector()
+        self.init_signals()
+        self.init_socket()
+        self.loop()
+
+    def init_threads(self):
+        ''' create the thread pool for running the wsgi app.
+            the loop still parses requests and writes the responses, the
+            pool threads only run the app. responses with data to send are
+            handed to the loop through `_completed` and a socketpair that
+            wakes the selector up.
+        '''
+        # wakes the loop up for finished apps and signals
+        self._wakeup = socket.socketpair()
+        for sock in self._wakeup:
+            sock.setblocking(False)
+        self.sel.register(self._wakeup[0], selectors.EVENT_READ)
+        threads = self.config.get('THREADS', 0, int)
+        if threads < 1 or self.module:
+            return
+        self.pool = ThreadPoolExecutor(max_workers=threads,
+                                       thread_name_prefix='boring')
+        self.multithread = True
+
+    def init_options(self):
+        for kind in self.timeouts:
+            name = '%s_TIMEOUT' % kind.upper()
+            self.timeouts[kind] = self.config.get(name, self.timeouts[kind],
+                                                  float)
+        self.write_buffer = self.config.get('WRITE_BUFFER', self.write_buffer,
+                                            int)
+        self.coalesce_size = self.config.get('COALESCE_SIZE',
+                                             self.coalesce_size, int)
+        self.max_header_count = self.config.get('MAX_HEADER_COUNT', None, int)
+        self.max_header_size = self.config.get('MAX_HEADER_SIZE', None, int)
+        self.body_spool_size = self.config.get('BODY_SPOOL_SIZE', None, int)
+        cache_size = self.config.get('STATIC_CACHE_SIZE', FileCache.SIZE, int)
+        if self.config.STATIC_URL and cache_size > 0:
+            self.static_cache = FileCache(
+                cache_size,
+                self.config.get('STATIC_CACHE_MAX_FILE', None, int),
+                self.config.get('STATIC_CACHE_CHECK', None, float))
+        if self.config.STATIC_URL and self.config.get('STATIC_GZIP', False,
+                                                      utils.to_bool):
+            self.gzip_cache = FileCache(
+                self.config.get('STATIC_GZIP_SIZE', FileCache.GZIP_SIZE, int),
+                FileCache.GZIP_MAX_FILE,
+                self.config.get('STATIC_CACHE_CHECK', None, float))
+        if self.module is DirectoryServer:
+            self.listing_cache = ListingCache(
+                self.config.get('LISTING_CACHE_SIZE', None, int))
+        self.log.configure(self.config.get('ACCESS_LOG'),
+                           self.config.get('ACCESS_LOG_MODE'),
+                           self.config.get('ACCESS_LOG_QUEUE', None, int))
+        # the app blocks while reading a streamed body,
+        # so it is only possible when it runs in the thread pool
+        self.stream_body = bool(self.pool) and self.config.get(
+            'STREAM_BODY', False, utils.to_bool)
+        self.graceful_timeout = self.config.get('GRACEFUL_TIMEOUT',
+                                                self.graceful_timeout, float)
+        self.max_keepalive_requests = self.config.get(
+            'MAX_KEEPALIVE_REQUESTS', self.max_keepalive_requests, int)
+        if self.master_pid:
+            self.timers.call_later(1, self.check_master)
+
+    def init_statics(self):
+        ''' wrap the app with the static files middleware, it is
+            built once and shared by all the requests.
+        '''
+        if not self.config.STATIC_URL or self.module:
+            return
+        manifest = None
+        if self.config.get('STATIC_MANIFEST', False, utils.to_bool):
+            manifest = StaticManifest(
+                self.config.STATIC_ROOT,
+                self.config.get('STATIC_MANIFEST_REFRESH', None, float))
+            print('[INFO] static manifest of %s: %s files' %
+                  (manifest.root, len(manifest)))
+            self.timers.call_later(manifest.refresh_interval,
+                                   self.refresh_manifest, manifest)
+        self.app = StaticsHandler(self.app, self.config,
+                                  cache=self.static_cache,
+                                  gzip_cache=self.gzip_cache,
+                                  manifest=manifest)
+
+    def refresh_manifest(self, manifest):
+        manifest.refresh()
+        self.timers.call_later(manifest.refresh_interval,
+                               self.refresh_manifest, manifest)
+
+    def loop(self):
+        self.init_threads()
+        self.init_options()
+        self.init_statics()
+        self.init_metrics()
         while 1:
-            events = self.sel.select(0)
-            for key, _ in events:
-                if key.fileobj is self.sock:
-
-                    self.handle_connection(self.sock)
+            if self.draining:
+                if not self.drain_started:
+                    self.start_drain()
+                if not self.connections:
+                    break
+            # block till a socket is ready or the next timer expires,
+            # don't block if pipelined requests are waiting
+            timeout = 0 if self._ready else self.timers.next_timeout()
+            events = self.sel.select(timeout)
+            for key, mask in events:
+                if key.fileobj in self.listeners:
+                    self.handle_connection(key.fileobj)
+                elif self._wakeup and key.fileobj is self._wakeup[0]:
+                    self.handle_completed()
+                elif mask & selectors.EVENT_WRITE:
+                    self.handle_write(key.fileobj, key.data)
                 else:
-                    try:
-                        self.handle_request(key.fileobj, key.data)
-                    except socket.error:
-                        self.close_connection(key.fileobj)
-                    except Exception:
-                        traceback.print_exc()
-                        self.close_connection(key.fileobj)
-                        #key.fileobj.send(b"h")
-            self.manage_connections()
+                    self.dispatch(key.fileobj, key.data)
+            self.handle_ready()
+            self.timers.run()
+        print('[INFO] server stopped')
+        self.shutdown()
+
+    def graceful_stop(self, restart=False):
+        ''' called from the signal handlers, the loop does the work '''
+        self.draining = True
+        self.restart = self.restart or restart
+        self.wake()
+
+    def wake(self):
+        if self._wakeup:
+            with contextlib.suppress(OSError):
+                self._wakeup[1].send(b'x')
+
+    def start_drain(self):
+        ''' stop accepting, close idle keep-alive connections and let
+            the requests in flight finish, for GRACEFUL_TIMEOUT at most.
+            with restart a new server process is started first on the
+            same listening socket.
+        '''
+        self.drain_started = True
+        if self.restart:
+            socks = [sock for sock, kind in self.listeners.items()
+                     if kind == 'http']
+            try:
+                start_generation(socks)
+            except OSError as e:
+                # keep serving, as the master does
+                print('[ERROR] could not start a new generation:', e)
+                self.draining = self.restart = self.drain_started = False
+                return
+            self.shared_sockets.update(socks)
+        for sock in list(self.listeners):
+            with contextlib.suppress(KeyError, ValueError):
+                self.sel.unregister(sock)
+            if sock not in self.shared_sockets:
+                # accept what is already in the backlog, close()
+                # would reset those connections
+                while self.handle_connection(sock):
+                    pass
+            sock.close()
+        self.listeners.clear()
+        for conn, (kind, _) in list(self._active_conns.items()):
+            if kind == 'keepalive' and not self.pending_data(conn):
+                self.close_connection(conn)
+        print('[INFO] draining %s connections, up to %ss' %
+              (len(self.connections), self.graceful_timeout))
+        self.timers.call_later(self.graceful_timeout, self.drain_expired)
+
+    def drain_expired(self):
+        if self.connections:
+            print('[WARNING] graceful timeout, closing %s connections' %
+                  len(self.connections))
+        for conn in list(self.connections):
+            self.close_connection(conn)
+
+    def pending_data(self, conn):
+        ''' the connection has received bytes of a request '''
+        try:
+            parser = self.sel.get_key(conn).data
+        except (KeyError, ValueError):
+            return True
+        return bool(getattr(parser, 'buf', None))
+
+    def dispatch(self, conn, parser):
+        try:
+            self.handle_request(conn, parser)
+        except socket.error:
+            self.close_connection(conn)
+        except Exception:
+            traceback.print_exc()
+            self.close_connection(conn)
+
+    def handle_ready(self):
+        ''' serve pipelined requests that are already in the buffer.
+            one request per connection on every loop iteration,
+            so a client can't starve the others.
+        '''
+        for _ in range(len(self._ready)):
+            conn, parser = self._ready.popleft()
+            try:
+                key = self.sel.get_key(conn)
+            except (KeyError, ValueError):
+                continue
+            if key.data is not parser:
+                # the parser has already been called by the loop
+                continue
+            self.dispatch(conn, parser.parse)
 
     def init_signals(self):
         for sig in self.signals:
@@ -154,23 +675,54 @@ class Server:
     def init(self):
         self.init_signals()
         args = self.create_args()
-        self.check_reload_arg()
-        if self.args.use_config:
+        # a config passed to Server() is kept, the options it doesn't
+        # set come from the command line
+        if self.args.use_config or not self.config:
             self.config = Config(self.args)
+        elif isinstance(self.config, Config) and self.config.args is None:
+            self.config.args = self.args
+        if self.args.use_config:
             self.config.load()
+        self.init_socket_options()
+        self.check_reload_arg()
         if self.args.app == ".":
             self.module = DirectoryServer
         else:
             self.load_app()
         # self.start_reload()
 
+    def init_socket_options(self):
+        ''' read before the listening socket is bound, the reloader
+            process binds it too.
+        '''
+        self.backlog = self.config.get('BACKLOG', self.backlog, int)
+        self.accept_batch = max(
+            self.config.get('ACCEPT_BATCH', self.accept_batch, int), 1)
+        self.tcp_nodelay = self.config.get('TCP_NODELAY', self.tcp_nodelay,
+                                           utils.to_bool)
+        self.tcp_quickack = self.config.get('TCP_QUICKACK', self.tcp_quickack,
+                                            utils.to_bool)
+        self.tcp_defer_accept = self.config.get('TCP_DEFER_ACCEPT',
+                                                self.tcp_defer_accept, int)
+        self.tcp_fastopen = self.config.get('TCP_FASTOPEN', self.tcp_fastopen,
+                                            int)
+        self.sndbuf = self.config.get('SNDBUF', self.sndbuf, int)
+        self.rcvbuf = self.config.get('RCVBUF', self.rcvbuf, int)
+        self.unix_socket = self.config.get('UNIX_SOCKET')
+        # octal like chmod, 660
+        self.unix_socket_mode = self.config.get(
+            'UNIX_SOCKET_MODE', None, lambda mode: int(str(mode), 8))
+        self.systemd_fds = systemd_fds()
+
     def check_reload_arg(self):
         if not self.args.reload:
             return
         reload_proc = os.environ.get("BORING_RELOAD_PROC")
         if not reload_proc:
-            # main process
-            code = reloader.start_new_process()
+            # main process, it keeps the listening sockets open
+            # while the server restarts
+            code = reloader.start_new_process(self.bind_sockets())
+            self.remove_unix_socket()
             sys.exit(code)
 
     def load_app(self):
@@ -182,16 +734,40 @@ class Server:
         return args
 
     def handle_connection(self, sock):
-        try:
-            conn, addr = sock.accept()
-        except socket.error:
-            return
+        ''' accept the connections waiting on sock, `accept_batch` at
+            most, the rest are accepted on the next loop iteration.
+            returns the number of accepted connections.
+        '''
+        accepted = 0
+        while accepted < self.accept_batch:
+            try:
+                conn, addr = sock.accept()
+            except socket.error:
+                break
+            accepted += 1
+            self.add_connection(sock, conn, addr)
+        return accepted
+
+    def add_connection(self, sock, conn, addr):
+        # (host, port), unix sockets have no client address
+        addr = tuple(addr[:2]) if isinstance(addr, tuple) else ('', 0)
         conn.setblocking(False)
+        self.tune_connection(conn)
+        self.connections.add(conn)
         self.sel.register(conn,
                           selectors.EVENT_READ,
-                          data=HTTPParser(conn, self, addr))
-        self._active_conns[conn] = int(time.time())
-        #self.sel.unregister(conn)
+                          data=self.new_parser(conn, addr))
+        self.set_timeout(conn, 'header')
+        if self.metrics:
+            self.metrics.accepted.inc()
+            if self.listeners[sock] == 'metrics':
+                self._metrics_conns.add(conn)
+
+    def new_parser(self, conn, addr, data=b''):
+        return HTTPParser(conn, self, addr, self.max_header_count,
+                          self.max_header_size, data,
+                          spool_size=self.body_spool_size,
+                          stream=self.stream_body)
 
     def handle_request(self, conn, parser):
         #nn.close()
@@ -201,6 +777,8 @@ class Server:
             self.close_connection(conn)
             return
         except HttpException as e:
+            if self.metrics:
+                self.metrics.parse_errors.inc()
             e.write_error(conn)
             self.close_connection(conn)
             return
@@ -215,7 +793,10 @@ class Server:
         if not parser.begin:
             #can't start processing the request.
             # client might be sending the request one by one
+            self.set_timeout(conn, 'body' if parser.seen_headers else 'header')
             return
+        # the app decides how long it takes
+        self.clear_timeout(conn)
         try:
             request = Request(parser)
             self.run(request, conn)
@@ -223,6 +804,8 @@ class Server:
             self.close_connection(conn)
             return
         except HttpException as e:
+            if self.metrics:
+                self.metrics.parse_errors.inc()
             e.write_error(conn)
             self.close_connection(conn)
         except Exception as e:
@@ -230,18 +813,98 @@ class Server:
             traceback.print_exc()
 
     def run(self, request, conn):
+        if self.metrics and (conn in self._metrics_conns
+                             or request.path == self.metrics_path):
+            WsgiApp(self.metrics.app, request, conn, self.log, self,
+                    self.config).run()
+            return
         if self.module:
             self.module(conn, request, self).run()
-            self.close_connection(conn)
             return
-        wsgiapp = WsgiApp(self.app, request, conn, self.log, self, self.config)
+        wsgiapp = WsgiApp(self.app, request, conn, self.log, self, self.config,
+                          threaded=bool(self.pool))
+        if self.pool:
+            self.submit(wsgiapp)
+            return
         wsgiapp.run()
-        # wsgiapp = WsgiApp(self.app, request, conn, self, self.log,
-        #                       self.config)
-        #     wsgiapp.dispatch_request()
+
+    def submit(self, wsgiapp):
+        ''' run the app in the thread pool, the response is written
+            by the loop when the pool thread wakes it up.
+        '''
+        conn = wsgiapp.conn
+        # the loop doesn't read from the connection while the app is running
+        with contextlib.suppress(KeyError, ValueError):
+            self.sel.unregister(conn)
+        future = self.pool.submit(wsgiapp.execute)
+        future.add_done_callback(wsgiapp.resp.task_done)
+
+    def complete(self, wsgiapp):
+        ''' called in the pool thread, the response has more data
+            or the app is done.
+        '''
+        self._completed.append(wsgiapp)
+        with contextlib.suppress(OSError):
+            self._wakeup[1].send(b'x')
+
+    def handle_completed(self):
+        with contextlib.suppress(OSError):
+            while self._wakeup[0].recv(1024):
+                pass
+        while self._completed:
+            wsgiapp = self._completed.popleft()
+            if wsgiapp.resp.finished or wsgiapp.conn._closed:
+                # woken up for a response already sent
+                continue
+            self.handle_write(wsgiapp.conn, wsgiapp)
+
+    def finish_response(self, handler):
+        ''' finish the request if the response has been sent,
+            otherwise wait for the socket to be writable.
+            handler is WsgiApp or DirectoryServer.
+        '''
+        if handler.resp.finished:
+            handler.finish()
+            return
+        self.wait_writable(handler)
+
+    def wait_writable(self, handler):
+        conn = handler.conn
+        if getattr(handler.resp, 'idle', False):
+            # waiting for the app in the thread pool, it wakes the loop up
+            with contextlib.suppress(KeyError, ValueError):
+                self.sel.unregister(conn)
+            self.clear_timeout(conn)
+            return
+        try:
+            try:
+                self.sel.modify(conn, selectors.EVENT_WRITE, data=handler)
+            except KeyError:
+                # not registered while the app was in the thread pool
+                self.sel.register(conn, selectors.EVENT_WRITE, data=handler)
+        except (KeyError, ValueError):
+            self.close_connection(conn)
+            return
+        self.set_timeout(conn, 'write')
+
+    def handle_write(self, conn, handler):
+        ''' the socket is writable, continue sending the response '''
+        try:
+            done = handler.resp.pump()
+        except socket.error:
+            done = handler.broken = True
+        except Exception:
+            traceback.print_exc()
+            done = handler.broken = True
+        if done:
+            self.clear_timeout(conn)
+            handler.finish()
+        else:
+            self.wait_writable(handler)
 
     def close_connection(self, conn):
         ''' Close the connection after serving the request '''
+        self.connections.discard(conn)
         if conn._closed:
             return
         try:
@@ -252,34 +915,106 @@ class Server:
             conn.close()
         except OSError:
             pass
-        with contextlib.suppress(KeyError):
-            del self._active_conns[conn]
-
-    def reuse_connection(self, conn, req):
-        """ re-use connection for keep-alive header"""
-        try:
+        self.clear_timeout(conn)
+        if self.metrics:
+            self.metrics.closed.inc()
+            self._metrics_conns.discard(conn)
+
+    def reuse_connection(self, conn, req, skip=0):
+        """ re-use connection for keep-alive header,
+            `skip` bytes of the body are still to be dropped.
+        """
+        with contextlib.suppress(KeyError, ValueError):
+            # not registered when the app ran in the thread pool
             self.sel.unregister(conn)
-            self.sel.register(conn,
-                              selectors.EVENT_READ,
-                              data=HTTPParser(conn, self, req.addr))
+        # bytes received after the request belong to the next one
+        data = req.parser.readbuf()
+        if self.draining and not data:
+            self.close_connection(conn)
+            return
+        parser = self.new_parser(conn, req.addr, data)
+        parser.requests = req.parser.requests + 1
+        parser.skip = skip
+        try:
+            self.sel.register(conn, selectors.EVENT_READ, data=parser)
         except (KeyError, ValueError):
             self.close_connection(conn)
         else:
-            self._active_conns[conn] = int(time.time())
-
-    def manage_connections(self):
-        '''  remove some connections that are inactive for some time'''
-        active = self._active_conns.items()
-        timeout_conns = []
-        for conn, conn_time in active:
-            if int(time.time()) - conn_time > 30:
-                timeout_conns.append(conn)
-        for conn in timeout_conns:
-            self.close_connection(conn)
+            self.set_timeout(conn, 'keepalive')
+            if parser.buf:
+                self._ready.append((conn, parser))
+
+    def set_keep_alive(self, resp):
+        ''' decide if the connection is kept open after resp,
+            the client must want it and the limits allow it.
+        '''
+        req = resp.req
+        requests = req.parser.requests
+        timeout = self.timeouts['keepalive']
+        if (not req.keep_alive or self.draining or timeout <= 0
+                or requests >= self.max_keepalive_requests):
+            resp.keep_alive = False
+            return
+        resp.keep_alive = True
+        resp.keep_alive_params = (timeout,
+                                  self.max_keepalive_requests - requests)
+
+    def set_timeout(self, conn, kind):
+        ''' close the connection if it is still in the same state
+            after the `kind` timeout, kind is header, body or keepalive.
+        '''
+        current = self._active_conns.get(conn)
+        if current:
+            if current[0] == kind:
+                return
+            self.timers.cancel(current[1])
+        timer = self.timers.call_later(self.timeouts[kind],
+                                       self.expire_connection, conn, kind)
+        self._active_conns[conn] = (kind, timer)
+
+    def clear_timeout(self, conn):
+        current = self._active_conns.pop(conn, None)
+        if current:
+            self.timers.cancel(current[1])
+
+    def expire_connection(self, conn, kind):
+        self._active_conns.pop(conn, None)
+        if kind in ('body', 'write'):
+            # body and write timeouts are for inactivity, slow clients
+            # are fine as long as data keeps moving
+            try:
+                data = self.sel.get_key(conn).data
+            except (KeyError, ValueError):
+                return
+            if kind == 'body':
+                idle = time.monotonic() - data.last_read
+            else:
+                idle = time.monotonic() - data.resp.last_write
+            if idle < self.timeouts[kind]:
+                timer = self.timers.call_later(self.timeouts[kind] - idle,
+                                               self.expire_connection, conn,
+                                               kind)
+                self._active_conns[conn] = (kind, timer)
+                return
+        self.close_connection(conn)
+
+    def check_master(self):
+        if os.getppid() != self.master_pid:
+            # master process is gone, don't leave orphan workers behind
+            print('[INFO] master process exited, worker', self.worker_id,
+                  'exiting')
+            self.shutdown()
+            sys.exit(0)
+        self.timers.call_later(1, self.check_master)
 
     def shutdown(self):
         ''' shutdown the server'''
-        self.sock.close()
+        if self.pool:
+            self.pool.shutdown(wait=False)
+        self.log.close()
+        for sock in self.listeners:
+            sock.close()
+        self.remove_unix_socket()
         self.sel.close()
         #self.sock.shutdown(socket.SHUT_RD|socket.SHUT_WR)
         self.stop = True
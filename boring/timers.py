@@ -0,0 +1,82 @@
+''' timers for the server loop.
+    a binary heap ordered by deadline, cancelled timers are dropped
+    lazily when they reach the top of the heap.
+'''
+import heapq
+import itertools
+import time
+
+
+class Timer:
+    __slots__ = ('deadline', 'seq', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, seq, callback, args):
+        self.deadline = deadline
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __lt__(self, other):
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+
+class TimerQueue:
+    # rebuild the heap when this many cancelled timers are in it
+    COMPACT_SIZE = 1024
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cancelled = 0
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled
+
+    def call_later(self, delay, callback, *args):
+        timer = Timer(time.monotonic() + delay, next(self._seq), callback,
+                      args)
+        heapq.heappush(self._heap, timer)
+        return timer
+
+    def cancel(self, timer):
+        if timer.cancelled:
+            return
+        timer.cancel()
+        self._cancelled += 1
+        if (self._cancelled > self.COMPACT_SIZE
+                and self._cancelled > len(self._heap) // 2):
+            self._heap = [t for t in self._heap if not t.cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+
+    def _drop_cancelled(self):
+        heap = self._heap
+        while heap and heap[0].cancelled:
+            heapq.heappop(heap)
+            self._cancelled -= 1
+
+    def next_timeout(self):
+        ''' seconds till the next timer expires,
+            None if there is no timer.
+        '''
+        self._drop_cancelled()
+        if not self._heap:
+            return None
+        return max(0, self._heap[0].deadline - time.monotonic())
+
+    def run(self):
+        ''' call the expired timers '''
+        now = time.monotonic()
+        heap = self._heap
+        while heap and heap[0].deadline <= now:
+            timer = heapq.heappop(heap)
+            if timer.cancelled:
+                self._cancelled -= 1
+                continue
+            # mark it so a late cancel() doesn't count it twice
+            timer.cancelled = True
+            timer.callback(*timer.args)
@@ -37,6 +37,13 @@ def http_date(d_time=None):
     return datetime.utcnow().strftime("%a, %d %b %y %H:%M:%S GMT")
 
 
+def to_bool(value):
+    ''' option value from command line or config file to bool '''
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
 def create_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("app",
@@ -53,8 +60,46 @@ def create_args():
                         help="enable auto reload")
     parser.add_argument('-b',
                         '--bind',
-                        default='0.0.0.0',
-                        help='bind to this address')
+                        help='''bind to this address, default 0.0.0.0.
+                         with --unix-socket only the unix socket is
+                         used unless an address is given''')
+    parser.add_argument('--unix-socket',
+                        metavar='PATH',
+                        help='listen on a unix domain socket')
+    parser.add_argument('--unix-socket-mode',
+                        metavar='MODE',
+                        help='''permissions of the unix socket in octal,
+                         eg 660, default from the umask''')
+    parser.add_argument('--backlog',
+                        type=int,
+                        help='''connections waiting to be accepted before
+                         new ones are refused, default 1024''')
+    parser.add_argument('--accept-batch',
+                        type=int,
+                        help='''connections accepted at once when the
+                         listening socket is ready, default 64''')
+    parser.add_argument('--tcp-nodelay',
+                        metavar='0|1',
+                        help='''disable nagle's algorithm on client
+                         connections, default 1''')
+    parser.add_argument('--tcp-quickack',
+                        action='store_true',
+                        help='''ack client data right away instead of
+                         delaying acks (linux)''')
+    parser.add_argument('--tcp-defer-accept',
+                        type=int,
+                        help='''seconds the kernel waits for the first data
+                         of a connection before it is accepted (linux)''')
+    parser.add_argument('--tcp-fastopen',
+                        type=int,
+                        help='''queue length of tcp fast open, 0 disables
+                         it, default 0''')
+    parser.add_argument('--sndbuf',
+                        type=int,
+                        help='send buffer size of connections in bytes')
+    parser.add_argument('--rcvbuf',
+                        type=int,
+                        help='receive buffer size of connections in bytes')
     parser.add_argument('--use-config',
                         action='store_true',
                         help='use configuration for boring')
@@ -66,6 +111,111 @@ def create_args():
     parser.add_argument('-d',
                         '--directory',
                         help='serve current directory on http')
+    parser.add_argument('-w',
+                        '--workers',
+                        type=int,
+                        help='number of worker processes to fork, default 1')
+    parser.add_argument('-t',
+                        '--threads',
+                        type=int,
+                        help='''run the wsgi app in a pool of THREADS threads,
+                         default 0 (run in the server loop)''')
+
+    parser.add_argument('--header-timeout',
+                        type=float,
+                        help='seconds to wait for the request headers, default 30')
+    parser.add_argument('--body-timeout',
+                        type=float,
+                        help='''close the connection if the request body stops
+                         arriving for this many seconds, default 30''')
+    parser.add_argument('--keepalive-timeout',
+                        type=float,
+                        help='''seconds to keep an idle keep-alive connection
+                         open, default 30''')
+    parser.add_argument('--max-keepalive-requests',
+                        type=int,
+                        help='''requests served on a keep-alive connection
+                         before it is closed, default 1000''')
+    parser.add_argument('--write-timeout',
+                        type=float,
+                        help='''close the connection if the client stops
+                         reading the response for this many seconds, default 30''')
+    parser.add_argument('--graceful-timeout',
+                        type=float,
+                        help='''seconds to let requests in flight finish
+                         when the server is stopped, default 30''')
+    parser.add_argument('--write-buffer',
+                        type=int,
+                        help='''bytes of response buffered per connection before
+                         the server stops reading from the app, default 65536''')
+    parser.add_argument('--coalesce-size',
+                        type=int,
+                        help='''file responses up to this size are sent with
+                         the headers in one write, default 16384''')
+    parser.add_argument('--max-header-count',
+                        type=int,
+                        help='maximum number of request headers, default 100')
+    parser.add_argument('--max-header-size',
+                        type=int,
+                        help='''maximum size in bytes of the request line and
+                         headers, default 65536''')
+    parser.add_argument('--body-spool-size',
+                        type=int,
+                        help='''request bodies larger than this are moved
+                         from memory to a temp file, default 1048576''')
+    parser.add_argument('--stream-body',
+                        action='store_true',
+                        help='''start the app before the request body has
+                         arrived, wsgi.input reads from the socket.
+                         only used with --threads''')
+    parser.add_argument('--metrics-path',
+                        help='serve prometheus metrics on this path, eg /metrics')
+    parser.add_argument('--metrics-port',
+                        type=int,
+                        help='serve prometheus metrics on a separate port')
+    parser.add_argument('--access-log',
+                        help='access log file, default - (stderr)')
+    parser.add_argument('--access-log-mode',
+                        choices=('sync', 'async'),
+                        help='''async writes the access log in batches from a
+                         background thread, default sync''')
+    parser.add_argument('--access-log-queue',
+                        type=int,
+                        help='''lines queued by the async access log before
+                         lines are dropped, default 10000''')
+    parser.add_argument('--static-cache-size',
+                        type=int,
+                        help='''bytes of static files cached in memory,
+                         0 disables the cache, default 33554432''')
+    parser.add_argument('--static-cache-max-file',
+                        type=int,
+                        help='''largest static file to cache in bytes,
+                         default 262144''')
+    parser.add_argument('--static-cache-check',
+                        type=float,
+                        help='''seconds between checks of cached files
+                         for changes, default 1''')
+    parser.add_argument('--listing-cache-size',
+                        type=int,
+                        help='''directory listings cached in memory when
+                         serving a directory, 0 disables it, default 64''')
+    parser.add_argument('--static-manifest',
+                        action='store_true',
+                        help='''index STATIC_ROOT at startup, requests for
+                         files not in the index get 404 without a
+                         filesystem lookup''')
+    parser.add_argument('--static-manifest-refresh',
+                        type=float,
+                        help='''seconds between checks of STATIC_ROOT for
+                         new or removed files, default 2''')
+    parser.add_argument('--static-gzip',
+                        action='store_true',
+                        help='''gzip text static files on the first request
+                         and keep the compressed copy in memory''')
+    parser.add_argument('--static-gzip-size',
+                        type=int,
+                        help='''bytes of compressed static files kept in
+                         memory, default 16777216''')
 
     args = parser.parse_args()
     return args
@@ -2,82 +2,146 @@ import importlib
 import os
 import socket
 import sys
+import time
 import traceback
 
 from boring import SERVER_SOFTWARE
 from boring.exception import HttpException
-from boring.http import Response
-from boring.middleware import StaticsHandler
+from boring.http import FileWrapper, Response, ThreadedResponse
+
+
+# header name -> environ key, the same few names come in every request.
+# bounded, clients can send any name.
+_cgi_keys = {}
+MAX_CGI_KEYS = 1024
+
+
+def cgi_key(name):
+    ''' environ key of a header name,
+        User-Agent -> HTTP_USER_AGENT
+    '''
+    key = _cgi_keys.get(name)
+    if key is None:
+        key = name.upper().replace('-', '_')
+        if key not in ('CONTENT_LENGTH', 'CONTENT_TYPE'):
+            key = 'HTTP_' + key
+        if len(_cgi_keys) < MAX_CGI_KEYS:
+            _cgi_keys[name] = key
+    return key
 
 
 class WsgiApp:
-    def __init__(self, app, request, conn, log=None, server=None, config=None):
+    def __init__(self, app, request, conn, log=None, server=None, config=None,
+                 threaded=False):
         self.server = server
         self.req = request
         self.app = app
         self.conn = conn
-        self.resp = Response(self.req, self.conn)
+        high_water = server.write_buffer if server else None
+        coalesce_size = server.coalesce_size if server else None
+        if threaded:
+            # the app runs in the thread pool, the loop sends the response
+            self.resp = ThreadedResponse(self.req, self.conn, server.pool,
+                                         lambda: server.complete(self),
+                                         high_water, coalesce_size)
+        else:
+            self.resp = Response(self.req, self.conn, high_water,
+                                 coalesce_size)
+        if server:
+            server.set_keep_alive(self.resp)
         self.log = log
         self.config = config
+        self.broken = False
+        self.started = time.monotonic()
+
+    def environ_template(self):
+        ''' the part of the environ that is the same for every
+            request of the server, built once and copied.
+        '''
+        template = self.server.environ_template
+        if template is None:
+            template = {
+                "wsgi.version": (1, 0),
+                "wsgi.errors": sys.stderr,
+                "wsgi.multithread": self.server.multithread,
+                "wsgi.multiprocess": self.server.multiprocess,
+                "wsgi.run_once": False,
+                "wsgi.file_wrapper": FileWrapper,
+                "SERVER_SOFTWARE": SERVER_SOFTWARE,
+                "SCRIPT_NAME": "",
+                "SERVER_NAME": "",
+                "SERVER_PORT": "",
+            }
+            self.server.environ_template = template
+        return template
 
     def wsgi_headers(self):
-        environ = {
-            "wsgi.version": (1, 0),
-            "wsgi.url_scheme": self.req.scheme,
-            "wsgi.input": self.req.body,
-            "wsgi.errors": sys.stderr,
-            "wsgi.multithread": False,
-            "wsgi.multiprocess": False,
-            "wsgi.run_once": False,
-            "SERVER_SOFTWARE": SERVER_SOFTWARE,
-            "REQUEST_METHOD": self.req.method,
-            "SCRIPT_NAME": "",
-            "PATH_INFO": self.req.path,
-            "QUERY_STRING": self.req.query,
-            "REQUEST_URI": self.req.uri,
-            "RAW_URI": self.req.uri,
-            "REMOTE_ADDR": self.req.remote_addr,
-            "REMOTE_PORT": self.req.remote_port,
-            "SERVER_NAME": "",
-            "SERVER_PORT": "",
-            "SERVER_PROTOCOL": self.req.proto
-        }
-        headers = self.req.headers.items()
-        for k, v in headers:
-            if k not in ("Content-Length", "Content-Type"):
-                k = "HTTP_" + k.replace("-", "_")
-            else:
-                k = k.replace("-", "_")
-            environ[k.upper()] = v
+        req = self.req
+        environ = self.environ_template().copy()
+        environ["wsgi.url_scheme"] = req.scheme
+        environ["wsgi.input"] = req.body
+        environ["REQUEST_METHOD"] = req.method
+        environ["PATH_INFO"] = req.path
+        environ["QUERY_STRING"] = req.query
+        environ["REQUEST_URI"] = environ["RAW_URI"] = req.uri
+        environ["REMOTE_ADDR"] = req.remote_addr
+        environ["REMOTE_PORT"] = req.remote_port
+        environ["SERVER_PROTOCOL"] = req.proto
+        for k, v in req.parser.headers:
+            key = cgi_key(k)
+            if key in environ:
+                # a field sent more than once
+                v = environ[key] + ',' + v
+            environ[key] = v
         return environ
 
     def start_app(self, app):
-        if self.config and self.config.STATIC_URL:
-            app = StaticsHandler(app, self.req, self.config)
         app_resp = app(self.wsgi_headers(), self.resp.start_response)
+        if not self.req.parser.can_skip_body():
+            # the rest of a streamed body can't be told apart from
+            # the next request
+            self.resp.keep_alive = False
         self.resp.write_response(app_resp)
         #resp = Response(self.req,self.conn,self.server)
 
     def run(self):
-        try:
+        self.execute()
+        self.server.finish_response(self)
 
+    def execute(self):
+        ''' run the app and send the response, in threaded mode this
+            runs in a pool thread and only pulls the response from the app.
+        '''
+        try:
             self.start_app(self.app)
         except Exception as e:
             self.handle_error(e)
             traceback.print_exc()
+
+    def finish(self):
+        ''' called in the server loop once the response is sent '''
+        self.resp.close()
+        self.req.body.close()
         self.log.access(self.req, self.resp)
-        if self.req.should_close:
+        if self.server.metrics:
+            self.server.metrics.observe(self)
+        # a streamed body the app didn't read to the end is skipped
+        skip = 0
+        if not self.req.parser.body_done:
+            skip = self.req.parser.skip_body()
+        if self.broken or not self.resp.keep_alive or skip is None:
             self.server.close_connection(self.conn)
         else:
-            self.server.reuse_connection(self.conn, self.req)
+            self.server.reuse_connection(self.conn, self.req, skip)
 
     def log_request(self):
         pass
 
     def handle_error(self, exc):
         if self.resp.headers_sent:
-            # headers have been sent before exception occurs
-            self.server.close_connection(self.conn)
+            # headers have been sent before exception occurs,
+            # the connection is closed in finish()
+            self.broken = True
             return
         if isinstance(exc, HttpException):
             self.resp.code = exc.code
@@ -86,6 +150,8 @@ class WsgiApp:
             self.resp.code = "500"
             self.resp.reason = 'Internal Server Error'
             exc = HttpException(code=500, reason="Internal Server Error")
+        # error response has `Connection: close`
+        self.broken = True
         try:
             exc.write_error(self.conn)
         except socket.error:
@@ -0,0 +1,51 @@
+import threading
+import time
+import types
+import unittest
+
+from boring.accesslog import AsyncAccessLog
+
+
+class StallingStream:
+    ''' write() blocks till `release` is set '''
+    def __init__(self):
+        self.release = threading.Event()
+        self.writing = threading.Event()
+        self.data = []
+
+    def write(self, data):
+        self.writing.set()
+        self.release.wait(5)
+        self.data.append(data)
+
+    def flush(self):
+        pass
+
+
+class TestAsyncAccessLog(unittest.TestCase):
+    def test_full_queue_drops(self):
+        log = AsyncAccessLog(queue_size=3)
+        log.stream = stream = StallingStream()
+        log.start()
+        req = types.SimpleNamespace(remote_addr='127.0.0.1', method='GET',
+                                    uri='/', proto='HTTP/1.1')
+        resp = types.SimpleNamespace(code=200)
+        log.access(req, resp)
+        log.event.set()
+        self.assertTrue(stream.writing.wait(5))
+        # the writer is stuck, the loop keeps going
+        started = time.monotonic()
+        for _ in range(10):
+            log.access(req, resp)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(len(log.queue), 3)
+        self.assertEqual(log.dropped, 7)
+        stream.release.set()
+        log.close()
+        output = ''.join(stream.data)
+        self.assertEqual(output.count('GET / HTTP/1.1 200'), 4)
+        self.assertIn('[WARNING] 7 access log lines dropped', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
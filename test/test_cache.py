@@ -0,0 +1,151 @@
+import gzip
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from boring.middleware.cache import FileCache
+from boring.middleware.statics import StaticsHandler
+
+
+class Config:
+    STATIC_URL = '/static/'
+
+    def __init__(self, root):
+        self.STATIC_ROOT = root
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def write(self, name, data, mtime=None):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+
+class TestFileCache(CacheTest):
+    def test_lru_eviction(self):
+        cache = FileCache(size=250, max_file_size=200)
+        a, b, c = (self.write(name, b'x' * 100) for name in 'abc')
+        cache.load(a)
+        cache.load(b)
+        # a is used, b is the least recently used one
+        self.assertIsNotNone(cache.get(a))
+        cache.load(c)
+        self.assertEqual(cache.used, 200)
+        self.assertIsNotNone(cache.get(a))
+        self.assertIsNone(cache.get(b))
+        self.assertIsNotNone(cache.get(c))
+
+    def test_too_big(self):
+        cache = FileCache(size=1000, max_file_size=10)
+        self.assertIsNone(cache.load(self.write('a', b'x' * 11)))
+        self.assertEqual(cache.used, 0)
+
+    def test_revalidate(self):
+        cache = FileCache(check_interval=60)
+        path = self.write('a.txt', b'one', mtime=1000)
+        entry = cache.load(path)
+        self.write('a.txt', b'two', mtime=2000)
+        # checked less than check_interval ago, served from memory
+        self.assertEqual(cache.get(path).content, b'one')
+        entry.checked -= 60
+        changed = cache.get(path)
+        self.assertEqual(changed.content, b'two')
+        self.assertNotEqual(changed.etag, entry.etag)
+        # same mtime, different size
+        self.write('a.txt', b'three', mtime=2000)
+        changed.checked -= 60
+        self.assertEqual(cache.get(path).content, b'three')
+        os.remove(path)
+        cache.get(path).checked -= 60
+        self.assertIsNone(cache.get(path))
+        self.assertEqual(cache.used, 0)
+
+
+class TestStaticCache(CacheTest):
+    def setUp(self):
+        super().setUp()
+        self.handler = StaticsHandler(None, Config(self.root),
+                                      cache=FileCache(check_interval=60))
+
+    def request(self, name, **env):
+        env['PATH_INFO'] = '/static/' + name
+        response = {}
+
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+
+        body = b''.join(self.handler(env, start_response))
+        return response['status'], response['headers'], body
+
+    def test_etag(self):
+        self.write('app.js', b'let a = 1;')
+        status, headers, body = self.request('app.js')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(body, b'let a = 1;')
+        etag = headers['ETag']
+        status, headers, body = self.request('app.js', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status, '304 Not Modified')
+        self.assertEqual(headers['ETag'], etag)
+        self.assertEqual(body, b'')
+        status, _, _ = self.request('app.js', HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(status, '200 OK')
+
+    def test_hits_dont_stat(self):
+        self.write('app.js', b'let a = 1;' * 100)
+        self.write('app.js.gz', gzip.compress(b'let a = 1;' * 100))
+        self.write('plain.js', b'let b = 2;')
+        stat = os.stat
+        calls = []
+
+        def counting_stat(*args, **kw):
+            calls.append(args[0])
+            return stat(*args, **kw)
+
+        for name in ('app.js', 'plain.js'):
+            for accept in ('gzip', ''):
+                # first request loads the cache
+                _, headers, _ = self.request(name,
+                                             HTTP_ACCEPT_ENCODING=accept)
+                with mock.patch('os.stat', counting_stat):
+                    _, again, _ = self.request(name,
+                                               HTTP_ACCEPT_ENCODING=accept)
+                    status, _, _ = self.request(
+                        name, HTTP_ACCEPT_ENCODING=accept,
+                        HTTP_IF_NONE_MATCH=headers['ETag'])
+                self.assertEqual(calls, [], (name, accept))
+                self.assertEqual(status, '304 Not Modified')
+                self.assertEqual(again, headers)
+        _, headers, _ = self.request('app.js', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        _, headers, _ = self.request('app.js')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        _, headers, _ = self.request('plain.js', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Vary', headers)
+
+    def test_sibling_removed(self):
+        self.write('app.js', b'let a = 1;')
+        gz = self.write('app.js.gz', gzip.compress(b'let a = 1;'))
+        _, headers, _ = self.request('app.js', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        os.remove(gz)
+        for entry in self.handler.cache.entries.values():
+            entry.checked = time.monotonic() - 60
+        _, headers, body = self.request('app.js', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertNotIn('Vary', headers)
+        self.assertEqual(body, b'let a = 1;')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+from boring.dir import DirectoryServer, ListingCache
+
+
+class TestListingCache(unittest.TestCase):
+    def test_mtime(self):
+        cache = ListingCache()
+        self.assertIsNone(cache.get('key', 1))
+        cache.set('key', 1, b'listing')
+        self.assertEqual(cache.get('key', 1), b'listing')
+        # the directory changed, the entry is dropped
+        self.assertIsNone(cache.get('key', 2))
+        self.assertNotIn('key', cache.entries)
+
+    def test_lru(self):
+        cache = ListingCache(size=2)
+        cache.set('a', 1, b'a')
+        cache.set('b', 1, b'b')
+        cache.get('a', 1)
+        cache.set('c', 1, b'c')
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        self.assertIsNone(cache.get('b', 1))
+
+    def test_disabled(self):
+        cache = ListingCache(size=0)
+        cache.set('a', 1, b'a')
+        self.assertIsNone(cache.get('a', 1))
+
+
+def directory_server(query='', cache=None):
+    ''' DirectoryServer without a connection '''
+    handler = DirectoryServer.__new__(DirectoryServer)
+    handler.request = types.SimpleNamespace(query=query)
+    handler.server = types.SimpleNamespace(listing_cache=cache)
+    handler.resp = types.SimpleNamespace(
+        start_response=lambda status, headers: None)
+    return handler
+
+
+class TestListOptions(unittest.TestCase):
+    def options(self, query):
+        return directory_server(query).list_options()
+
+    def test_defaults(self):
+        self.assertEqual(self.options(''),
+                         ('name', 'asc', 0, DirectoryServer.PER_PAGE))
+        self.assertEqual(self.options('sort=size&order=desc&page=2'
+                                      '&per_page=50'),
+                         ('size', 'desc', 2, 50))
+
+    def test_invalid(self):
+        default = ('name', 'asc', 0, DirectoryServer.PER_PAGE)
+        for query in ('sort=mtime', 'order=up', 'page=x', 'per_page=ten',
+                      'sort=__class__&order=DESC'):
+            self.assertEqual(self.options(query), default, query)
+
+    def test_clamp(self):
+        self.assertEqual(self.options('page=-3')[2], 0)
+        self.assertEqual(self.options('per_page=0')[3], 1)
+        self.assertEqual(self.options('per_page=-5')[3], 1)
+        self.assertEqual(self.options('per_page=99999999')[3],
+                         DirectoryServer.MAX_PER_PAGE)
+
+
+class TestListdir(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def listing(self, handler):
+        return b''.join(handler.listdir(self.root))
+
+    def test_cached_till_changed(self):
+        cache = ListingCache()
+        open(os.path.join(self.root, 'one.txt'), 'w').close()
+        body = self.listing(directory_server(cache=cache))
+        self.assertIn(b'one.txt', body)
+        self.assertEqual(len(cache.entries), 1)
+        # served from the cache
+        handler = directory_server(cache=cache)
+        handler.scan = None
+        self.assertEqual(self.listing(handler), body)
+        # other options are another entry
+        self.listing(directory_server('sort=size', cache=cache))
+        self.assertEqual(len(cache.entries), 2)
+        open(os.path.join(self.root, 'two.txt'), 'w').close()
+        os.utime(self.root, ns=(0, os.stat(self.root).st_mtime_ns + 1))
+        body = self.listing(directory_server(cache=cache))
+        self.assertIn(b'two.txt', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from boring.middleware.manifest import StaticManifest
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'js'))
+        self.touch('app.css')
+        self.touch('js', 'app.js')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def touch(self, *parts):
+        with open(self.path(*parts), 'w') as f:
+            f.write('x')
+
+    def changed(self, *dirs):
+        # mtime resolution of some filesystems is coarse
+        later = time.time() + 10
+        for d in dirs:
+            os.utime(self.path(*d), (later, later))
+
+    def test_refresh(self):
+        manifest = StaticManifest(self.root)
+        self.assertIn(self.path('app.css'), manifest)
+        self.assertIn(self.path('js', 'app.js'), manifest)
+        self.assertNotIn(self.path('js'), manifest)
+        self.assertEqual(manifest.refresh(), 0)
+
+        os.makedirs(self.path('img', 'icons'))
+        self.touch('img', 'icons', 'logo.svg')
+        os.remove(self.path('js', 'app.js'))
+        self.changed((), ('js',))
+        manifest.refresh()
+        self.assertIn(self.path('img', 'icons', 'logo.svg'), manifest)
+        self.assertNotIn(self.path('js', 'app.js'), manifest)
+
+        shutil.rmtree(self.path('img'))
+        self.changed(())
+        manifest.refresh()
+        self.assertNotIn(self.path('img', 'icons', 'logo.svg'), manifest)
+        self.assertEqual(len(manifest), 1)
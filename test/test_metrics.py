@@ -0,0 +1,123 @@
+import os
+import socket
+import unittest
+
+from boring.http import HTTPParser, Request
+from boring.metrics import Metrics, SharedMetrics
+from boring.server import Server
+from boring.wsgi import WsgiApp
+
+
+def hello(environ, start_response):
+    start_response('200 OK', [('Content-Length', '5')])
+    return [b'hello']
+
+
+def error(environ, start_response):
+    start_response('500 Internal Server Error', [('Content-Length', '0')])
+    return [b'']
+
+
+def broken(environ, start_response):
+    raise ValueError('broken app')
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.server.metrics = self.metrics = Metrics(self.server)
+        self.sockets = []
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+
+    def serve(self, app):
+        conn, client = socket.socketpair()
+        self.sockets.extend([conn, client])
+        client.sendall(b'GET / HTTP/1.1\r\nHost: boring.com\r\n\r\n')
+        parser = HTTPParser(conn, self.server, ('127.0.0.1', 5000))()
+        handler = WsgiApp(app, Request(parser), conn, server=self.server)
+        handler.execute()
+        self.metrics.observe(handler)
+        return client.recv(65536)
+
+    def test_requests_by_code(self):
+        self.assertTrue(self.serve(hello).startswith(b'HTTP/1.1 200'))
+        self.assertTrue(self.serve(error).startswith(b'HTTP/1.1 500'))
+        # handle_error sets the code as a str
+        self.assertTrue(self.serve(broken).startswith(b'HTTP/1.1 500'))
+        lines = self.metrics.render().decode().splitlines()
+        requests = [line for line in lines
+                    if line.startswith('boring_requests_total{')]
+        self.assertEqual(requests, ['boring_requests_total{code="200"} 1',
+                                    'boring_requests_total{code="500"} 2'])
+        self.assertIn('boring_request_duration_seconds_count 3', lines)
+
+    def test_dropped_lines(self):
+        self.server.log.writer = type('Writer', (), {'dropped': 3})()
+        self.metrics.render()
+        self.server.log.writer.dropped = 5
+        lines = self.metrics.render().decode().splitlines()
+        self.assertIn('# TYPE boring_access_log_dropped_total counter', lines)
+        self.assertIn('boring_access_log_dropped_total 5', lines)
+
+    def test_no_requests(self):
+        lines = self.metrics.render().decode().splitlines()
+        # no sample for a labelled counter, 0 for the others
+        self.assertFalse([line for line in lines
+                          if line.startswith('boring_requests_total')])
+        self.assertIn('boring_parse_errors_total 0', lines)
+
+
+class TestSharedMetrics(unittest.TestCase):
+    def worker(self, shared, worker_id):
+        server = Server()
+        server.worker_id = worker_id
+        return Metrics(server, shared)
+
+    def test_all_workers(self):
+        shared = SharedMetrics(3)
+        one, two = self.worker(shared, 1), self.worker(shared, 2)
+        one.requests.inc(label='200')
+        one.store()
+        two.requests.inc(3, label='404')
+        lines = two.render().decode().splitlines()
+        self.assertEqual(
+            [line for line in lines if 'requests_total{' in line],
+            ['boring_requests_total{worker="1",code="200"} 1',
+             'boring_requests_total{worker="2",code="404"} 3'])
+        # one header per metric, worker 3 has stored nothing
+        self.assertEqual(lines.count('# TYPE boring_requests_total counter'),
+                         1)
+        self.assertEqual(len([line for line in lines
+                              if line.startswith('boring_uptime_seconds')]),
+                         2)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork')
+    def test_forked(self):
+        shared = SharedMetrics(2)
+        pid = os.fork()
+        if not pid:
+            metrics = self.worker(shared, 2)
+            metrics.parse_errors.inc(7)
+            metrics.store()
+            os._exit(0)
+        os.waitpid(pid, 0)
+        lines = self.worker(shared, 1).render().decode().splitlines()
+        self.assertIn('boring_parse_errors_total{worker="1"} 0', lines)
+        self.assertIn('boring_parse_errors_total{worker="2"} 7', lines)
+
+    def test_torn_read(self):
+        shared = SharedMetrics(1)
+        self.assertIsNone(shared.read(1))
+        shared.write(1, b'{}')
+        self.assertEqual(shared.read(1), b'{}')
+        # a write in progress is not read
+        seq, size = shared.HEADER.unpack_from(shared.map, 0)
+        shared.HEADER.pack_into(shared.map, 0, seq + 1, size)
+        self.assertIsNone(shared.read(1, retries=3))
+
+
+if __name__ == '__main__':
+    unittest.main()
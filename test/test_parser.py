@@ -1,6 +1,8 @@
 import socket
 import unittest
 
+from boring.exception import (BadRequest, HeaderTooLarge, InvalidHeader,
+                              UnknownEncoding)
 from boring.http import HTTPParser, Request
 
 
@@ -136,5 +138,330 @@ class TestExcessData(unittest.TestCase):
         self.assertEqual(int(size),len(request.body.read()))
 
 
+class Pipelined(FakeSocket):
+    def recv(self, size):
+        return (b'GET /one HTTP/1.1\r\nHost: boring.com\r\n\r\n'
+                b'POST /two HTTP/1.1\r\nContent-Length: 3\r\n\r\nabc'
+                b'GET /three HTTP/1.1\r\n')
+
+
+class TestPipelined(unittest.TestCase):
+    '''
+    data after the first request is kept for the next parser
+    and parsed without reading from the socket.
+    '''
+    def test_pipelined(self):
+        conn = Pipelined()
+        addr = ('localhost', 67712)
+        parser = HTTPParser(conn, FakeServer(), addr)()
+        self.assertEqual(Request(parser).path, '/one')
+        self.assertEqual(parser.body.read(), b'')
+        parser = HTTPParser(conn, FakeServer(), addr,
+                            data=parser.readbuf()).parse()
+        self.assertTrue(parser.begin)
+        self.assertEqual(Request(parser).path, '/two')
+        self.assertEqual(parser.body.read(), b'abc')
+        parser = HTTPParser(conn, FakeServer(), addr,
+                            data=parser.readbuf()).parse()
+        self.assertFalse(parser.begin)
+        self.assertEqual(parser.readbuf(), b'GET /three HTTP/1.1\r\n')
+
+
+class SegmentedSocket(FakeSocket):
+    ''' returns the request a few bytes per recv() '''
+    request = b'''POST /upload HTTP/1.1
+Host:boring.com
+Content-Length: 11
+X-Empty:
+
+hello world'''.replace(b'\n', b'\r\n')
+    step = 3
+
+    def recv(self, size):
+        pos = getattr(self, 'pos', 0)
+        self.pos = pos + self.step
+        return self.request[pos:pos + self.step]
+
+
+class TestSegmented(unittest.TestCase):
+    '''
+    The request arrives in many small segments,
+    the parser should only start the request once it is complete.
+    '''
+    def test_segmented(self):
+        conn = SegmentedSocket()
+        parser = HTTPParser(conn, FakeServer(), ('localhost', 67712))
+        calls = 0
+        while not parser.begin:
+            parser()
+            calls += 1
+            self.assertTrue(parser.is_alive)
+        self.assertEqual(calls, -(-len(conn.request) // conn.step))
+        request = Request(parser)
+        self.assertEqual(request.headers.get('Host'), 'boring.com')
+        self.assertEqual(request.headers.get('X-Empty'), '')
+        self.assertEqual(request.body.read(), b'hello world')
+
+
+class BodySocket(SegmentedSocket):
+    body = bytes(range(256)) * 4
+    request = (b'POST /upload HTTP/1.1\r\nContent-Length: 1024\r\n\r\n' +
+               body)
+    step = 100
+
+
+class TestBody(unittest.TestCase):
+    '''
+    bodies over the spool size are written to a temp file,
+    in streaming mode wsgi.input reads them from the socket.
+    '''
+    def parse(self, conn, **kw):
+        parser = HTTPParser(conn, FakeServer(), ('localhost', 67712), **kw)
+        while not parser.begin:
+            parser()
+            self.assertTrue(parser.is_alive)
+        return parser
+
+    def test_spool(self):
+        for spool_size, on_disk in ((2048, False), (1024, False),
+                                    (1023, True), (10, True)):
+            parser = self.parse(BodySocket(), spool_size=spool_size)
+            self.assertEqual(parser.body.buf._rolled, on_disk, spool_size)
+            self.assertEqual(Request(parser).body.read(), BodySocket.body)
+
+    def test_stream(self):
+        for size in (1, 7, 100, 1000):
+            conn = BodySocket()
+            parser = self.parse(conn, stream=True)
+            # the app starts before the body has arrived
+            self.assertLess(conn.pos, len(conn.request))
+            body = Request(parser).body
+            pieces = []
+            while 1:
+                data = body.read(size)
+                if not data:
+                    break
+                self.assertLessEqual(len(data), size)
+                pieces.append(data)
+            self.assertEqual(b''.join(pieces), BodySocket.body, size)
+            self.assertTrue(parser.body_done)
+            self.assertEqual(parser.readbuf(), b'')
+
+    def test_stream_chunked(self):
+        conn = ChunkedSocket()
+        parser = self.parse(conn, stream=True)
+        body = Request(parser).body
+        self.assertEqual(body.readline(), b'hello world')
+        self.assertEqual(body.read(), b'')
+        self.assertTrue(parser.body_done)
+
+    def test_skip(self):
+        conn = BodySocket()
+        conn.request += b'GET /next HTTP/1.1\r\n\r\n'
+        parser = self.parse(conn, stream=True)
+        self.assertTrue(parser.can_skip_body())
+        parser.SKIP_SIZE = 10
+        self.assertFalse(parser.can_skip_body())
+        # the app doesn't read the body
+        left = parser.skip_body()
+        self.assertGreater(left, 0)
+        self.assertEqual(parser.readbuf(), b'')
+        parser = HTTPParser(conn, FakeServer(), ('localhost', 67712))
+        parser.skip = left
+        while not parser.begin:
+            parser()
+            self.assertTrue(parser.is_alive)
+        self.assertEqual(Request(parser).path, '/next')
+
+    def test_skip_chunked(self):
+        # the end of a chunked body can only be found in the buffer
+        conn = ChunkedSocket()
+        parser = self.parse(conn, stream=True)
+        self.assertFalse(parser.can_skip_body())
+        self.assertIsNone(parser.skip_body())
+        conn = ChunkedSocket()
+        conn.step = 200
+        parser = self.parse(conn, stream=True)
+        self.assertTrue(parser.can_skip_body())
+        self.assertEqual(parser.skip_body(), 0)
+
+    def test_stream_closed(self):
+        conn = BodySocket()
+        conn.request = conn.request[:200]
+        parser = self.parse(conn, stream=True)
+        with self.assertRaises(ConnectionError):
+            Request(parser).body.read()
+
+
+class ChunkedSocket(SegmentedSocket):
+    request = b'''POST /upload HTTP/1.1
+Transfer-Encoding: chunked
+
+5;name=value
+hello
+6
+ world
+0
+X-Trailer: yes
+
+'''.replace(b'\n', b'\r\n')
+
+
+class TestChunked(unittest.TestCase):
+    '''
+    chunked body that arrives in small segments is decoded
+    without reading from the socket outside of parser().
+    '''
+    def test_chunked(self):
+        for step in (1, 3, 7, 200):
+            conn = ChunkedSocket()
+            conn.step = step
+            parser = HTTPParser(conn, FakeServer(), ('localhost', 67712))
+            while not parser.begin:
+                parser()
+                self.assertTrue(parser.is_alive)
+            self.assertEqual(Request(parser).body.read(), b'hello world')
+            self.assertEqual(parser.readbuf(), b'')
+
+    def test_invalid_size(self):
+        conn = ChunkedSocket()
+        conn.request = conn.request.replace(b'\r\n6\r\n', b'\r\nzz\r\n')
+        conn.step = 200
+        parser = HTTPParser(conn, FakeServer(), ('localhost', 67712))
+        with self.assertRaises(BadRequest):
+            parser()
+
+    def parse_size(self, size):
+        conn = ChunkedSocket()
+        conn.request = conn.request.replace(b'\r\n6\r\n',
+                                            b'\r\n' + size + b'\r\n')
+        conn.step = 200
+        parser = HTTPParser(conn, FakeServer(), ('localhost', 67712))
+        parser()
+        return Request(parser).body.read()
+
+    def test_strict_size(self):
+        # only hex digits, int() would take all of these
+        for size in (b'0x6', b'+6', b'-6', b'0_6', b' 6', b'6 ', b'\t6', b''):
+            with self.assertRaises(BadRequest, msg=size):
+                self.parse_size(size)
+        for size in (b'6', b'06', b'6;name=value', b'6 ;name'):
+            self.assertEqual(self.parse_size(size), b'hello world', size)
+
+
+class ManyHeaders(FakeSocket):
+    def recv(self, size):
+        headers = b''.join(b'X-%d: %d\r\n' % (i, i) for i in range(20))
+        return b'GET / HTTP/1.1\r\n' + headers + b'\r\n'
+
+
+class TestLimits(unittest.TestCase):
+    def get_parser(self, **limits):
+        return HTTPParser(ManyHeaders(), FakeServer(), ('localhost', 67712),
+                          **limits)
+
+    def test_header_count(self):
+        self.assertTrue(self.get_parser(max_header_count=20)().begin)
+        with self.assertRaises(HeaderTooLarge):
+            self.get_parser(max_header_count=19)()
+
+    def test_header_size(self):
+        with self.assertRaises(HeaderTooLarge):
+            self.get_parser(max_header_size=100)()
+
+    def test_invalid_header(self):
+        parser = self.get_parser()
+        with self.assertRaises(InvalidHeader):
+            parser.parse_header(b'Host : boring.com')
+        with self.assertRaises(InvalidHeader):
+            parser.parse_header(b'no colon')
+
+
+class TestKeepAlive(unittest.TestCase):
+    def get_request(self, head):
+        parser = HTTPParser(FakeSocket(), FakeServer(), ('localhost', 67712),
+                            data=head + b'\r\n\r\n').parse()
+        return Request(parser)
+
+    def test_keep_alive(self):
+        cases = [
+            (b'GET / HTTP/1.1', True),
+            (b'GET / HTTP/1.1\r\nConnection: close', False),
+            (b'GET / HTTP/1.1\r\nConnection: Upgrade, Close', False),
+            (b'GET / HTTP/1.0', False),
+            (b'GET / HTTP/1.0\r\nConnection: Keep-Alive', True),
+        ]
+        for head, keep_alive in cases:
+            req = self.get_request(head)
+            self.assertEqual(req.keep_alive, keep_alive, head)
+            self.assertEqual(req.should_close, not keep_alive, head)
+
+    def test_case_insensitive(self):
+        req = self.get_request(b'GET / HTTP/1.1\r\nconnection: close\r\n'
+                               b'accept: a\r\nACCEPT: b')
+        self.assertFalse(req.keep_alive)
+        self.assertEqual(req.headers.get('Connection'), 'close')
+        self.assertEqual(req.headers.get('Accept'), 'a, b')
+        self.assertEqual(req.headers.get_all('accept'), ['a', 'b'])
+        self.assertIn('CONNECTION', req.headers)
+
+    def test_repeated_content_length(self):
+        with self.assertRaises(BadRequest):
+            self.get_request(b'POST / HTTP/1.1\r\ncontent-length: 1\r\n'
+                             b'Content-Length: 2')
+
+
+
+class TestFraming(unittest.TestCase):
+    '''
+    a body length a proxy could read differently is refused,
+    the chunked body would be parsed as the next request.
+    '''
+    body = b'5\r\nhello\r\n0\r\n\r\n'
+
+    def parse(self, head, body=b''):
+        data = b'POST / HTTP/1.1\r\n' + head + b'\r\n\r\n' + body
+        return HTTPParser(FakeSocket(), FakeServer(), ('localhost', 67712),
+                          data=data).parse()
+
+    def test_chunked(self):
+        for head in (b'Transfer-Encoding: chunked',
+                     b'transfer-encoding: Chunked',
+                     b'Transfer-Encoding:  chunked  '):
+            parser = self.parse(head, self.body)
+            self.assertTrue(parser.begin, head)
+            self.assertEqual(parser.body.read(), b'hello')
+
+    def test_not_chunked_last(self):
+        for head in (b'Transfer-Encoding: chunked, gzip',
+                     b'Transfer-Encoding: gzip',
+                     b'Transfer-Encoding: chunked,',
+                     b'Transfer-Encoding: xchunked',
+                     b'Transfer-Encoding: chunked\x0b',
+                     b'Transfer-Encoding: chunked, chunked',
+                     b'Transfer-Encoding: chunked\r\n'
+                     b'Transfer-Encoding: chunked'):
+            with self.assertRaises(BadRequest, msg=head):
+                self.parse(head, self.body)
+
+    def test_unknown_coding(self):
+        with self.assertRaises(UnknownEncoding):
+            self.parse(b'Transfer-Encoding: gzip, chunked', self.body)
+
+    def test_length_and_chunked(self):
+        for head in (b'Transfer-Encoding: chunked\r\nContent-Length: 3',
+                     b'Content-Length: 0\r\nTransfer-Encoding: chunked'):
+            with self.assertRaises(BadRequest, msg=head):
+                self.parse(head, self.body)
+
+    def test_content_length(self):
+        parser = self.parse(b'Content-Length: 05', b'hello')
+        self.assertEqual(parser.body.read(), b'hello')
+        for value in (b'+5', b'-5', b'0x5', b'5_0', b'5 5', b'5.0', b'',
+                      b'\xb2', b'1, 1'):
+            with self.assertRaises(BadRequest, msg=value):
+                self.parse(b'Content-Length: ' + value, b'hello')
+
+
 if __name__ == '__main__':
     unittest.main()
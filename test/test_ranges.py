@@ -0,0 +1,37 @@
+import unittest
+
+from boring.ranges import MultipartRanges, parse_range, select_ranges
+
+
+class TestRanges(unittest.TestCase):
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-9', 100), [(0, 9)])
+        self.assertEqual(parse_range('bytes=90-', 100), [(90, 99)])
+        self.assertEqual(parse_range('bytes=-10', 100), [(90, 99)])
+        self.assertEqual(parse_range('bytes=50-200', 100), [(50, 99)])
+        # overlapping and adjacent ranges are merged
+        self.assertEqual(parse_range('bytes=20-29,0-9,10-15,25-40', 100),
+                         [(0, 15), (20, 40)])
+        self.assertEqual(parse_range('bytes=100-', 100), [])
+        self.assertIsNone(parse_range('bytes=9-0', 100))
+        self.assertIsNone(parse_range('items=0-9', 100))
+        self.assertIsNone(parse_range('bytes=a-b', 100))
+
+    def test_if_range(self):
+        self.assertEqual(select_ranges('bytes=0-9', '"abc"', 100, '"abc"'),
+                         [(0, 9)])
+        self.assertIsNone(select_ranges('bytes=0-9', '"abc"', 100, '"xyz"'))
+        self.assertIsNone(select_ranges('bytes=0-9', '"abc"', 100, 'W/"abc"'))
+        date = 'Sun, 18 Oct 26 17:11:05 GMT'
+        self.assertEqual(select_ranges('bytes=0-9', date, 100, None, date),
+                         [(0, 9)])
+        self.assertIsNone(select_ranges(None, None, 100))
+
+    def test_multipart(self):
+        content = bytes(range(100))
+        body = MultipartRanges(content, [(0, 1), (10, 12)], 100, 'text/plain')
+        data = b''.join(body)
+        self.assertEqual(len(data), body.length)
+        self.assertIn(b'Content-Range: bytes 10-12/100\r\n\r\n\n\x0b\x0c\r\n',
+                      data)
+        self.assertTrue(data.endswith(b'--%s--\r\n' % body.boundary.encode()))
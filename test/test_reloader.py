@@ -0,0 +1,41 @@
+import sys
+import types
+import unittest
+from unittest import mock
+
+from boring import reloader
+
+PATHS = {
+    'stdlib': '/usr/lib/python3.11',
+    'platstdlib': '/usr/lib/python3.11',
+    'purelib': '/usr/lib/python3.11/site-packages',
+    'platlib': '/usr/lib/python3.11/site-packages',
+}
+
+
+class TestModuleFiles(unittest.TestCase):
+    def module_files(self, *paths):
+        modules = {'fake_%s' % i: types.SimpleNamespace(__file__=path)
+                   for i, path in enumerate(paths)}
+        with mock.patch.dict(sys.modules, modules), \
+                mock.patch('sysconfig.get_paths', return_value=PATHS), \
+                mock.patch('site.getsitepackages',
+                           return_value=['/venv/lib/python3.11/site-packages']):
+            return [path for path in reloader.module_files()
+                    if path in paths]
+
+    def test_stdlib(self):
+        self.assertEqual(self.module_files('/usr/lib/python3.11/os.py',
+                                           '/usr/lib/python3.11/json/x.py'),
+                         [])
+
+    def test_packages(self):
+        paths = ['/usr/lib/python3.11/site-packages/app/views.py',
+                 '/venv/lib/python3.11/site-packages/pkg/__init__.py',
+                 '/usr/lib/python3.11-src/app.py',
+                 '/home/dev/project/app.py']
+        self.assertEqual(self.module_files(*paths), paths)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,411 @@
+import os
+import selectors
+import socket
+import tempfile
+import threading
+import types
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from boring.http import FileWrapper, Response, ThreadedResponse
+from boring.server import Server
+
+
+class ShortWriteSocket:
+    ''' non-blocking socket that takes at most `limit` bytes per call
+        and raises BlockingIOError on every `block`th call.
+    '''
+    def __init__(self, limit, block=3):
+        self.limit = limit
+        self.block = block
+        self.calls = 0
+        self.data = bytearray()
+        # number of buffers passed to each sendmsg()
+        self.iov = []
+
+    def take(self, buffers):
+        self.calls += 1
+        if self.calls % self.block == 0:
+            raise BlockingIOError
+        data = b''.join(bytes(buf) for buf in buffers)[:self.limit]
+        self.data += data
+        return len(data)
+
+    def send(self, data):
+        return self.take([data])
+
+    def sendmsg(self, buffers):
+        self.iov.append(len(buffers))
+        return self.take(buffers)
+
+    def gettimeout(self):
+        return 0.0
+
+
+def get_response(conn, **kw):
+    req = types.SimpleNamespace(keep_alive=True, proto='HTTP/1.1')
+    return Response(req, conn, **kw)
+
+
+class TestFlush(unittest.TestCase):
+    pieces = [b'HTTP/1.1 200 OK\r\n', b'a' * 10, memoryview(b'bcdefg'), b'h',
+              bytearray(b'ijklmnopqrstuvwxyz'), b'0' * 33]
+
+    def test_short_writes(self):
+        expected = b''.join(bytes(p) for p in self.pieces)
+        for limit in (1, 2, 5, 7, 16, 1000):
+            conn = ShortWriteSocket(limit)
+            resp = get_response(conn)
+            for piece in self.pieces:
+                resp.write(piece)
+            blocked = 0
+            for _ in range(10000):
+                if resp.flush():
+                    break
+                blocked += 1
+            else:
+                self.fail('flush() never finished')
+            self.assertEqual(bytes(conn.data), expected, limit)
+            self.assertEqual(resp.out_size, 0)
+            self.assertEqual(resp.bytes_sent, len(expected))
+            self.assertFalse(resp.out)
+            # several pieces go out in one call
+            self.assertGreater(max(conn.iov), 1)
+            if limit < len(expected):
+                self.assertTrue(blocked)
+
+
+class WindowSocket(ShortWriteSocket):
+    ''' takes data till `window` bytes are waiting to be read by the
+        client, then raises BlockingIOError till read() is called.
+    '''
+    def __init__(self, window):
+        super().__init__(limit=window, block=0)
+        self.window = window
+        self.read_pos = 0
+
+    def take(self, buffers):
+        self.calls += 1
+        room = self.window - (len(self.data) - self.read_pos)
+        if room <= 0:
+            raise BlockingIOError
+        data = b''.join(bytes(buf) for buf in buffers)[:room]
+        self.data += data
+        return len(data)
+
+    def read(self):
+        self.read_pos = len(self.data)
+
+
+class TestPump(unittest.TestCase):
+    CHUNK = b'x' * 10
+
+    def app(self, count):
+        for _ in range(count):
+            self.pulled += 1
+            yield self.CHUNK
+
+    def start(self, conn, count, high_water):
+        self.pulled = 0
+        resp = get_response(conn, high_water=high_water)
+        resp.start_response('200 OK', [('Content-Length',
+                                         str(count * len(self.CHUNK)))])
+        resp.write_response(self.app(count))
+        return resp
+
+    def test_over_high_water(self):
+        conn = WindowSocket(window=300)
+        resp = self.start(conn, count=100, high_water=50)
+        self.assertFalse(resp.finished)
+        # the app is not pulled once the buffer is over the high water
+        # mark, what doesn't fit in the socket waits in the buffer
+        self.assertGreater(resp.out_size, 0)
+        self.assertLess(resp.out_size, 50 + len(self.CHUNK))
+        # the socket window plus the buffer, not the whole body
+        self.assertLess(self.pulled * len(self.CHUNK),
+                        300 + 50 + len(self.CHUNK))
+        head = bytes(conn.data).index(b'\r\n\r\n') + 4
+        self.assertEqual(len(conn.data) - head + resp.out_size,
+                         self.pulled * len(self.CHUNK))
+        # still EAGAIN, the buffer stays under the high water mark
+        self.assertFalse(resp.pump())
+        self.assertFalse(resp.finished)
+        self.assertLess(resp.out_size, 50 + len(self.CHUNK))
+        while not resp.pump():
+            conn.read()
+            self.assertLessEqual(resp.out_size, 50 + len(self.CHUNK))
+        self.assertTrue(resp.finished)
+        self.assertEqual(self.pulled, 100)
+        self.assertTrue(bytes(conn.data).endswith(b'\r\n\r\n' +
+                                                  self.CHUNK * 100))
+
+    def test_stream(self):
+        conn = WindowSocket(window=65536)
+        on_wire = []
+
+        def app():
+            yield b'first'
+            # the app is waiting for the next event, the client
+            # already has the first one
+            on_wire.append(bytes(conn.data))
+            yield b'second'
+
+        resp = get_response(conn)
+        resp.start_response('200 OK', [])
+        resp.write_response(app())
+        self.assertTrue(resp.finished)
+        self.assertTrue(on_wire[0].endswith(b'\r\n\r\n5\r\nfirst\r\n'))
+        # the headers and the framed chunk go out in one call
+        self.assertEqual(conn.iov[0], 4)
+        self.assertTrue(bytes(conn.data).endswith(
+            b'6\r\nsecond\r\n0\r\n\r\n'))
+
+    def test_list(self):
+        conn = WindowSocket(window=65536)
+        resp = get_response(conn)
+        resp.start_response('200 OK', [('Content-Length', '6')])
+        resp.write_response([b'a', b'bc', b'def'])
+        self.assertTrue(resp.finished)
+        # everything is in memory already, one write
+        self.assertEqual(conn.iov, [4])
+        self.assertTrue(bytes(conn.data).endswith(b'\r\n\r\nabcdef'))
+
+    def test_under_high_water(self):
+        conn = WindowSocket(window=65536)
+        resp = self.start(conn, count=5, high_water=1024)
+        self.assertTrue(resp.finished)
+        self.assertEqual(resp.out_size, 0)
+        self.assertTrue(bytes(conn.data).endswith(b'\r\n\r\n' +
+                                                  self.CHUNK * 5))
+
+
+class TestSendfile(unittest.TestCase):
+    def setUp(self):
+        self.conn, self.client = socket.socketpair()
+        self.addCleanup(self.conn.close)
+        self.addCleanup(self.client.close)
+        self.conn.setblocking(False)
+        self.file = tempfile.TemporaryFile()
+        self.addCleanup(self.file.close)
+        self.data = os.urandom(100000)
+        self.file.write(self.data)
+        self.file.seek(0)
+
+    def send(self, length, **kw):
+        resp = get_response(self.conn, **kw)
+        resp.start_response('200 OK', [('Content-Length', str(length))])
+        received = bytearray()
+        with mock.patch('os.sendfile', wraps=os.sendfile) as sendfile:
+            resp.write_response(FileWrapper(self.file))
+            while not resp.pump():
+                received += self.client.recv(65536)
+        self.conn.close()
+        while 1:
+            data = self.client.recv(65536)
+            if not data:
+                break
+            received += data
+        head, _, body = bytes(received).partition(b'\r\n\r\n')
+        return resp, sendfile, head, body
+
+    def test_sendfile(self):
+        resp, sendfile, head, body = self.send(len(self.data))
+        self.assertTrue(sendfile.called)
+        self.assertEqual(body, self.data)
+        self.assertEqual(resp.sent, len(self.data))
+        self.assertEqual(resp.bytes_sent, len(head) + 4 + len(self.data))
+
+    def test_content_length(self):
+        # a shorter content-length is respected
+        resp, sendfile, _, body = self.send(60000)
+        self.assertTrue(sendfile.called)
+        self.assertEqual(body, self.data[:60000])
+        self.assertEqual(resp.sent, 60000)
+
+    def test_small_file(self):
+        # read and sent with the headers
+        resp, sendfile, _, body = self.send(1000, coalesce_size=16384)
+        self.assertFalse(sendfile.called)
+        self.assertEqual(body, self.data[:1000])
+        self.assertEqual(resp.sent, 1000)
+
+
+class TestThreadedResponse(unittest.TestCase):
+    CHUNK = b'x' * 10
+
+    def setUp(self):
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.pool.shutdown)
+        self.pulled = 0
+        self.woken = 0
+
+    def notify(self):
+        self.woken += 1
+
+    def drain(self):
+        ''' wait for the pull in the pool thread and its callback '''
+        self.pool.submit(lambda: None).result()
+
+    def app(self, count):
+        for _ in range(count):
+            self.pulled += 1
+            yield self.CHUNK
+
+    def start(self, conn, app, length=None):
+        req = types.SimpleNamespace(keep_alive=True, proto='HTTP/1.1')
+        resp = ThreadedResponse(req, conn, self.pool, self.notify,
+                                high_water=50)
+        headers = []
+        if length is not None:
+            headers.append(('Content-Length', str(length)))
+        resp.start_response('200 OK', headers)
+        # like Server.submit
+        future = self.pool.submit(resp.write_response, app)
+        future.add_done_callback(resp.task_done)
+        self.drain()
+        return resp
+
+    def test_slow_reader(self):
+        conn = WindowSocket(window=300)
+        resp = self.start(conn, self.app(100), length=1000)
+        # the pool thread stops at the high water mark and
+        # doesn't touch the socket
+        self.assertFalse(resp.pulling)
+        self.assertTrue(resp.producing)
+        self.assertLess(self.pulled * len(self.CHUNK), 50 + len(self.CHUNK))
+        self.assertEqual(conn.data, b'')
+        self.assertTrue(self.woken)
+        for _ in range(10000):
+            if resp.pump():
+                break
+            self.drain()
+            # the socket is full, the buffer stays under the high water mark
+            self.assertLess(resp.out_size, 50 + len(self.CHUNK))
+            conn.read()
+        else:
+            self.fail('pump() never finished')
+        self.assertEqual(self.pulled, 100)
+        self.assertTrue(bytes(conn.data).endswith(b'\r\n\r\n' +
+                                                  self.CHUNK * 100))
+        self.assertTrue(resp.keep_alive)
+
+    def test_app_error(self):
+        def app():
+            yield self.CHUNK
+            raise ValueError('broken app')
+
+        conn = WindowSocket(window=65536)
+        resp = self.start(conn, app())
+        while not resp.pump():
+            self.drain()
+        self.assertFalse(resp.producing)
+        self.assertTrue(bytes(conn.data).endswith(b'\r\n\r\n' + b'a\r\n' +
+                                                  self.CHUNK + b'\r\n'))
+        # the response is cut, the connection is closed
+        self.assertFalse(resp.keep_alive)
+
+    def test_close_while_pulling(self):
+        pulling = threading.Event()
+        release = threading.Event()
+        closed = []
+
+        def app():
+            try:
+                yield self.CHUNK
+                pulling.set()
+                release.wait(5)
+                yield self.CHUNK
+            finally:
+                closed.append(threading.current_thread())
+
+        conn = WindowSocket(window=65536)
+        req = types.SimpleNamespace(keep_alive=True, proto='HTTP/1.1')
+        resp = ThreadedResponse(req, conn, self.pool, self.notify)
+        resp.start_response('200 OK', [])
+        future = self.pool.submit(resp.write_response, app())
+        future.add_done_callback(resp.task_done)
+        self.assertTrue(pulling.wait(5))
+        # the client went away
+        resp.close()
+        self.assertTrue(resp.aborted)
+        self.assertEqual(closed, [])
+        release.set()
+        self.drain()
+        self.assertFalse(resp.producing)
+        # closed by the pool thread that was in it
+        self.assertEqual(len(closed), 1)
+        self.assertIsNot(closed[0], threading.current_thread())
+
+
+class FakeHandler:
+    def __init__(self, conn, results):
+        self.conn = conn
+        # values returned by pump(), the last one is the end
+        self.results = list(results)
+        self.resp = types.SimpleNamespace(finished=not results,
+                                          pump=self.pump)
+        self.broken = False
+        self.finished = 0
+
+    def pump(self):
+        done = self.results.pop(0)
+        self.resp.finished = done
+        return done
+
+    def finish(self):
+        self.finished += 1
+
+
+class TestServerWrite(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.conn, self.client = socket.socketpair()
+        self.server.sel.register(self.conn, selectors.EVENT_READ)
+
+    def tearDown(self):
+        self.server.sel.close()
+        self.conn.close()
+        self.client.close()
+
+    def test_finished(self):
+        handler = FakeHandler(self.conn, [])
+        self.server.finish_response(handler)
+        self.assertEqual(handler.finished, 1)
+        key = self.server.sel.get_key(self.conn)
+        self.assertEqual(key.events, selectors.EVENT_READ)
+
+    def test_wait_writable(self):
+        handler = FakeHandler(self.conn, [False, True])
+        self.server.finish_response(handler)
+        key = self.server.sel.get_key(self.conn)
+        self.assertEqual(key.events, selectors.EVENT_WRITE)
+        self.assertIs(key.data, handler)
+        self.assertEqual(self.server._active_conns[self.conn][0], 'write')
+        # still EAGAIN
+        self.server.handle_write(self.conn, handler)
+        self.assertEqual(handler.finished, 0)
+        self.assertEqual(self.server._active_conns[self.conn][0], 'write')
+        self.server.handle_write(self.conn, handler)
+        self.assertEqual(handler.finished, 1)
+        self.assertNotIn(self.conn, self.server._active_conns)
+
+    def test_wait_app(self):
+        handler = FakeHandler(self.conn, [False])
+        # the app in the thread pool has nothing for the loop yet
+        handler.resp.idle = True
+        self.server.finish_response(handler)
+        with self.assertRaises(KeyError):
+            self.server.sel.get_key(self.conn)
+        self.assertNotIn(self.conn, self.server._active_conns)
+        # woken up with data to write
+        handler.resp.idle = False
+        handler.results = [False]
+        self.server.handle_write(self.conn, handler)
+        key = self.server.sel.get_key(self.conn)
+        self.assertEqual(key.events, selectors.EVENT_WRITE)
+        self.assertEqual(self.server._active_conns[self.conn][0], 'write')
+
+
+if __name__ == '__main__':
+    unittest.main()
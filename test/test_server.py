@@ -0,0 +1,172 @@
+import os
+import selectors
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from boring.config import Config
+from boring.server import Server, systemd_fds
+
+
+def init_server(argv, **kw):
+    server = Server(**kw)
+    with mock.patch.object(sys, 'argv', ['boring'] + argv), \
+            mock.patch.object(Server, 'init_signals'):
+        server.init()
+    return server
+
+
+class TestInit(unittest.TestCase):
+    def test_config_kept(self):
+        config = Config(None)
+        config['WORKERS'] = '4'
+        config['BACKLOG'] = '16'
+        server = init_server(['.', '--backlog', '32', '--accept-batch', '8'],
+                             config=config)
+        self.assertIs(server.config, config)
+        self.assertEqual(server.config.get('WORKERS', 1, int), 4)
+        # set in the config, then the command line
+        self.assertEqual(server.backlog, 16)
+        self.assertEqual(server.accept_batch, 8)
+
+    def test_no_config(self):
+        server = init_server(['.', '--workers', '2'])
+        self.assertIsInstance(server.config, Config)
+        self.assertEqual(server.config.get('WORKERS', 1, int), 2)
+
+
+class TestRestart(unittest.TestCase):
+    def test_start_generation_fails(self):
+        server = init_server(['.'])
+        sock = socket.socket()
+        self.addCleanup(sock.close)
+        sock.bind(('127.0.0.1', 0))
+        sock.listen()
+        server.listeners[sock] = 'http'
+        server.sel.register(sock, selectors.EVENT_READ)
+        server.graceful_stop(restart=True)
+        error = OSError(12, 'Cannot allocate memory')
+        with mock.patch('boring.server.start_generation',
+                        side_effect=error), \
+                mock.patch('builtins.print') as log:
+            server.start_drain()
+        log.assert_called_once_with(
+            '[ERROR] could not start a new generation:', error)
+        # still serving on the same socket
+        self.assertFalse(server.draining)
+        self.assertFalse(server.drain_started)
+        self.assertIn(sock, server.listeners)
+        self.assertNotEqual(sock.fileno(), -1)
+        self.assertTrue(server.sel.get_key(sock))
+
+
+def hello(environ, start_response):
+    start_response('200 OK', [('Content-Length', '5')])
+    return [b'hello']
+
+
+def get(sock):
+    sock.settimeout(5)
+    sock.sendall(b'GET / HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n')
+    data = b''
+    while 1:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return data
+        data += chunk
+
+
+class ListenerTest(unittest.TestCase):
+    def serve(self, server):
+        ''' run the loop of `server` in a thread with the hello app '''
+        server.module = None
+        server.app = hello
+        with mock.patch('builtins.print'):
+            server.init_socket()
+        thread = threading.Thread(target=server.loop, daemon=True)
+        thread.start()
+        while server._wakeup is None:
+            time.sleep(0.01)
+
+        def stop():
+            server.graceful_stop()
+            thread.join(5)
+        self.addCleanup(stop)
+
+
+class TestAccept(unittest.TestCase):
+    def test_batch(self):
+        server = init_server(['.', '--accept-batch', '2', '--backlog', '8'])
+        self.assertEqual(server.backlog, 8)
+        sock = socket.socket()
+        self.addCleanup(sock.close)
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(server.backlog)
+        sock.setblocking(False)
+        server.listeners[sock] = 'http'
+        clients = [socket.create_connection(sock.getsockname())
+                   for _ in range(3)]
+        for client in clients:
+            self.addCleanup(client.close)
+        self.assertEqual(server.handle_connection(sock), 2)
+        self.assertEqual(server.handle_connection(sock), 1)
+        self.assertEqual(server.handle_connection(sock), 0)
+        self.assertEqual(len(server.connections), 3)
+        for conn in server.connections:
+            conn.close()
+
+
+class TestUnixSocket(ListenerTest):
+    def test_round_trip(self):
+        path = os.path.join(tempfile.mkdtemp(), 'boring.sock')
+        server = init_server(['.', '--unix-socket', path])
+        self.serve(server)
+        self.assertEqual(list(server.listeners.values()), ['http'])
+        client = socket.socket(socket.AF_UNIX)
+        self.addCleanup(client.close)
+        client.connect(path)
+        response = get(client)
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 OK'))
+        self.assertTrue(response.endswith(b'\r\n\r\nhello'))
+
+
+class TestSystemd(ListenerTest):
+    def test_listen_fds(self):
+        env = {'LISTEN_PID': str(os.getpid()), 'LISTEN_FDS': '2',
+               'LISTEN_FDNAMES': 'http:https'}
+        with mock.patch.dict(os.environ, env):
+            self.assertEqual(systemd_fds(), [3, 4])
+            # left out of the environment of the processes started
+            for name in env:
+                self.assertNotIn(name, os.environ)
+
+    def test_other_pid(self):
+        env = {'LISTEN_PID': str(os.getpid() + 1), 'LISTEN_FDS': '1'}
+        with mock.patch.dict(os.environ, env):
+            self.assertEqual(systemd_fds(), [])
+
+    def test_serve(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen()
+        # the fd systemd would pass
+        fd = sock.detach()
+        env = {'LISTEN_PID': str(os.getpid()), 'LISTEN_FDS': '1'}
+        with mock.patch.dict(os.environ, env), \
+                mock.patch('boring.server.systemd_fds', return_value=[fd]):
+            server = init_server(['.', '--port', '0'])
+        self.assertEqual(server.systemd_fds, [fd])
+        self.serve(server)
+        listener, = server.listeners
+        self.assertEqual(listener.fileno(), fd)
+        client = socket.create_connection(listener.getsockname())
+        self.addCleanup(client.close)
+        self.assertTrue(get(client).endswith(b'hello'))
+
+
+if __name__ == '__main__':
+    unittest.main()
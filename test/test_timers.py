@@ -0,0 +1,84 @@
+import unittest
+from unittest import mock
+
+from boring.timers import TimerQueue
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTimerQueue(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('boring.timers.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.timers = TimerQueue()
+        self.calls = []
+
+    def add(self, delay, name):
+        return self.timers.call_later(delay, self.calls.append, name)
+
+    def test_order(self):
+        self.assertIsNone(self.timers.next_timeout())
+        self.add(5, 'c')
+        self.add(1, 'a')
+        self.add(3, 'b')
+        # same deadline, called in the order they were added
+        self.add(3, 'b2')
+        self.assertEqual(self.timers.next_timeout(), 1)
+        self.clock.now += 3
+        self.assertEqual(self.timers.next_timeout(), 0)
+        self.timers.run()
+        self.assertEqual(self.calls, ['a', 'b', 'b2'])
+        self.assertEqual(self.timers.next_timeout(), 2)
+        self.assertEqual(len(self.timers), 1)
+
+    def test_cancel(self):
+        first = self.add(1, 'a')
+        self.add(2, 'b')
+        self.timers.cancel(first)
+        # cancelling twice is counted once
+        self.timers.cancel(first)
+        self.assertEqual(len(self.timers), 1)
+        # a cancelled timer at the top doesn't decide the timeout
+        self.assertEqual(self.timers.next_timeout(), 2)
+        self.clock.now += 2
+        self.timers.run()
+        self.assertEqual(self.calls, ['b'])
+        self.assertEqual(len(self.timers), 0)
+        self.assertIsNone(self.timers.next_timeout())
+
+    def test_cancel_after_run(self):
+        timer = self.add(1, 'a')
+        self.clock.now += 1
+        self.timers.run()
+        self.timers.cancel(timer)
+        self.assertEqual(self.timers._cancelled, 0)
+        self.assertEqual(len(self.timers), 0)
+
+    def test_compact(self):
+        size = TimerQueue.COMPACT_SIZE
+        timers = [self.add(10 + i, i) for i in range(size * 2)]
+        for timer in timers[:size]:
+            self.timers.cancel(timer)
+        # not more than half of the heap yet, kept lazily
+        self.assertEqual(len(self.timers._heap), size * 2)
+        self.timers.cancel(timers[-1])
+        # rebuilt without the cancelled timers
+        self.assertEqual(len(self.timers._heap), size - 1)
+        self.assertEqual(self.timers._cancelled, 0)
+        self.assertEqual(len(self.timers), size - 1)
+        self.assertEqual(self.timers.next_timeout(), 10 + size)
+        self.clock.now += 10 + size * 2
+        self.timers.run()
+        self.assertEqual(self.calls, list(range(size, size * 2 - 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
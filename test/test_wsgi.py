@@ -2,6 +2,7 @@ import socket
 import unittest
 
 from boring.http import HTTPParser, Request
+from boring.server import Server
 from boring.wsgi import WsgiApp
 
 
@@ -39,4 +40,69 @@ class ParserTest(unittest.TestCase):
         addr = ('localhost', 67712)  # remote addr
         parse = HTTPParser(conn, FakeServer(), addr)
         request = Request(parse())
-        return request
\ No newline at end of file
+        return request
+
+    def test_environ(self):
+        server = Server()
+        server.multithread = True
+        app = WsgiApp(None, self.get_request(), FakeSocket(), server=server)
+        environ = app.wsgi_headers()
+        self.assertEqual(environ['REQUEST_METHOD'], 'POST')
+        self.assertEqual(environ['PATH_INFO'], '/user/login/')
+        self.assertEqual(environ['CONTENT_LENGTH'], '12')
+        self.assertEqual(environ['HTTP_USER_AGENT'], 'chrome')
+        self.assertTrue(environ['wsgi.multithread'])
+        self.assertEqual(environ['wsgi.input'].read(), b'this is body')
+        # the template is shared, not the environ
+        environ['HTTP_X'] = '1'
+        self.assertNotIn('HTTP_X', app.wsgi_headers())
+        self.assertIs(app.environ_template(), server.environ_template)
+
+
+def unread(environ, start_response):
+    start_response('200 OK', [('Content-Length', '2')])
+    return [b'ok']
+
+
+class TestStreamBody(unittest.TestCase):
+    ''' a streamed body the app doesn't read is skipped when it is
+        small, a bigger one closes the connection.
+    '''
+    def setUp(self):
+        self.server = Server()
+        self.conn, self.client = socket.socketpair()
+        self.client.settimeout(5)
+
+    def tearDown(self):
+        self.server.sel.close()
+        self.conn.close()
+        self.client.close()
+
+    def serve(self, length, sent):
+        self.client.sendall(b'POST / HTTP/1.1\r\nContent-Length: %d\r\n\r\n'
+                            % length + b'x' * sent)
+        parser = HTTPParser(self.conn, self.server, ('127.0.0.1', 5000),
+                            stream=True)()
+        app = WsgiApp(unread, Request(parser), self.conn, self.server.log,
+                      self.server)
+        app.execute()
+        self.assertTrue(app.resp.finished)
+        head = self.client.recv(65536)
+        app.finish()
+        return head
+
+    def test_skip(self):
+        head = self.serve(1000, 100)
+        self.assertNotIn(b'Connection: close', head)
+        # the rest of the body, then the next request
+        self.client.sendall(b'x' * 900 + b'GET /next HTTP/1.1\r\n\r\n')
+        parser = self.server.sel.get_key(self.conn).data
+        while not parser.begin:
+            parser()
+            self.assertTrue(parser.is_alive)
+        self.assertEqual(Request(parser).path, '/next')
+
+    def test_close(self):
+        head = self.serve(10 ** 6, 100)
+        self.assertIn(b'Connection: close', head)
+        self.assertTrue(self.conn._closed)